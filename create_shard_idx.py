@@ -2,24 +2,38 @@
 Currently randomly generate embeddings and create indexes. 
 
 Generate shard index for the given dataset, if dataset not provided, generate random embeddings
+
+Shards are built by a process pool (-j), every worker generates, trains and writes one shard at a time (only the
+shards in flight are in memory). Shard i is seeded from (seed, i), the result does not depend on the pool size.
+--resume skips the shards whose index is already written, and refuses to resume a build started with other args
+(idx_root/build_manifest.json).
 '''
 
 import os
 import time
 import faiss
 import argparse
+import multiprocessing
 import numpy as np
 
-from utils.read_write import save_np_to_file, load_npy
-from utils.vdb_utils import random_normal_vectors, save_index, random_floats, random_mv_normal_vectors
+from utils.read_write import save_np_to_file, load_npy, save_json_to_file, load_json
+from utils.vdb_utils import save_index, read_index, index_kind
+from utils.centroid_router import build_router_index
+from utils.shard_catalog import ShardCatalog
 
 # fix random seed
 # np.random.seed(0)
 
+# build args of the shards, checked by --resume
+MANIFEST_FILE = "build_manifest.json"
+IVF_NLIST = 100
+
 def create_ivf_index(npy_path):
     # load npy file
-    data = load_npy(npy_path)
-    nlist = 100
+    return train_ivf_index(load_npy(npy_path))
+
+def train_ivf_index(data):
+    nlist = IVF_NLIST
     # print(data.shape)
     d = data.shape[1]
     quantizer = faiss.IndexFlatL2(d)  # the other index
@@ -42,6 +56,117 @@ def create_flat_index(npy_path):
 def compute_embeds_avgs(embeds):
     return np.mean(embeds, axis=0)
 
+def compute_embeds_radius(embeds, centroid):
+    # max distance to the centroid, bounds the distance of a query to any vector of the shard (Dispatcher.lower_bounds)
+    return np.sqrt(((embeds - centroid) ** 2).sum(axis=1).max())
+
+def compute_radii(npy_root, embeds_centroids):
+    # radii of the existing npy shards, shard i is embeds_{i}.npy
+    radii = np.zeros(len(embeds_centroids))
+    for i in range(len(embeds_centroids)):
+        radii[i] = compute_embeds_radius(load_npy(os.path.join(npy_root, f"embeds_{i}.npy")), embeds_centroids[i])
+    return radii
+
+def generate_shard_embeds(cluster_size, dim, seed, shard_id):
+    # shard i ~ N(mean_i, 0.5), mean_i ~ U(-1, 1), own generator per shard (independent of the build order)
+    rng = np.random.default_rng([seed, shard_id])
+    random_mean = rng.uniform(-1, 1)
+    random_std = 0.5
+    return rng.standard_normal((cluster_size, dim), dtype=np.float32) * np.float32(random_std) + np.float32(random_mean)
+
+def build_shard(task):
+    '''
+    Generate, train and write shard i (process pool worker)
+
+    args:
+        - task: (i, npy_root, index_root, cluster_size, dim, seed, resume)
+    return:
+        - i, catalog entry, centroid, radius, resumed
+    '''
+    i, npy_root, index_root, cluster_size, dim, seed, resume = task
+    npy_path = os.path.join(npy_root, f"embeds_{i}.npy")
+    index_path = os.path.join(index_root, f"embeds_{i}.index")
+    resumed = resume and os.path.exists(index_path) and os.path.exists(npy_path)
+    if resumed:
+        # the index is renamed into place after its npy is written, both are complete
+        embeds = load_npy(npy_path)
+        index = read_index(index_path, mmap=True)
+    else:
+        embeds = generate_shard_embeds(cluster_size, dim, seed, i)
+        save_np_to_file(npy_path, embeds)
+        index = train_ivf_index(embeds)
+        save_index(index, index_path + ".tmp")
+        os.replace(index_path + ".tmp", index_path)
+    centroid = compute_embeds_avgs(embeds)
+    shard = {"id": i, "path": f"embeds_{i}.index", "num_vectors": int(index.ntotal), "nbytes": os.path.getsize(index_path),
+             "index_type": index_kind(index)}
+    return i, shard, centroid, compute_embeds_radius(embeds, centroid), resumed
+
+def build_manifest(num_shards, cluster_size, dim, seed):
+    # everything the shard files depend on, a resumed build must match the partial one
+    return {"num_shards": num_shards, "cluster_size": cluster_size, "dim": dim, "seed": seed,
+            "index": {"type": "IVFFlat", "nlist": IVF_NLIST, "metric": "L2"}}
+
+def check_resume(index_root, manifest):
+    '''
+    Raise ValueError if the partial build of index_root was started with other build args (or cannot be checked)
+    '''
+    manifest_path = os.path.join(index_root, MANIFEST_FILE)
+    if not os.path.exists(manifest_path):
+        built = [f for f in os.listdir(index_root) if f.startswith("embeds_") and f.endswith(".index") and f != "embeds_centroids.index"]
+        if len(built) > 0:
+            raise ValueError(f"no {MANIFEST_FILE} in {index_root}, cannot check the args of its {len(built)} shards, rebuild without --resume")
+        return
+    saved = load_json(manifest_path)
+    mismatch = {key: {"partial build": saved.get(key), "requested": value} for key, value in manifest.items() if saved.get(key) != value}
+    if len(mismatch) > 0:
+        raise ValueError(f"cannot resume the build of {index_root}, build args differ: {mismatch}")
+
+def build_shards(npy_root, index_root, num_shards, cluster_size, dim, seed=0, num_procs=1, resume=False, verbose=True):
+    '''
+    Build shards 0..num_shards-1 (npy + IVF index), num_procs at a time
+
+    return:
+        - shards: catalog entries ordered by shard id
+        - embeds_centroids, embeds_radii: (num_shards, dim) and (num_shards,)
+        - num_resumed: shards already written (resume)
+    '''
+    # written before any shard, a later --resume checks its args against it
+    manifest = build_manifest(num_shards, cluster_size, dim, seed)
+    if resume:
+        check_resume(index_root, manifest)
+    save_json_to_file(os.path.join(index_root, MANIFEST_FILE), manifest)
+
+    tasks = [(i, npy_root, index_root, cluster_size, dim, seed, resume) for i in range(num_shards)]
+    shards = [None] * num_shards
+    embeds_centroids = np.zeros((num_shards, dim))
+    embeds_radii = np.zeros(num_shards)
+    num_resumed = 0
+
+    pool = None
+    if num_procs > 1:
+        # spawn: workers never inherit faiss / OpenMP state, one OMP thread each (parallel across shards)
+        pool = multiprocessing.get_context("spawn").Pool(num_procs, initializer=faiss.omp_set_num_threads, initargs=(1,))
+    try:
+        results = map(build_shard, tasks) if pool is None else pool.imap_unordered(build_shard, tasks)
+        for i, shard, centroid, radius, resumed in results:
+            shards[i] = shard
+            embeds_centroids[i] = centroid
+            embeds_radii[i] = radius
+            num_resumed += resumed
+            if verbose:
+                print(f"embeds_{i}.index {'resumed' if resumed else 'created'}")
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+    return shards, embeds_centroids, embeds_radii, num_resumed
+
+def create_centroid_index(npy_path, args):
+    # router over the shard centroids, pinned by the Dispatcher (see utils/centroid_router.py)
+    return build_router_index(load_npy(npy_path), kind=args.centroid_index, hnsw_m=args.hnsw_m, ef_search=args.hnsw_ef_search,
+                              nlist=args.centroid_nlist, ivf_nprobe=args.centroid_nprobe)
+
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Generate shard indics")
@@ -51,6 +176,19 @@ if __name__ == "__main__":
     parser.add_argument("-d", "--dim", default=128, help="dimension of embeddings", type=int,)
     parser.add_argument("-ns", "--num_shards", default=1000, help="number of shards", type=int,)
     parser.add_argument("--cluster_size", default=10000, help="number of embeddings per shard", type=int,)
+    parser.add_argument("--seed", default=0, help="random seed (shard i uses (seed, i))", type=int,)
+    # build pipeline
+    parser.add_argument("-j", "--num_procs", default=1, help="shards built in parallel (worker processes, 1: in this process)", type=int,)
+    parser.add_argument("--resume", action="store_true", help="skip the shards whose index is already written (same build args only)")
+    # centroid router
+    parser.add_argument("--centroid_index", default="flat", choices=["flat", "hnsw", "ivf"], help="index type of the centroid router")
+    parser.add_argument("--hnsw_m", default=32, help="hnsw: graph degree", type=int,)
+    parser.add_argument("--hnsw_ef_search", default=64, help="hnsw: search candidate list size (saved with the index)", type=int,)
+    parser.add_argument("--centroid_nlist", default=None, help="ivf: number of lists (default 4 * sqrt(num_shards))", type=int,)
+    parser.add_argument("--centroid_nprobe", default=16, help="ivf: lists scanned per query (saved with the index)", type=int,)
+    parser.add_argument("--centroids_only", action="store_true", help="only rebuild the centroid router from npy_root/embeds_centroids.npy")
+    parser.add_argument("--radii_only", action="store_true", help="only compute the shard radii (idx_root/embeds_radii.npy) from npy_root")
+    parser.add_argument("--catalog_only", action="store_true", help="only write the shard catalog of the existing indexes of idx_root")
     args = parser.parse_args()
 
     # args for random generation
@@ -65,35 +203,50 @@ if __name__ == "__main__":
     if not os.path.exists(index_root):
         os.makedirs(index_root)
 
-    # init empty npy arrays
-    embeds_centroids = np.zeros((num_shards, dim))
-    
-    # create npy files
-    for i in range(num_shards):
-        random_mean = random_floats(1, low=-1, high=1)
-        # random_std = random_floats(1)
-        # random_mean = [0]
-        random_std = [0.5]
-        embeds = random_normal_vectors(cluster_size, dim, random_mean[0], random_std[0])
-        embeds_centroids[i] = compute_embeds_avgs(embeds)
-        save_np_to_file(os.path.join(npy_root, f"embeds_{i}.npy"), embeds)
-        print(f"embeds_{i}.npy created")
+    if args.centroids_only:
+        index = create_centroid_index(os.path.join(npy_root, "embeds_centroids.npy"), args)
+        save_index(index, os.path.join(index_root, "embeds_centroids.index"))
+        print(f"Centroids index ({args.centroid_index}) created")
+        exit()
+
+    if args.radii_only:
+        radii = compute_radii(npy_root, load_npy(os.path.join(npy_root, "embeds_centroids.npy")))
+        save_np_to_file(os.path.join(index_root, "embeds_radii.npy"), radii)
+        catalog = ShardCatalog.load(index_root)
+        if catalog is not None:
+            catalog.radii = radii
+            catalog.save()
+        print(f"Radii of {len(radii)} shards created")
+        exit()
+
+    if args.catalog_only:
+        # probes every index, centroids from npy_root if present
+        centroids_path = os.path.join(npy_root, "embeds_centroids.npy")
+        centroids = load_npy(centroids_path) if os.path.exists(centroids_path) else None
+        catalog = ShardCatalog.scan(index_root, probe=True, centroids=centroids)
+        catalog.save()
+        print(f"Catalog of {len(catalog)} shards created")
+        exit()
+
+    start_time = time.perf_counter()
+    shards, embeds_centroids, embeds_radii, num_resumed = build_shards(npy_root, index_root, num_shards, cluster_size, dim,
+                                                                       seed=args.seed, num_procs=args.num_procs, resume=args.resume)
+    build_time = time.perf_counter() - start_time
 
     # save centroids
-    save_np_to_file(os.path.join(npy_root, f"embeds_centroids.npy"), embeds_centroids)
-
-    # create indexes
-    for npy_path in os.listdir(npy_root):
-        if "centroids" in npy_path: 
-            # create flat index for centroids
-            index = create_flat_index(os.path.join(npy_root, npy_path))
-            save_index(index, os.path.join(index_root, "embeds_centroids.index"))
-            print("Centroids index created")
-            continue
-        
-        print(npy_path)
-        index_prefix = npy_path.split(".")[0]
-        index = create_ivf_index(os.path.join(npy_root, npy_path))
-        save_index(index, os.path.join(index_root, f"{index_prefix}.index"))
-        print(f"{index_prefix}.index created")
-        
\ No newline at end of file
+    save_np_to_file(os.path.join(npy_root, "embeds_centroids.npy"), embeds_centroids)
+    # shard radii, next to the indexes (early termination)
+    save_np_to_file(os.path.join(index_root, "embeds_radii.npy"), embeds_radii)
+
+    # create the router index for centroids (flat, hnsw or ivf)
+    index = create_centroid_index(os.path.join(npy_root, "embeds_centroids.npy"), args)
+    save_index(index, os.path.join(index_root, "embeds_centroids.index"))
+    print(f"Centroids index ({args.centroid_index}) created")
+
+    # shard catalog: ids, sizes, centroids and radii known before any index is loaded
+    catalog = ShardCatalog(index_root, shards, centroid_index="embeds_centroids.index", centroids=embeds_centroids,
+                           radii=embeds_radii, dim=dim)
+    catalog.save()
+    print(f"Catalog of {len(catalog)} shards created")
+    print(f"{num_shards - num_resumed} shards built, {num_resumed} resumed in {build_time:.2f}s "
+          f"({num_shards / build_time:.2f} shards/s, {args.num_procs} procs)")
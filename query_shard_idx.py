@@ -13,26 +13,41 @@ import multiprocessing
 import numpy as np
 from pprint import pprint
 
-from utils.index_store import IndexStore, ThreadDataLoader, ProcessDataLoader
-from utils.dispatcher import Dispatcher
+from utils.index_store import IndexStore, ThreadDataLoaderPool
+from utils.dispatcher import Dispatcher, prune_ratio_arg
+from utils.shard_catalog import ShardCatalog
 from utils.index_manager import IndexManager
-from utils.vdb_utils import random_floats, random_normal_vectors, query_index_file, random_queries_mix_distribs
-from utils.search_by_topology import search_outterloop_index, search_outterloop_query, search_outterloop_index_async, query_to_index_stopology
+from utils.vdb_utils import random_queries_mix_distribs
+from utils.search_by_topology import search_outterloop_index, search_outterloop_query, search_outterloop_index_async
+from utils.search_by_topology import search_outterloop_query_batched, micro_batch_plans
+from utils.search_by_topology import search_outterloop_index_bounded
 
 
-faiss.omp_set_num_threads(3)
-
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Query shard index for vector database")
     parser.add_argument("-idx", "--idx_root", required=False, default="shards/idxs/", help="dir to index files", type=str,)
     parser.add_argument("-np", "--nprobe", default=10, help="a small number (nprobe) of subsets to visit", type=int,)
     parser.add_argument("-k", default=10, help="top k results", type=int,)
+    parser.add_argument("-pr", "--prune_ratio", default=None, help="adaptive nprobe: skip shards whose centroid distance > ratio x the nearest one (>= 1)", type=prune_ratio_arg,)
     parser.add_argument("-nq", "--num_query", default=10000, help="number of queries", type=int,)
     parser.add_argument("-mr", "--mixtures_ratio", default=0., help="mixtures ratio for random queries", type=float,)
     parser.add_argument("--log", required=False, default="logs/app.log", help="log file", type=str,)
     parser.add_argument("-mi", "--max_index_store", default=1000, help="max indexes to store", type=int,)
+    parser.add_argument("-rp", "--ranking_policy", required=False, default="LFU", help="LRU, LFU, ARC, 2Q or WTINYLFU (--evict rank)", type=str,
+                        choices=["LRU", "LFU", "ARC", "2Q", "WTINYLFU"],)
+    parser.add_argument("--evict", default="rank", choices=["rank", "topology"], 
+                        help="evict by the ranking policy, or the shard used farthest in the search topology (Belady within the batch)")
+    parser.add_argument("-mb", "--mem_budget_mb", default=None, help="memory budget (MB) for loaded indexes, evict by ranking to fit", type=float,)
     parser.add_argument("-st", "--search_topology", default="index_async", 
-                        help="search topology: <index>, <query> or <index_async>", type=str,)
+                        help="search topology: <index>, <query>, <query_batched>, <index_async> or <index_bounded>", type=str,)
+    parser.add_argument("--stream", action="store_true", help="index_async: emit every query as soon as its last shard is searched, report time to result")
+    parser.add_argument("--early_completion", action="store_true", help="index_async: order shards so queries complete early (see --stream)")
+    parser.add_argument("--completion_greedy", default=1024, help="early completion: shards ordered greedily (O(S^2)), the rest by score", type=int,)
+    parser.add_argument("-ub", "--micro_batch", default=256, help="queries per micro-batch (query_batched)", type=int,)
+    parser.add_argument("-omp", "--omp_threads", default=3, help="faiss OMP thread budget (split across search workers)", type=int,)
+    parser.add_argument("-sw", "--search_workers", default=1, help="number of shards searched concurrently (index_async)", type=int,)
+    parser.add_argument("-nl", "--num_loaders", default=4, help="number of concurrent index loader threads", type=int,)
+    parser.add_argument("--mmap", action="store_true", help="mmap IVF inverted lists instead of reading them into RAM")
     # hardcode args for now
     parser.add_argument("-d", "--dim", default=128, help="dimension of embeddings", type=int,)
     parser.add_argument("--seed", default=None, help="random seed", type=int,)
@@ -57,6 +72,11 @@ if __name__ == "__main__":
     max_index_store = args.max_index_store
     search_topology = args.search_topology
     seed = args.seed
+    omp_threads = args.omp_threads
+    search_workers = args.search_workers
+    num_loaders = args.num_loaders
+
+    faiss.omp_set_num_threads(omp_threads)
 
     if seed is not None:
         np.random.seed(seed)
@@ -73,13 +93,9 @@ if __name__ == "__main__":
     idx_k = k
     
     # idx_paths = [os.path.join(index_root, f) for f in os.listdir(index_root)]
-    idx_paths = []
-    centriod_idx_paths = ""
-    for f in os.listdir(index_root):
-        if "centroid" in f:
-            centriod_idx_paths = os.path.join(index_root, f)
-        else:
-            idx_paths.append(os.path.join(index_root, f))    
+    # shard ids from the catalog (create_shard_idx.py), or the directory listing without one
+    catalog = ShardCatalog.open(index_root)
+    idx_paths, centriod_idx_paths = catalog.paths, catalog.centroid_index_path
 
     # Generate random queries from normal distribution with mean 0 and std 1
     # random_mean = random_floats(1, low=-1, high=1)
@@ -87,10 +103,12 @@ if __name__ == "__main__":
     # queries = random_normal_vectors(num_queries, dim, random_mean[0], random_std[0], seed=seed)
     queries = random_queries_mix_distribs(num_queries, dim, mixtures_ratio=mixtures_ratio, low=-1, high=1, seed=seed)
 
-    index_manager = IndexManager()
-    index_store = IndexStore(max_indexes=max_index_store, index_manager=index_manager)
-    dispatcher = Dispatcher(centriod_idx_paths, index_store, verbose=args.verbose)
-    dispatcher.search_knn_centroids(queries, nprobe)
+    index_manager = IndexManager(policy=args.ranking_policy, capacity=max_index_store)
+    index_store = IndexStore(max_indexes=max_index_store, index_manager=index_manager, mmap=args.mmap, 
+                             mem_budget_mb=args.mem_budget_mb, evict_policy=args.evict, catalog=catalog)
+    dispatcher = Dispatcher(centriod_idx_paths, verbose=args.verbose, catalog=catalog)
+    dispatcher.search_knn_centroids(queries, nprobe, prune_ratio=args.prune_ratio)
+    print(f"Shard visits: {int((dispatcher.I >= 0).sum())} ({(dispatcher.I >= 0).sum(axis=1).mean():.2f} per query)")
 
     # inference
     start_time = time.perf_counter()
@@ -101,34 +119,85 @@ if __name__ == "__main__":
         plan_gen_time = time.perf_counter() - plan_gen_start
         print(f"Plan generation time: {plan_gen_time:.8f}s")
         # exit()
+        index_store.set_search_plan([idx_paths[idx] for idx in stopology.indices.tolist()])
         D_matrix, I_matrix, file_idx_matrix = search_outterloop_query(stopology, queries, idx_k, k, idx_paths, index_store)
+    elif "query_batched" == search_topology.lower():
+        plan_gen_start = time.perf_counter()
+        stopology = dispatcher.create_search_outterloop_query_topology(queries)
+        plan_gen_time = time.perf_counter() - plan_gen_start
+        print(f"Plan generation time: {plan_gen_time:.8f}s")
+        index_store.set_search_plan([idx_paths[idx] for plan in micro_batch_plans(stopology, args.micro_batch) for idx in plan.keys()])
+
+        # time to result of every query, from the start of the search
+        result_times = np.full(num_queries, np.nan)
+        def on_result(q_idxs, D, I, file_idx):
+            result_times[q_idxs] = time.perf_counter() - start_time
+        D_matrix, I_matrix, file_idx_matrix = search_outterloop_query_batched(stopology, queries, idx_k, k, idx_paths, index_store, 
+                                                                              micro_batch=args.micro_batch, on_result=on_result)
+        print(f"Time to result: p50 {np.nanpercentile(result_times, 50):.5f}s; p99 {np.nanpercentile(result_times, 99):.5f}s")
     elif "index" == search_topology.lower():
         # rstopology = query_to_index_stopology(stopology)
+        plan_gen_start = time.perf_counter()
         rstopology = dispatcher.create_search_outterloop_index_topology()
+        plan_gen_time = time.perf_counter() - plan_gen_start
+        print(f"Plan generation time: {plan_gen_time:.8f}s")
         # print("s: {}".format(len(rstopology)))
+        index_store.set_search_plan([idx_paths[idx] for idx in rstopology.keys()])
         D_matrix, I_matrix, file_idx_matrix = search_outterloop_index(rstopology, queries, idx_k, k, idx_paths, index_store)
     elif "index_async" == search_topology.lower():
         plan_gen_start = time.perf_counter()
-        rstopology = dispatcher.create_search_outterloop_index_topology()
-        # print("s: {}".format(len(rstopology)))
         # sort rs topology by length of values
-        rstopology = {k: v for k, v in sorted(rstopology.items(), key=lambda item: len(item[1]), reverse=True)}
+        rstopology = dispatcher.create_search_outterloop_index_topology(sort_by_size=True)
+        if args.early_completion:
+            rstopology = rstopology.order_by_completion(max_greedy=args.completion_greedy)
+        # print("s: {}".format(len(rstopology)))
         plan_gen_time = time.perf_counter() - plan_gen_start
         print(f"Plan generation time: {plan_gen_time:.8f}s")
         # exit()
 
-        index_loader = ThreadDataLoader(index_store, idx_paths)
+        index_store.set_search_plan([idx_paths[idx] for idx in rstopology.keys()])
+        index_loader = ThreadDataLoaderPool(index_store, idx_paths, num_loaders=num_loaders)
         index_loader.parse_stopology(rstopology)
+        index_store.set_index_loader(index_loader)
+        result_times = np.full(num_queries, np.nan)
+        def on_result(q_idxs, D, I, file_idx):
+            result_times[q_idxs] = time.perf_counter() - start_time
+        index_loader.start()
+        D_matrix, I_matrix, file_idx_matrix = search_outterloop_index_async(rstopology, queries, idx_k, k, idx_paths, index_store, 
+                                                                                 num_workers=search_workers, omp_threads=omp_threads,
+                                                                                 on_result=on_result if args.stream else None)
+        index_loader.stop_loading()
+        if args.stream:
+            print(f"Time to result: p50 {np.nanpercentile(result_times, 50):.5f}s; p99 {np.nanpercentile(result_times, 99):.5f}s")
+    elif "index_bounded" == search_topology.lower():
+        radii = catalog.radii
+        if radii is None:
+            raise ValueError("index_bounded needs the shard radii, run create_shard_idx.py --radii_only")
+        plan_gen_start = time.perf_counter()
+        rstopology = dispatcher.create_search_outterloop_index_topology(sort_by_size=True)
+        lower_bounds = dispatcher.lower_bounds(dispatcher.D, dispatcher.I, radii)
+        plan_gen_time = time.perf_counter() - plan_gen_start
+        print(f"Plan generation time: {plan_gen_time:.8f}s")
+
+        # the search sets the plan and feeds the loader round by round
+        index_loader = ThreadDataLoaderPool(index_store, idx_paths, num_loaders=num_loaders)
+        index_store.set_index_loader(index_loader)
         index_loader.start()
-        D_matrix, I_matrix, file_idx_matrix = search_outterloop_index_async(rstopology, queries, idx_k, k, idx_paths, index_store)
+        bound_stats = {}
+        D_matrix, I_matrix, file_idx_matrix = search_outterloop_index_bounded(rstopology, queries, idx_k, k, idx_paths, index_store,
+                                                                              lower_bounds, stats=bound_stats)
         index_loader.stop_loading()
+        total = bound_stats["searched"] + bound_stats["skipped"]
+        print(f"Skipped shard searches: {bound_stats['skipped']} / {total} ({bound_stats['skipped'] / max(total, 1):.2%}); "
+              f"shards never searched: {bound_stats['shards_skipped']} / {len(rstopology)}"
+              f"{'; store too small for a round, searched in index-major order' if bound_stats['index_major'] else ''}")
     else:
         raise ValueError("Invalid search topology")
 
     end_time = time.perf_counter()
     qb_runtime = end_time - start_time
 
-    if "index_async" == search_topology.lower():
+    if search_topology.lower() in ["index_async", "index_bounded"]:
         index_loader.join()
 
     if args.verbose:
@@ -143,6 +212,7 @@ if __name__ == "__main__":
         print(file_idx_matrix)
 
     print(f"Search time: {qb_runtime:.8f}s")
+    print(f"Hit rate: {index_store.hit_rate():.4f} ({index_store.hits} hits, {index_store.misses} misses)")
     
     # Sort index ranking dict: "index_manager.ranking_dict"
     # pprint(sorted(index_manager.ranking_dict.items(), key=lambda x: x[1], reverse=True))
@@ -32,3 +32,13 @@ python query_shard_idx.py -nq $NUM_QUERIES -k $K --nprobe $NPROBE \
     --mixtures_ratio $MIXTURES_RATIO \
     --log logs/st_query_1_batch.log \
     --seed 0
+
+sleep 1
+
+python query_shard_idx.py -nq $NUM_QUERIES -k $K --nprobe $NPROBE \
+    --search_topology query_batched \
+    --micro_batch 256 \
+    --max_index_store $MAX_INDEX_STORE \
+    --mixtures_ratio $MIXTURES_RATIO \
+    --log logs/st_query_batched_1_batch.log \
+    --seed 0
@@ -0,0 +1,90 @@
+'''
+Benchmark: adaptive per-query nprobe (Dispatcher.prune_shards) vs fixed nprobe
+
+For every prune ratio: shard visits (plan entries), search throughput (cold store, loader pool, index_async topology)
+and recall@k against the exhaustive search (every shard probed) and against fixed nprobe.
+
+python scripts/bench_adaptive_nprobe.py -idx shards/idxs/ -np 10 -pr 2 1.5 1.2 1.1 -nq 10000
+'''
+
+import os
+import sys
+import time
+import argparse
+
+import faiss
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from utils.index_store import IndexStore, ThreadDataLoaderPool
+from utils.dispatcher import Dispatcher, prune_ratio_arg
+from utils.index_manager import IndexManager
+from utils.result_accumulator import pack_labels
+from utils.search_by_topology import search_outterloop_index_async
+from utils.vdb_utils import random_queries_mix_distribs, list_shard_indexes
+
+
+def search(I, queries, idx_paths, args):
+    # cold store, shards loaded in plan order while searching
+    rstopology = Dispatcher.search_plan(I, sort_by_size=True)
+    index_store = IndexStore(max_indexes=args.max_index_store, index_manager=IndexManager())
+    index_loader = ThreadDataLoaderPool(index_store, idx_paths, num_loaders=args.num_loaders)
+    index_loader.parse_stopology(rstopology)
+    index_store.set_index_loader(index_loader)
+
+    start_time = time.perf_counter()
+    index_loader.start()
+    D, I, file_idx = search_outterloop_index_async(rstopology, queries, args.k, args.k, idx_paths, index_store)
+    runtime = time.perf_counter() - start_time
+    index_loader.stop_loading()
+    index_loader.join()
+    return runtime, pack_labels(file_idx, I)
+
+def recall(labels, labels_exact):
+    hits = [len(np.intersect1d(row[row >= 0], exact_row[exact_row >= 0])) for row, exact_row in zip(labels, labels_exact)]
+    return np.mean(hits) / labels_exact.shape[1]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Adaptive nprobe vs fixed nprobe")
+    parser.add_argument("-idx", "--idx_root", required=False, default="shards/idxs/", help="dir to index files", type=str,)
+    parser.add_argument("-np", "--nprobe", default=10, help="max shards per query (fixed nprobe baseline)", type=int,)
+    parser.add_argument("-pr", "--prune_ratios", nargs="+", default=[2., 1.5, 1.2, 1.1], help="prune ratios to compare (>= 1)", type=prune_ratio_arg,)
+    parser.add_argument("-k", default=10, help="top k results", type=int,)
+    parser.add_argument("-nq", "--num_query", default=10000, help="number of queries", type=int,)
+    parser.add_argument("-mi", "--max_index_store", default=100, help="max indexes to store", type=int,)
+    parser.add_argument("-nl", "--num_loaders", default=4, help="number of concurrent index loader threads", type=int,)
+    parser.add_argument("--no_exact", action="store_true", help="skip the exhaustive search (recall vs fixed nprobe only)")
+    parser.add_argument("-mr", "--mixtures_ratio", default=0.01, help="mixtures ratio for random queries", type=float,)
+    parser.add_argument("-omp", "--omp_threads", default=3, help="faiss OMP threads", type=int,)
+    parser.add_argument("-d", "--dim", default=128, help="dimension of embeddings", type=int,)
+    parser.add_argument("--seed", default=0, help="random seed", type=int,)
+    args = parser.parse_args()
+
+    faiss.omp_set_num_threads(args.omp_threads)
+    idx_paths, centriod_idx_paths = list_shard_indexes(args.idx_root)
+
+    queries = random_queries_mix_distribs(args.num_query, args.dim, mixtures_ratio=args.mixtures_ratio, low=-1, high=1,
+                                          seed=args.seed).astype(np.float32)
+    dispatcher = Dispatcher(centriod_idx_paths, verbose=False)
+    D, I = dispatcher.route(queries, args.nprobe)
+
+    labels_exact = None
+    if not args.no_exact:
+        _, I_all = dispatcher.route(queries, dispatcher.router.num_shards)
+        _, labels_exact = search(I_all, queries, idx_paths, args)
+
+    fixed_runtime, labels_fixed = search(I, queries, idx_paths, args)
+    fixed_visits = int((I >= 0).sum())
+    print(f"{len(idx_paths)} shards, {args.num_query} queries, k {args.k}")
+    for name, prune_ratio in [(f"fixed np={args.nprobe}", None)] + [(f"ratio {r}", r) for r in args.prune_ratios]:
+        if prune_ratio is None:
+            runtime, labels, visits = fixed_runtime, labels_fixed, fixed_visits
+        else:
+            I_pruned = Dispatcher.prune_shards(D, I, prune_ratio)
+            visits = int((I_pruned >= 0).sum())
+            runtime, labels = search(I_pruned, queries, idx_paths, args)
+        exact_recall = "" if labels_exact is None else f"; recall@{args.k} {recall(labels, labels_exact):.4f}"
+        print(f"{name:>12}: {visits / args.num_query:.2f} shards/query ({1 - visits / fixed_visits:.1%} visits saved); "
+              f"{args.num_query / runtime:.1f} queries/s ({fixed_runtime / runtime:.2f}x){exact_recall}; "
+              f"vs fixed {recall(labels, labels_fixed):.4f}")
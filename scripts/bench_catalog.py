@@ -0,0 +1,81 @@
+'''
+Benchmark: startup shard discovery, loading the catalog (utils/shard_catalog.py) vs listing and probing the index files
+
+    - catalog: read catalog.json and the centroids npy
+    - list + probe: list idx_root, stat and read every shard index (IVF lists mapped) for its size, vector count and type
+    - list: directory listing only (shard paths, nothing known about the shards)
+
+The shard set is idx_root (catalog written by create_shard_idx.py or --catalog_only) or, with --synthetic N,
+N small IVF shards written to a temporary dir.
+
+python scripts/bench_catalog.py -idx shards/idxs/
+python scripts/bench_catalog.py --synthetic 5000
+'''
+
+import os
+import sys
+import time
+import argparse
+import tempfile
+
+import faiss
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from utils.shard_catalog import ShardCatalog
+from utils.vdb_utils import save_index
+
+
+def create_synthetic_shards(idx_root, num_shards, cluster_size, dim, seed):
+    rng = np.random.default_rng(seed)
+    centroids = np.zeros((num_shards, dim), dtype=np.float32)
+    for i in range(num_shards):
+        embeds = (rng.uniform(-1, 1) + rng.normal(0, 0.5, (cluster_size, dim))).astype(np.float32)
+        centroids[i] = embeds.mean(axis=0)
+        quantizer = faiss.IndexFlatL2(dim)
+        index = faiss.IndexIVFFlat(quantizer, dim, 4, faiss.METRIC_L2)
+        index.train(embeds)
+        index.add(embeds)
+        save_index(index, os.path.join(idx_root, f"embeds_{i}.index"))
+    index = faiss.IndexFlatL2(dim)
+    index.add(centroids)
+    save_index(index, os.path.join(idx_root, "embeds_centroids.index"))
+    ShardCatalog.scan(idx_root, probe=True, centroids=centroids).save()
+
+def run(idx_root, repeat):
+    if ShardCatalog.load(idx_root) is None:
+        raise ValueError(f"no catalog in {idx_root}, run create_shard_idx.py --catalog_only")
+    modes = [
+        ("catalog", lambda: ShardCatalog.load(idx_root)),
+        ("list + probe", lambda: ShardCatalog.scan(idx_root, probe=True)),
+        ("list", lambda: ShardCatalog.scan(idx_root, probe=False)),
+    ]
+    catalog_runtime = None
+    for name, func in modes:
+        runtimes = []
+        for _ in range(repeat):
+            start_time = time.perf_counter()
+            catalog = func()
+            runtimes.append(time.perf_counter() - start_time)
+        runtime = np.median(runtimes)
+        catalog_runtime = runtime if catalog_runtime is None else catalog_runtime
+        print(f"{name:>12}: {runtime*1e3:.2f}ms for {len(catalog)} shards ({runtime / len(catalog) * 1e6:.2f} us/shard); "
+              f"{runtime / catalog_runtime:.1f}x the catalog")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Catalog load vs listing and probing the shard files")
+    parser.add_argument("-idx", "--idx_root", required=False, default="shards/idxs/", help="dir to index files", type=str,)
+    parser.add_argument("--synthetic", default=0, help="number of synthetic shards instead of idx_root", type=int,)
+    parser.add_argument("--cluster_size", default=200, help="embeddings per synthetic shard", type=int,)
+    parser.add_argument("-d", "--dim", default=128, help="dimension of the synthetic embeddings", type=int,)
+    parser.add_argument("-r", "--repeat", default=5, help="runs per mode (median), the first one warms the page cache", type=int,)
+    parser.add_argument("--seed", default=0, help="random seed", type=int,)
+    args = parser.parse_args()
+
+    if args.synthetic > 0:
+        with tempfile.TemporaryDirectory() as idx_root:
+            create_synthetic_shards(idx_root, args.synthetic, args.cluster_size, args.dim, args.seed)
+            run(idx_root, args.repeat)
+    else:
+        run(args.idx_root, args.repeat)
@@ -0,0 +1,88 @@
+'''
+Benchmark: request coalescing (serve/batcher.py) vs per-request execution, in-process (no HTTP)
+
+num_clients asyncio clients send small query batches back to back (closed loop) to a fresh SearchEngine.
+Per-request execution is the same batcher with max_batch_size 1 (every request is its own dispatcher batch).
+Reports throughput, request latency percentiles and the mean number of requests per dispatcher batch.
+
+python scripts/bench_coalescing.py -idx shards/idxs/ -c 1 8 32 -nr 20 -nq 8 -mi 100
+'''
+
+import os
+import sys
+import time
+import asyncio
+import argparse
+
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from serve.engine import SearchEngine
+from serve.batcher import CoalescingBatcher
+from utils.vdb_utils import random_queries_mix_distribs
+
+
+async def run_clients(batcher, client_batches):
+    latencies = []
+    results = [[None] * len(batches) for batches in client_batches]
+
+    async def client(c, batches):
+        for i, queries in enumerate(batches):
+            start_time = time.perf_counter()
+            results[c][i] = await batcher.search(queries)
+            latencies.append(time.perf_counter() - start_time)
+
+    batcher.start()
+    start_time = time.perf_counter()
+    await asyncio.gather(*[client(c, batches) for c, batches in enumerate(client_batches)])
+    runtime = time.perf_counter() - start_time
+    await batcher.stop()
+    return runtime, np.array(latencies), results
+
+def run(client_batches, max_batch_size, max_wait_ms, args):
+    engine = SearchEngine(args.idx_root, k=args.k, nprobe=args.nprobe, max_index_store=args.max_index_store,
+                          num_loaders=args.num_loaders, omp_threads=args.omp_threads)
+    batcher = CoalescingBatcher(engine, max_batch_size=max_batch_size, max_wait_ms=max_wait_ms)
+    try:
+        runtime, latencies, results = asyncio.run(run_clients(batcher, client_batches))
+    finally:
+        engine.close()
+    return runtime, latencies, results, batcher.num_requests / max(batcher.num_batches, 1)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Request coalescing vs per-request execution")
+    parser.add_argument("-idx", "--idx_root", required=False, default="shards/idxs/", help="dir to index files", type=str,)
+    parser.add_argument("-c", "--num_clients", nargs="+", default=[1, 8, 32], help="concurrent clients, one run each (-c 1 8 32)", type=int,)
+    parser.add_argument("-nr", "--num_requests", default=20, help="requests per client", type=int,)
+    parser.add_argument("-nq", "--num_query", default=8, help="queries per request", type=int,)
+    parser.add_argument("-np", "--nprobe", default=10, help="a small number (nprobe) of subsets to visit", type=int,)
+    parser.add_argument("-k", default=10, help="top k results", type=int,)
+    parser.add_argument("-mi", "--max_index_store", default=100, help="max indexes to store", type=int,)
+    parser.add_argument("-nl", "--num_loaders", default=4, help="number of concurrent index loader threads", type=int,)
+    parser.add_argument("-omp", "--omp_threads", default=3, help="faiss OMP threads", type=int,)
+    parser.add_argument("-bs", "--max_batch_size", default=4096, help="max queries coalesced into one batch", type=int,)
+    parser.add_argument("-mw", "--max_wait_ms", default=2., help="max time a request waits for others to join its batch", type=float,)
+    parser.add_argument("-mr", "--mixtures_ratio", default=0., help="mixtures ratio for random queries", type=float,)
+    parser.add_argument("-d", "--dim", default=128, help="dimension of embeddings", type=int,)
+    parser.add_argument("--seed", default=0, help="random seed", type=int,)
+    args = parser.parse_args()
+
+    print(f"{args.num_requests} requests/client x {args.num_query} queries; coalescing: max {args.max_batch_size} queries, {args.max_wait_ms}ms")
+    for num_clients in args.num_clients:
+        client_batches = [[random_queries_mix_distribs(args.num_query, args.dim, mixtures_ratio=args.mixtures_ratio, low=-1, high=1,
+                                                       seed=args.seed + c * args.num_requests + i) for i in range(args.num_requests)]
+                          for c in range(num_clients)]
+        num_queries = num_clients * args.num_requests * args.num_query
+        modes = {}
+        for name, max_batch_size, max_wait_ms in [("per-request", 1, 0.), ("coalesced", args.max_batch_size, args.max_wait_ms)]:
+            runtime, latencies, results, requests_per_batch = run(client_batches, max_batch_size, max_wait_ms, args)
+            modes[name] = results
+            p50, p99 = np.percentile(latencies, [50, 99]) * 1e3
+            print(f"clients {num_clients:>3} {name:>11}: {num_queries / runtime:.1f} queries/s; latency p50 {p50:.2f}ms; p99 {p99:.2f}ms; "
+                  f"{requests_per_batch:.1f} requests/batch")
+
+        # coalescing must not change the results (same shards probed, exact top k within them)
+        for per_request, coalesced in zip(modes["per-request"], modes["coalesced"]):
+            for (D1, I1, F1), (D2, I2, F2) in zip(per_request, coalesced):
+                assert np.allclose(D1, D2, rtol=1e-4, atol=1e-4), "coalesced distances differ"
@@ -0,0 +1,116 @@
+'''
+Benchmark: early termination with shard lower bounds (search_outterloop_index_bounded) vs fixed nprobe
+
+For the same routing (nprobe nearest centroids): search time (resident store, every shard loaded before timing),
+(query, shard) searches skipped, shards never searched, and exactness against the fixed nprobe search
+(distances equal, labels equal up to distance ties).
+
+The shard set is idx_root (needs embeds_radii.npy, create_shard_idx.py --radii_only) or, with --synthetic N,
+N well separated clusters (mean_i ~ U(-1, 1)^dim, std --cluster_std) written to a temporary dir as flat indexes.
+
+python scripts/bench_early_termination.py -idx shards/idxs/ -np 10 -nq 10000
+python scripts/bench_early_termination.py --synthetic 200 -d 32 --cluster_std 0.05 -np 10 -nq 10000
+'''
+
+import os
+import sys
+import time
+import argparse
+import tempfile
+
+import faiss
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from utils.index_store import IndexStore
+from utils.dispatcher import Dispatcher
+from utils.index_manager import IndexManager
+from utils.search_by_topology import search_outterloop_index, search_outterloop_index_bounded
+from utils.vdb_utils import random_queries_mix_distribs, list_shard_indexes, load_shard_radii, save_index
+
+
+def create_synthetic_shards(idx_root, num_shards, cluster_size, dim, cluster_std, seed):
+    rng = np.random.default_rng(seed)
+    means = rng.uniform(-1, 1, (num_shards, dim))
+    centroids = np.zeros((num_shards, dim), dtype=np.float32)
+    radii = np.zeros(num_shards)
+    for i in range(num_shards):
+        embeds = (means[i] + rng.normal(0, cluster_std, (cluster_size, dim))).astype(np.float32)
+        centroids[i] = embeds.mean(axis=0)
+        radii[i] = np.sqrt(((embeds - centroids[i]) ** 2).sum(axis=1).max())
+        index = faiss.IndexFlatL2(dim)
+        index.add(embeds)
+        save_index(index, os.path.join(idx_root, f"embeds_{i}.index"))
+    index = faiss.IndexFlatL2(dim)
+    index.add(centroids)
+    save_index(index, os.path.join(idx_root, "embeds_centroids.index"))
+    np.save(os.path.join(idx_root, "embeds_radii.npy"), radii)
+
+def run(idx_root, args):
+    idx_paths, centriod_idx_paths = list_shard_indexes(idx_root)
+    radii = load_shard_radii(idx_root)
+    if radii is None:
+        raise ValueError(f"no shard radii in {idx_root}, run create_shard_idx.py --radii_only")
+
+    queries = random_queries_mix_distribs(args.num_query, args.dim, mixtures_ratio=args.mixtures_ratio, low=-1, high=1,
+                                          seed=args.seed).astype(np.float32)
+    dispatcher = Dispatcher(centriod_idx_paths, verbose=False)
+    D, I = dispatcher.route(queries, args.nprobe)
+    rstopology = Dispatcher.search_plan(I, sort_by_size=True)
+    lower_bounds = Dispatcher.lower_bounds(D, I, radii)
+
+    # resident store: the comparison is about searches, not IO
+    index_store = IndexStore(max_indexes=len(idx_paths), index_manager=IndexManager())
+    for idx in rstopology.keys():
+        index_store.add_index_from_path(idx_paths[idx])
+    # release_index would drop the shards between runs
+    index_store.release_index = lambda index_path: None
+
+    runtimes = {"fixed": [], "bounded": []}
+    for _ in range(args.repeat):
+        start_time = time.perf_counter()
+        D_fixed, I_fixed, file_idx_fixed = search_outterloop_index(rstopology, queries, args.k, args.k, idx_paths, index_store)
+        runtimes["fixed"].append(time.perf_counter() - start_time)
+
+        stats = {}
+        start_time = time.perf_counter()
+        D_bounded, I_bounded, file_idx_bounded = search_outterloop_index_bounded(rstopology, queries, args.k, args.k, idx_paths,
+                                                                                 index_store, lower_bounds, stats=stats)
+        runtimes["bounded"].append(time.perf_counter() - start_time)
+
+    fixed_runtime, bounded_runtime = np.median(runtimes["fixed"]), np.median(runtimes["bounded"])
+    total = stats["searched"] + stats["skipped"]
+    same_labels = ((I_fixed == I_bounded) & (file_idx_fixed == file_idx_bounded)).all(axis=1).mean()
+    print(f"{len(idx_paths)} shards, {args.num_query} queries, nprobe {args.nprobe}, k {args.k}; "
+          f"median radius {np.median(radii):.3f}, median centroid distance {np.median(np.sqrt(D)):.3f}")
+    print(f"  fixed: {fixed_runtime:.4f}s; {total} searches")
+    print(f"bounded: {bounded_runtime:.4f}s ({fixed_runtime / bounded_runtime:.2f}x); {stats['searched']} searches, "
+          f"{stats['skipped']} skipped ({stats['skipped'] / max(total, 1):.1%}); "
+          f"{stats['shards_skipped']} / {len(rstopology)} shards never searched")
+    print(f"exactness: distances equal {np.allclose(D_fixed, D_bounded)}; "
+          f"max |dD| {np.abs(D_fixed - D_bounded).max():.2e}; labels equal for {same_labels:.2%} of queries")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Early termination with shard lower bounds vs fixed nprobe")
+    parser.add_argument("-idx", "--idx_root", required=False, default="shards/idxs/", help="dir to index files", type=str,)
+    parser.add_argument("--synthetic", default=0, help="number of separated synthetic shards instead of idx_root", type=int,)
+    parser.add_argument("--cluster_size", default=2000, help="embeddings per synthetic shard", type=int,)
+    parser.add_argument("--cluster_std", default=0.05, help="std of the synthetic shards", type=float,)
+    parser.add_argument("-np", "--nprobe", default=10, help="shards per query", type=int,)
+    parser.add_argument("-k", default=10, help="top k results", type=int,)
+    parser.add_argument("-nq", "--num_query", default=10000, help="number of queries", type=int,)
+    parser.add_argument("-r", "--repeat", default=3, help="runs per mode (median)", type=int,)
+    parser.add_argument("-mr", "--mixtures_ratio", default=0.01, help="mixtures ratio for random queries", type=float,)
+    parser.add_argument("-omp", "--omp_threads", default=3, help="faiss OMP threads", type=int,)
+    parser.add_argument("-d", "--dim", default=128, help="dimension of embeddings", type=int,)
+    parser.add_argument("--seed", default=0, help="random seed", type=int,)
+    args = parser.parse_args()
+
+    faiss.omp_set_num_threads(args.omp_threads)
+    if args.synthetic > 0:
+        with tempfile.TemporaryDirectory() as idx_root:
+            create_synthetic_shards(idx_root, args.synthetic, args.cluster_size, args.dim, args.cluster_std, args.seed)
+            run(idx_root, args)
+    else:
+        run(args.idx_root, args)
@@ -0,0 +1,98 @@
+'''
+Microbenchmark: IndexManager ranking updates, eviction and get_head_index at 100k shard keys
+
+Replays a zipf shard access trace against a store of --capacity resident shards (no faiss, no files):
+every access updates the rank, a miss evicts the lowest ranked resident shard when the store is full.
+Compares the previous sort-based manager/eviction with the current ordered-dict / frequency-bucket one.
+
+python scripts/bench_index_manager.py -nk 100000 -na 200000 -c 1000
+'''
+
+import os
+import sys
+import time
+import argparse
+
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from utils.index_manager import IndexManager
+
+
+class LegacyIndexManager:
+    # previous IndexManager: ranking dict, full sort when the ranking changed
+    def __init__(self, policy='LFU'):
+        self.policy = policy
+        self.rankings = []
+        self.ranking_dict = {}
+        self.ranking_updated = True
+
+    def update_index_rank(self, index_path, rank):
+        if self.policy == 'LFU' and index_path in self.ranking_dict:
+            self.ranking_dict[index_path] += rank
+        else:
+            self.ranking_dict[index_path] = rank
+        self.ranking_updated = False
+
+    def get_head_index(self, k=1):
+        if not self.ranking_updated:
+            self.rankings = sorted(self.ranking_dict, key=self.ranking_dict.get, reverse=True)
+            self.ranking_updated = True
+        return self.rankings[:k]
+
+def legacy_victim(manager, resident):
+    # previous IndexStore.evict_index: rebuild the local ranking of resident indexes and sort it
+    local_ranking_dict = {key: manager.ranking_dict.get(key, 0) for key in resident}
+    local_ranking_list = sorted(local_ranking_dict, key=local_ranking_dict.get, reverse=True)
+    return local_ranking_list[-1]
+
+def replay_legacy(trace, policy, capacity, head_every):
+    manager = LegacyIndexManager(policy=policy)
+    resident = set()
+    for i, key in enumerate(trace):
+        manager.update_index_rank(key, 1 if policy == 'LFU' else time.perf_counter())
+        if key not in resident:
+            if len(resident) >= capacity:
+                resident.remove(legacy_victim(manager, resident))
+            resident.add(key)
+        if (i + 1) % head_every == 0:
+            manager.get_head_index(k=capacity)
+
+def replay(trace, policy, capacity, head_every):
+    manager = IndexManager(policy=policy)
+    resident = set()
+    for i, key in enumerate(trace):
+        manager.update_index_rank(key, 1 if policy == 'LFU' else time.perf_counter())
+        if key not in resident:
+            if len(resident) >= capacity:
+                victim = manager.get_victim()
+                resident.remove(victim)
+                manager.remove_resident(victim)
+            resident.add(key)
+            manager.add_resident(key)
+        if (i + 1) % head_every == 0:
+            manager.get_head_index(k=capacity)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark IndexManager ranking and eviction")
+    parser.add_argument("-nk", "--num_keys", default=100000, help="number of shard keys", type=int,)
+    parser.add_argument("-na", "--num_access", default=200000, help="number of shard accesses", type=int,)
+    parser.add_argument("-c", "--capacity", default=1000, help="resident shards (max_indexes)", type=int,)
+    parser.add_argument("--zipf", default=1.2, help="zipf parameter of the access trace", type=float,)
+    parser.add_argument("--head_every", default=10000, help="call get_head_index every N accesses (once per batch)", type=int,)
+    parser.add_argument("--seed", default=0, help="random seed", type=int,)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    trace = [f"shards/idxs/embeds_{i}.index" for i in (rng.zipf(args.zipf, args.num_access) - 1) % args.num_keys]
+    print(f"{args.num_access} accesses over {args.num_keys} keys, {len(set(trace))} distinct, capacity {args.capacity}")
+
+    for policy in ['LRU', 'LFU']:
+        runtimes = []
+        for func in [replay_legacy, replay]:
+            start_time = time.perf_counter()
+            func(trace, policy, args.capacity, args.head_every)
+            runtimes.append(time.perf_counter() - start_time)
+        legacy_us, new_us = [r / args.num_access * 1e6 for r in runtimes]
+        print(f"{policy}: legacy {legacy_us:.2f} us/access; current {new_us:.2f} us/access; speedup {legacy_us / new_us:.1f}x")
@@ -0,0 +1,70 @@
+'''
+Benchmark: full read vs mmap shard loading in IndexStore
+
+For each mode a fresh process loads every shard of the synthetic set (create_shard_idx.py) and searches it.
+Reports time-to-first-result (load + search of the first shard), time to load all shards,
+the store's resident byte accounting and the peak RSS of the process.
+For cold-cache numbers drop the page cache before running (sync; echo 3 > /proc/sys/vm/drop_caches).
+
+python scripts/bench_mmap_load.py -idx shards/idxs/
+'''
+
+import os
+import sys
+import json
+import time
+import argparse
+import resource
+import subprocess
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+
+def run_mode(idx_root, mmap, num_query, dim, k):
+    from utils.index_store import IndexStore
+    from utils.vdb_utils import query_index_file, random_queries, list_shard_indexes
+
+    idx_paths, _ = list_shard_indexes(idx_root)
+    queries = random_queries(num_query, dim, seed=0)
+    index_store = IndexStore(max_indexes=len(idx_paths), mmap=mmap)
+
+    start_time = time.perf_counter()
+    first_result_time = None
+    for idx_path in idx_paths:
+        query_index_file(idx_path, queries, k, index_store)
+        if first_result_time is None:
+            first_result_time = time.perf_counter() - start_time
+    all_time = time.perf_counter() - start_time
+
+    return {
+        "mode": "mmap" if mmap else "read",
+        "num_shards": len(idx_paths),
+        "first_result_s": first_result_time,
+        "all_shards_s": all_time,
+        "resident_mb": index_store.resident_bytes / 2**20,
+        # linux: ru_maxrss is in KB
+        "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 2**10,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare full read and mmap shard loading")
+    parser.add_argument("-idx", "--idx_root", required=False, default="shards/idxs/", help="dir to index files", type=str,)
+    parser.add_argument("-nq", "--num_query", default=100, help="queries searched on every shard", type=int,)
+    parser.add_argument("-k", default=10, help="top k results", type=int,)
+    parser.add_argument("-d", "--dim", default=128, help="dimension of embeddings", type=int,)
+    parser.add_argument("--mode", default=None, choices=["read", "mmap"], help="run a single mode (used internally)")
+    args = parser.parse_args()
+
+    if args.mode is not None:
+        print(json.dumps(run_mode(args.idx_root, args.mode == "mmap", args.num_query, args.dim, args.k)))
+        sys.exit(0)
+
+    for mode in ["read", "mmap"]:
+        # separate process per mode, so peak RSS is not shared
+        out = subprocess.run([sys.executable, os.path.abspath(__file__), "--mode", mode, "-idx", args.idx_root,
+                              "-nq", str(args.num_query), "-k", str(args.k), "-d", str(args.dim)],
+                             check=True, capture_output=True, text=True).stdout
+        r = json.loads(out.strip().splitlines()[-1])
+        print(f"{r['mode']:>4}: {r['num_shards']} shards; first result: {r['first_result_s']:.5f}s; "
+              f"all shards: {r['all_shards_s']:.5f}s; resident: {r['resident_mb']:.1f} MB; peak RSS: {r['peak_rss_mb']:.1f} MB")
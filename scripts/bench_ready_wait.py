@@ -0,0 +1,87 @@
+'''
+Benchmark: waiting for loading indexes, busy-wait (before) vs load futures (after)
+
+Cold-cache workload: every run starts with an empty store, the loader pool prefetches the topology
+while index_async search waits for each shard. Reports end-to-end latency and process CPU time.
+For a cold page cache drop it before each run (sync; echo 3 > /proc/sys/vm/drop_caches).
+
+python scripts/bench_ready_wait.py -idx shards/idxs/ -nq 20000
+'''
+
+import os
+import sys
+import time
+import argparse
+
+import faiss
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from utils.index_store import IndexStore, ThreadDataLoaderPool
+from utils.dispatcher import Dispatcher
+from utils.index_manager import IndexManager
+from utils.vdb_utils import random_queries_mix_distribs, list_shard_indexes
+from utils.search_by_topology import search_outterloop_index_async
+
+
+class SpinIndexStore(IndexStore):
+    '''
+    Previous behaviour: spin on the "loading" status with time.sleep(0.000001)
+    '''
+    def wait_for_index(self, index_path):
+        while True:
+            index = self.indexes.get(index_path)
+            if index is None:
+                if not self.add_index_from_path(index_path):
+                    time.sleep(0.000001)
+            elif index == "loading":
+                time.sleep(0.000001)
+            else:
+                return index
+
+
+def run(store_cls, rstopology, queries, idx_paths, centriod_idx_paths, args):
+    index_store = store_cls(max_indexes=args.max_index_store, index_manager=IndexManager())
+    index_loader = ThreadDataLoaderPool(index_store, idx_paths, num_loaders=args.num_loaders)
+    index_loader.parse_stopology(rstopology)
+    index_store.set_index_loader(index_loader)
+
+    cpu_start = time.process_time()
+    start_time = time.perf_counter()
+    index_loader.start()
+    search_outterloop_index_async(rstopology, queries, args.k, args.k, idx_paths, index_store)
+    runtime = time.perf_counter() - start_time
+    cpu_time = time.process_time() - cpu_start
+    index_loader.stop_loading()
+    index_loader.join()
+    return runtime, cpu_time
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Busy-wait vs future based index readiness")
+    parser.add_argument("-idx", "--idx_root", required=False, default="shards/idxs/", help="dir to index files", type=str,)
+    parser.add_argument("-np", "--nprobe", default=10, help="a small number (nprobe) of subsets to visit", type=int,)
+    parser.add_argument("-k", default=10, help="top k results", type=int,)
+    parser.add_argument("-nq", "--num_query", default=20000, help="number of queries", type=int,)
+    parser.add_argument("-mi", "--max_index_store", default=100, help="max indexes to store", type=int,)
+    parser.add_argument("-nl", "--num_loaders", default=4, help="number of concurrent index loader threads", type=int,)
+    parser.add_argument("-r", "--repeat", default=3, help="runs per mode", type=int,)
+    parser.add_argument("-omp", "--omp_threads", default=3, help="faiss OMP threads", type=int,)
+    parser.add_argument("-d", "--dim", default=128, help="dimension of embeddings", type=int,)
+    parser.add_argument("--seed", default=0, help="random seed", type=int,)
+    args = parser.parse_args()
+
+    faiss.omp_set_num_threads(args.omp_threads)
+
+    idx_paths, centriod_idx_paths = list_shard_indexes(args.idx_root)
+
+    queries = random_queries_mix_distribs(args.num_query, args.dim, mixtures_ratio=0., low=-1, high=1, seed=args.seed)
+    dispatcher = Dispatcher(centriod_idx_paths, verbose=False)
+    dispatcher.search_knn_centroids(queries, args.nprobe)
+    rstopology = dispatcher.create_search_outterloop_index_topology(sort_by_size=True)
+
+    print(f"{len(rstopology)} shards, {args.num_query} queries, {args.num_loaders} loaders, -mi {args.max_index_store}")
+    for name, store_cls in [("busy-wait", SpinIndexStore), ("futures", IndexStore)]:
+        results = np.array([run(store_cls, rstopology, queries, idx_paths, centriod_idx_paths, args) for _ in range(args.repeat)])
+        runtime, cpu_time = results.mean(axis=0)
+        print(f"{name:>9}: latency {runtime:.5f}s; CPU time {cpu_time:.5f}s; CPU/latency {cpu_time / runtime:.2f}")
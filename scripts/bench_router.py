@@ -0,0 +1,81 @@
+'''
+Benchmark: centroid routing latency and recall, flat vs HNSW vs IVF router (utils/centroid_router.py)
+
+Recall: fraction of the exact (flat) nprobe nearest shards that the router returns, averaged over queries.
+Centroids come from --centroids (npy_root/embeds_centroids.npy) or are generated like create_shard_idx.py
+(shard i ~ N(mean_i, 0.5), mean_i ~ U(-1, 1), centroid = mean of cluster_size embeddings).
+
+python scripts/bench_router.py -ns 100000 -nq 10000 -np 10
+'''
+
+import os
+import sys
+import time
+import argparse
+
+import faiss
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from utils.centroid_router import CentroidRouter, build_router_index
+from utils.vdb_utils import random_queries_mix_distribs
+
+
+def synthetic_centroids(num_shards, dim, cluster_size, seed):
+    # mean of cluster_size N(mean_i, 0.5) embeddings, without generating them
+    rng = np.random.default_rng(seed)
+    means = rng.uniform(-1, 1, (num_shards, 1))
+    return (means + rng.normal(0, 0.5 / np.sqrt(cluster_size), (num_shards, dim))).astype(np.float32)
+
+def recall(I, I_exact):
+    hits = [len(np.intersect1d(row, exact_row)) for row, exact_row in zip(I, I_exact)]
+    return np.mean(hits) / I_exact.shape[1]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Centroid router latency and recall")
+    parser.add_argument("--centroids", default=None, help="centroids npy (default: synthetic)", type=str,)
+    parser.add_argument("-ns", "--num_shards", default=100000, help="number of shards (synthetic centroids)", type=int,)
+    parser.add_argument("--cluster_size", default=10000, help="embeddings per shard (synthetic centroids)", type=int,)
+    parser.add_argument("-nq", "--num_query", default=10000, help="number of queries", type=int,)
+    parser.add_argument("-np", "--nprobe", default=10, help="shards per query", type=int,)
+    parser.add_argument("--hnsw_m", default=32, help="hnsw: graph degree", type=int,)
+    parser.add_argument("--ef_search", nargs="+", default=[32, 64, 128], help="hnsw: efSearch values", type=int,)
+    parser.add_argument("--ivf_nprobe", nargs="+", default=[4, 16, 64], help="ivf: lists scanned per query", type=int,)
+    parser.add_argument("-mr", "--mixtures_ratio", default=0.01, help="mixtures ratio for random queries", type=float,)
+    parser.add_argument("-omp", "--omp_threads", default=None, help="faiss OMP threads", type=int,)
+    parser.add_argument("-d", "--dim", default=128, help="dimension of embeddings", type=int,)
+    parser.add_argument("--seed", default=0, help="random seed", type=int,)
+    args = parser.parse_args()
+
+    if args.omp_threads is not None:
+        faiss.omp_set_num_threads(args.omp_threads)
+    if args.centroids is not None:
+        centroids = np.load(args.centroids).astype(np.float32)
+    else:
+        centroids = synthetic_centroids(args.num_shards, args.dim, args.cluster_size, args.seed)
+    queries = random_queries_mix_distribs(args.num_query, centroids.shape[1], mixtures_ratio=args.mixtures_ratio, low=-1, high=1,
+                                          seed=args.seed).astype(np.float32)
+    print(f"{centroids.shape[0]} shards, {args.num_query} queries, nprobe {args.nprobe}")
+
+    configs = [("flat", {}, {})]
+    configs += [(f"hnsw ef={ef}", {"kind": "hnsw", "hnsw_m": args.hnsw_m}, {"ef_search": ef}) for ef in args.ef_search]
+    configs += [(f"ivf nprobe={n}", {"kind": "ivf"}, {"ivf_nprobe": n}) for n in args.ivf_nprobe]
+
+    built = {}
+    I_exact, flat_latency = None, None
+    for name, build_args, search_args in configs:
+        kind = build_args.get("kind", "flat")
+        if kind not in built:
+            start_time = time.perf_counter()
+            built[kind] = build_router_index(centroids, **build_args)
+            print(f"{kind}: built in {time.perf_counter() - start_time:.2f}s")
+        router = CentroidRouter(built[kind], **search_args)
+
+        start_time = time.perf_counter()
+        _, I = router.search(queries, args.nprobe)
+        latency = time.perf_counter() - start_time
+        if I_exact is None:
+            I_exact, flat_latency = I, latency
+        print(f"{name:>16}: {latency / args.num_query * 1e6:.2f} us/query; speedup {flat_latency / latency:.1f}x; "
+              f"recall@{args.nprobe} {recall(I, I_exact):.4f}")
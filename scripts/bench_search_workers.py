@@ -0,0 +1,74 @@
+'''
+Benchmark: index_async search throughput vs number of search workers
+
+All shards are loaded into the store first (resident), so the numbers show how shard search
+scales with the worker pool. Use --cold to start every run with an empty store instead.
+
+python scripts/bench_search_workers.py -idx shards/idxs/ -nq 20000 -w 1 2 4 8 16 32 -omp 32
+'''
+
+import os
+import sys
+import time
+import argparse
+
+import faiss
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from utils.index_store import IndexStore
+from utils.dispatcher import Dispatcher
+from utils.index_manager import IndexManager
+from utils.vdb_utils import random_queries_mix_distribs, list_shard_indexes
+from utils.search_by_topology import search_outterloop_index_async
+
+
+class ResidentIndexStore(IndexStore):
+    '''
+    Keep searched shards resident so every run searches the same warm store
+    '''
+    def remove_index(self, index_path):
+        return
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Search throughput vs number of search workers")
+    parser.add_argument("-idx", "--idx_root", required=False, default="shards/idxs/", help="dir to index files", type=str,)
+    parser.add_argument("-np", "--nprobe", default=10, help="a small number (nprobe) of subsets to visit", type=int,)
+    parser.add_argument("-k", default=10, help="top k results", type=int,)
+    parser.add_argument("-nq", "--num_query", default=20000, help="number of queries", type=int,)
+    parser.add_argument("-mr", "--mixtures_ratio", default=0., help="mixtures ratio for random queries", type=float,)
+    parser.add_argument("-w", "--workers", nargs="+", default=[1, 2, 4, 8], help="search worker counts to run", type=int,)
+    parser.add_argument("-omp", "--omp_threads", default=None, help="faiss OMP thread budget (default: all cores)", type=int,)
+    parser.add_argument("--cold", action="store_true", help="start each run with an empty store")
+    parser.add_argument("-d", "--dim", default=128, help="dimension of embeddings", type=int,)
+    parser.add_argument("--seed", default=0, help="random seed", type=int,)
+    args = parser.parse_args()
+
+    omp_threads = args.omp_threads if args.omp_threads is not None else os.cpu_count()
+    faiss.omp_set_num_threads(omp_threads)
+
+    idx_paths, centriod_idx_paths = list_shard_indexes(args.idx_root)
+
+    queries = random_queries_mix_distribs(args.num_query, args.dim, mixtures_ratio=args.mixtures_ratio, low=-1, high=1, seed=args.seed)
+
+    store_cls = IndexStore if args.cold else ResidentIndexStore
+    index_store = store_cls(max_indexes=len(idx_paths) + 1, index_manager=IndexManager())
+    dispatcher = Dispatcher(centriod_idx_paths, verbose=False)
+    dispatcher.search_knn_centroids(queries, args.nprobe)
+    rstopology = dispatcher.create_search_outterloop_index_topology(sort_by_size=True)
+    if not args.cold:
+        for file_idx in rstopology.keys():
+            index_store.add_index_from_path(idx_paths[file_idx])
+
+    print(f"{len(rstopology)} shards, {args.num_query} queries, omp thread budget {omp_threads}")
+    base_tput = None
+    for num_workers in args.workers:
+        if args.cold:
+            index_store.remove_multiple_indexes(list(index_store.indexes.keys()))
+        start_time = time.perf_counter()
+        search_outterloop_index_async(rstopology, queries, args.k, args.k, idx_paths, index_store,
+                                      num_workers=num_workers, omp_threads=omp_threads)
+        runtime = time.perf_counter() - start_time
+        tput = args.num_query / runtime
+        base_tput = tput if base_tput is None else base_tput
+        print(f"workers: {num_workers:3d}; time: {runtime:.5f}s; tput: {tput:.3f} queries/s; scaling: {tput / base_tput:.2f}x")
@@ -0,0 +1,72 @@
+'''
+Benchmark: shard build throughput (shards/s), the original create_shard_idx.py flow vs the build_shards pipeline
+
+    - original: generate and write every npy (random_floats / random_normal_vectors), then load, train and write
+      every IVF index one at a time
+    - pipeline -j N: build_shards with N worker processes, every shard generated, trained and written in one go
+    - resume: build_shards --resume over a complete build (only metadata is recomputed)
+
+Every mode writes to its own temporary dir. The centroid router and the catalog are not timed (same in all modes).
+
+python scripts/bench_shard_build.py -ns 50 --cluster_size 10000 -d 128 -j 1 2 4
+'''
+
+import os
+import sys
+import time
+import argparse
+import tempfile
+
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from create_shard_idx import build_shards, create_ivf_index, compute_embeds_avgs
+from utils.read_write import save_np_to_file
+from utils.vdb_utils import random_floats, random_normal_vectors, save_index
+
+
+def build_original(npy_root, index_root, num_shards, cluster_size, dim):
+    embeds_centroids = np.zeros((num_shards, dim))
+    for i in range(num_shards):
+        random_mean = random_floats(1, low=-1, high=1)
+        embeds = random_normal_vectors(cluster_size, dim, random_mean[0], 0.5)
+        embeds_centroids[i] = compute_embeds_avgs(embeds)
+        save_np_to_file(os.path.join(npy_root, f"embeds_{i}.npy"), embeds)
+    for i in range(num_shards):
+        index = create_ivf_index(os.path.join(npy_root, f"embeds_{i}.npy"))
+        save_index(index, os.path.join(index_root, f"embeds_{i}.index"))
+
+def timed_build(func, *func_args, **func_kwargs):
+    with tempfile.TemporaryDirectory() as root:
+        npy_root, index_root = os.path.join(root, "npys"), os.path.join(root, "idxs")
+        os.makedirs(npy_root)
+        os.makedirs(index_root)
+        start_time = time.perf_counter()
+        func(npy_root, index_root, *func_args, **func_kwargs)
+        build_time = time.perf_counter() - start_time
+
+        # resume over the complete build
+        resume_time = None
+        if func is build_shards:
+            start_time = time.perf_counter()
+            func(npy_root, index_root, *func_args, resume=True, **func_kwargs)
+            resume_time = time.perf_counter() - start_time
+    return build_time, resume_time
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Shard build throughput")
+    parser.add_argument("-ns", "--num_shards", default=20, help="number of shards", type=int,)
+    parser.add_argument("--cluster_size", default=10000, help="number of embeddings per shard", type=int,)
+    parser.add_argument("-d", "--dim", default=128, help="dimension of embeddings", type=int,)
+    parser.add_argument("-j", "--num_procs", nargs="+", default=[1, os.cpu_count()], help="pipeline worker processes to compare", type=int,)
+    args = parser.parse_args()
+
+    print(f"{args.num_shards} shards of {args.cluster_size}x{args.dim}, {os.cpu_count()} cpus")
+    original_time, _ = timed_build(build_original, args.num_shards, args.cluster_size, args.dim)
+    print(f"      original: {args.num_shards / original_time:.2f} shards/s ({original_time:.2f}s)")
+    for num_procs in sorted(set(args.num_procs)):
+        build_time, resume_time = timed_build(build_shards, args.num_shards, args.cluster_size, args.dim, num_procs=num_procs,
+                                              verbose=False)
+        print(f"pipeline -j {num_procs:>2}: {args.num_shards / build_time:.2f} shards/s ({build_time:.2f}s, "
+              f"{original_time / build_time:.2f}x); resume {args.num_shards / resume_time:.2f} shards/s")
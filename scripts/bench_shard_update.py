@@ -0,0 +1,114 @@
+'''
+Benchmark: incremental shard updates (utils/shard_updater.py) vs rebuilding the shard
+
+For every batch size: ingest throughput (vectors/s) of
+    - append: ShardUpdater.append + commit (quantizer reused, shard file and catalog rewritten)
+    - rebuild: load the shard npy, concatenate the batch, retrain the IVF index and write it (create_shard_idx.py flow)
+and delete throughput (ShardUpdater.delete + commit).
+Then a running SearchEngine is checked to return an appended vector (and no deleted one) without a restart.
+
+Shards are built in a temporary dir with create_shard_idx.build_shards.
+
+python scripts/bench_shard_update.py -ns 8 --cluster_size 10000 -d 128 -b 100 1000 10000
+'''
+
+import os
+import sys
+import time
+import argparse
+import tempfile
+
+import faiss
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from create_shard_idx import build_shards, train_ivf_index
+from serve.engine import SearchEngine
+from utils.centroid_router import build_router_index
+from utils.read_write import load_npy, save_np_to_file
+from utils.shard_catalog import ShardCatalog
+from utils.shard_updater import ShardUpdater
+from utils.vdb_utils import save_index
+
+
+def build(root, args):
+    npy_root, index_root = os.path.join(root, "npys"), os.path.join(root, "idxs")
+    os.makedirs(npy_root)
+    os.makedirs(index_root)
+    shards, centroids, radii, _ = build_shards(npy_root, index_root, args.num_shards, args.cluster_size, args.dim, seed=args.seed,
+                                              verbose=False)
+    save_index(build_router_index(centroids), os.path.join(index_root, "embeds_centroids.index"))
+    ShardCatalog(index_root, shards, centroid_index="embeds_centroids.index", centroids=centroids, radii=radii, dim=args.dim).save()
+    return npy_root, index_root
+
+def new_vectors(updater, shard_id, num_vectors, rng):
+    # around the shard centroid, like its own vectors
+    centroid = updater.catalog.centroids[shard_id]
+    return (centroid + rng.normal(0, 0.5, (num_vectors, len(centroid)))).astype(np.float32)
+
+def rebuild(npy_root, index_root, shard_id, vectors):
+    npy_path = os.path.join(npy_root, f"embeds_{shard_id}.npy")
+    embeds = np.concatenate([load_npy(npy_path), vectors])
+    save_np_to_file(npy_path, embeds)
+    save_index(train_ivf_index(embeds), os.path.join(index_root, f"embeds_{shard_id}.index"))
+
+def check_pickup(index_root, args, rng):
+    # a running engine serves an appended vector and stops serving a deleted one, no restart
+    engine = SearchEngine(index_root, k=args.k, nprobe=args.num_shards, max_index_store=args.num_shards, omp_threads=args.omp_threads)
+    updater = ShardUpdater(index_root)
+    vector = new_vectors(updater, 0, 1, rng)
+    engine.search(vector)
+
+    [new_id] = updater.append(0, vector)
+    updater.commit()
+    start_time = time.perf_counter()
+    D, I, file_idx = engine.search(vector)
+    appended = (I[0, 0] == new_id) and (file_idx[0, 0] == 0) and D[0, 0] < 1e-4
+    refresh_search_time = time.perf_counter() - start_time
+
+    updater.delete(0, [new_id])
+    updater.commit()
+    D, I, file_idx = engine.search(vector)
+    deleted = not ((I[0] == new_id) & (file_idx[0] == 0)).any()
+    print(f"running engine: appended vector served {appended}, deleted vector gone {deleted}; "
+          f"catalog version {engine.stats()['catalog_version']}; first search after an update {refresh_search_time*1e3:.1f}ms")
+    engine.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Incremental shard updates vs rebuild")
+    parser.add_argument("-ns", "--num_shards", default=8, help="number of shards", type=int,)
+    parser.add_argument("--cluster_size", default=10000, help="number of embeddings per shard", type=int,)
+    parser.add_argument("-d", "--dim", default=128, help="dimension of embeddings", type=int,)
+    parser.add_argument("-b", "--batch_sizes", nargs="+", default=[100, 1000, 10000], help="vectors per update", type=int,)
+    parser.add_argument("-k", default=10, help="top k results", type=int,)
+    parser.add_argument("-omp", "--omp_threads", default=3, help="faiss OMP threads", type=int,)
+    parser.add_argument("--seed", default=0, help="random seed", type=int,)
+    args = parser.parse_args()
+
+    faiss.omp_set_num_threads(args.omp_threads)
+    rng = np.random.default_rng(args.seed)
+    with tempfile.TemporaryDirectory() as root:
+        npy_root, index_root = build(root, args)
+        updater = ShardUpdater(index_root)
+        print(f"{args.num_shards} shards of {args.cluster_size}x{args.dim}")
+        for batch_size in args.batch_sizes:
+            # shard 1 for appends, shard 2 for rebuilds: both start from the same size
+            vectors = new_vectors(updater, 1, batch_size, rng)
+            start_time = time.perf_counter()
+            ids = updater.append(1, vectors)
+            updater.commit()
+            append_time = time.perf_counter() - start_time
+
+            start_time = time.perf_counter()
+            rebuild(npy_root, index_root, 2, vectors)
+            rebuild_time = time.perf_counter() - start_time
+
+            start_time = time.perf_counter()
+            updater.delete(1, ids)
+            updater.commit()
+            delete_time = time.perf_counter() - start_time
+            print(f"batch {batch_size:>6}: append {batch_size / append_time:.0f} vectors/s ({append_time*1e3:.1f}ms); "
+                  f"rebuild {batch_size / rebuild_time:.0f} vectors/s ({rebuild_time*1e3:.1f}ms, {rebuild_time / append_time:.1f}x slower); "
+                  f"delete {batch_size / delete_time:.0f} vectors/s ({delete_time*1e3:.1f}ms)")
+        check_pickup(index_root, args, rng)
@@ -0,0 +1,73 @@
+'''
+Benchmark: shard-partitioned worker processes (utils/shard_workers.py), scaling from 1 to N workers
+
+Every configuration gets a fresh SearchEngine (0 workers: everything in this process), one warm-up batch,
+then --repeat timed batches. Reports throughput and the speedup over the in-process engine, checks that
+the partitioned search returns the same distances.
+
+python scripts/bench_shard_workers.py -idx shards/idxs/ -w 0 1 2 4 8 -nq 10000 -mi 1000
+'''
+
+import os
+import sys
+import time
+import argparse
+
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from serve.engine import SearchEngine
+from utils.vdb_utils import random_queries_mix_distribs
+
+
+def run(num_workers, batches, args):
+    engine = SearchEngine(args.idx_root, k=args.k, nprobe=args.nprobe, max_index_store=args.max_index_store,
+                          mem_budget_mb=args.mem_budget_mb, num_loaders=args.num_loaders, omp_threads=args.omp_threads,
+                          shard_workers=num_workers)
+    try:
+        # warm-up: worker start, first loads
+        engine.search(batches[0])
+        results = []
+        start_time = time.perf_counter()
+        for queries in batches[1:]:
+            results.append(engine.search(queries))
+        runtime = time.perf_counter() - start_time
+    finally:
+        engine.close()
+    return runtime, results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Scaling of shard-partitioned worker processes")
+    parser.add_argument("-idx", "--idx_root", required=False, default="shards/idxs/", help="dir to index files", type=str,)
+    parser.add_argument("-w", "--num_workers", nargs="+", default=[0, 1, 2, 4], help="worker processes, 0: in-process (-w 0 1 2 4)", type=int,)
+    parser.add_argument("-nq", "--num_query", default=10000, help="queries per batch", type=int,)
+    parser.add_argument("-r", "--repeat", default=3, help="timed batches", type=int,)
+    parser.add_argument("-np", "--nprobe", default=10, help="a small number (nprobe) of subsets to visit", type=int,)
+    parser.add_argument("-k", default=10, help="top k results", type=int,)
+    parser.add_argument("-mi", "--max_index_store", default=1000, help="max indexes to store (total over the workers)", type=int,)
+    parser.add_argument("-mb", "--mem_budget_mb", default=None, help="memory budget (MB, total over the workers)", type=float,)
+    parser.add_argument("-nl", "--num_loaders", default=4, help="loader threads per worker", type=int,)
+    parser.add_argument("-omp", "--omp_threads", default=None, help="faiss OMP threads (total, default: number of cores)", type=int,)
+    parser.add_argument("-mr", "--mixtures_ratio", default=0., help="mixtures ratio for random queries", type=float,)
+    parser.add_argument("-d", "--dim", default=128, help="dimension of embeddings", type=int,)
+    parser.add_argument("--seed", default=0, help="random seed", type=int,)
+    args = parser.parse_args()
+
+    if args.omp_threads is None:
+        args.omp_threads = os.cpu_count()
+    batches = [random_queries_mix_distribs(args.num_query, args.dim, mixtures_ratio=args.mixtures_ratio, low=-1, high=1, seed=args.seed + i)
+               for i in range(args.repeat + 1)]
+
+    print(f"{args.repeat} batches x {args.num_query} queries; {os.cpu_count()} cores; {args.omp_threads} OMP threads")
+    baseline, reference = None, None
+    for num_workers in args.num_workers:
+        runtime, results = run(num_workers, batches, args)
+        tput = args.repeat * args.num_query / runtime
+        baseline = tput if baseline is None else baseline
+        print(f"workers {num_workers:>2}: {tput:.1f} queries/s; speedup {tput / baseline:.2f}x")
+
+        if reference is None:
+            reference = results
+        for (D1, _, _), (D2, _, _) in zip(reference, results):
+            assert np.allclose(D1, D2, rtol=1e-4, atol=1e-4), "partitioned distances differ"
@@ -0,0 +1,102 @@
+'''
+Benchmark: moving a query batch to a worker process and its results back, pickling vs SharedArena (utils/shared_arena.py)
+
+One round trip = the coordinator hands (num_queries, dim) float32 queries to the worker, the worker reads them and
+returns D (float32), I and file_idx (int64) of shape (num_queries, k). No search, only the transfer:
+    - pickle: arrays are sent through a multiprocessing Pipe (pickled, copied through the socket)
+    - arena: queries are written into shared memory, the worker writes its results in place, only the layout is pickled
+
+python scripts/bench_shared_arena.py -nq 20000 -d 128
+'''
+
+import os
+import sys
+import time
+import pickle
+import argparse
+import multiprocessing
+
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from utils.shared_arena import SharedArena
+
+
+def worker_main(conn, k):
+    arena = None
+    while True:
+        message = conn.recv()
+        if message[0] == "stop":
+            break
+        if message[0] == "pickle":
+            queries = message[1]
+            num_queries = queries.shape[0]
+            conn.send((np.zeros((num_queries, k), dtype=np.float32), np.zeros((num_queries, k), dtype=np.int64),
+                       np.zeros((num_queries, k), dtype=np.int64)))
+        else:
+            layout = message[1]
+            if arena is None or arena.name != layout["name"]:
+                arena = SharedArena.attach(layout)
+            queries = arena["queries"]
+            arena["D"][:] = 0
+            arena["I"][:] = 0
+            arena["file_idx"][:] = 0
+            conn.send(("ok",))
+        # touch the queries like a search would
+        queries.sum()
+        queries = None
+    if arena is not None:
+        arena.close()
+
+
+def roundtrip_pickle(conn, queries, arena):
+    conn.send(("pickle", queries))
+    D, I, file_idx = conn.recv()
+    return D
+
+def roundtrip_arena(conn, queries, arena):
+    arena["queries"][:] = queries
+    conn.send(("arena", arena.layout()))
+    conn.recv()
+    return arena["D"]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Query / result transfer cost, pickling vs shared memory")
+    parser.add_argument("-nq", "--num_query", default=20000, help="number of queries", type=int,)
+    parser.add_argument("-d", "--dim", default=128, help="dimension of embeddings", type=int,)
+    parser.add_argument("-k", default=10, help="top k results", type=int,)
+    parser.add_argument("-r", "--repeat", default=20, help="round trips per mode", type=int,)
+    args = parser.parse_args()
+
+    queries = np.random.default_rng(0).uniform(-1, 1, (args.num_query, args.dim)).astype(np.float32)
+    arena = SharedArena.create({
+        "queries": (queries.shape, np.float32),
+        "D": ((args.num_query, args.k), np.float32),
+        "I": ((args.num_query, args.k), np.int64),
+        "file_idx": ((args.num_query, args.k), np.int64),
+    })
+
+    ctx = multiprocessing.get_context("spawn")
+    parent_conn, child_conn = ctx.Pipe()
+    worker = ctx.Process(target=worker_main, args=(child_conn, args.k), daemon=True)
+    worker.start()
+
+    payload = len(pickle.dumps(queries, protocol=pickle.HIGHEST_PROTOCOL)) / 2**20
+    print(f"{args.num_query}x{args.dim} float32 queries ({payload:.2f} MB pickled), D/I/file_idx {args.num_query}x{args.k}")
+    baseline = None
+    for name, func in [("pickle", roundtrip_pickle), ("arena", roundtrip_arena)]:
+        # first round trip: worker start, arena attach
+        func(parent_conn, queries, arena)
+        runtimes = []
+        for _ in range(args.repeat):
+            start_time = time.perf_counter()
+            func(parent_conn, queries, arena)
+            runtimes.append(time.perf_counter() - start_time)
+        runtime = np.median(runtimes)
+        baseline = runtime if baseline is None else baseline
+        print(f"{name:>6}: round trip {runtime*1e3:.3f}ms; speedup {baseline / runtime:.1f}x")
+
+    parent_conn.send(("stop",))
+    worker.join()
+    arena.unlink()
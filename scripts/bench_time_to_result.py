@@ -0,0 +1,83 @@
+'''
+Benchmark: per-query time to result of index-major search
+
+    - batch: results are returned when the whole batch is done (time to result = batch latency)
+    - stream: search_outterloop_index_async with on_result, shards by batch size
+    - stream + early completion: shards ordered by SearchPlan.order_by_completion
+
+Shards are preloaded (warm store) unless --cold, so only the search order differs.
+
+python scripts/bench_time_to_result.py -idx shards/idxs/ -nq 20000 -mr 0.5
+'''
+
+import os
+import sys
+import time
+import argparse
+
+import faiss
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from utils.index_store import IndexStore
+from utils.dispatcher import Dispatcher
+from utils.vdb_utils import random_queries_mix_distribs, list_shard_indexes
+from utils.search_by_topology import search_outterloop_index_async
+
+
+class ResidentIndexStore(IndexStore):
+    # keep searched shards resident, so every run sees the same warm store
+    def release_index(self, index_path):
+        pass
+
+
+def run(plan, queries, idx_paths, index_store, k, stream):
+    result_times = np.full(queries.shape[0], np.nan)
+    def on_result(q_idxs, D, I, file_idx):
+        result_times[q_idxs] = time.perf_counter() - start_time
+
+    start_time = time.perf_counter()
+    search_outterloop_index_async(plan, queries, k, k, idx_paths, index_store, on_result=on_result if stream else None)
+    runtime = time.perf_counter() - start_time
+    if not stream:
+        result_times[:] = runtime
+    return np.percentile(result_times, 50), np.percentile(result_times, 99), runtime
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Time to result: batch vs streaming index-major search")
+    parser.add_argument("-idx", "--idx_root", required=False, default="shards/idxs/", help="dir to index files", type=str,)
+    parser.add_argument("-np", "--nprobe", default=10, help="a small number (nprobe) of subsets to visit", type=int,)
+    parser.add_argument("-k", default=10, help="top k results", type=int,)
+    parser.add_argument("-nq", "--num_query", default=20000, help="number of queries", type=int,)
+    parser.add_argument("-mr", "--mixtures_ratio", default=0.5, help="mixtures ratio for random queries", type=float,)
+    parser.add_argument("-r", "--repeat", default=3, help="runs per mode", type=int,)
+    parser.add_argument("-omp", "--omp_threads", default=3, help="faiss OMP threads", type=int,)
+    parser.add_argument("-d", "--dim", default=128, help="dimension of embeddings", type=int,)
+    parser.add_argument("--cold", action="store_true", help="load shards on demand instead of preloading them")
+    parser.add_argument("--seed", default=0, help="random seed", type=int,)
+    args = parser.parse_args()
+
+    faiss.omp_set_num_threads(args.omp_threads)
+
+    idx_paths, centriod_idx_paths = list_shard_indexes(args.idx_root)
+
+    queries = random_queries_mix_distribs(args.num_query, args.dim, mixtures_ratio=args.mixtures_ratio, low=-1, high=1, seed=args.seed)
+    dispatcher = Dispatcher(centriod_idx_paths, verbose=False)
+    dispatcher.search_knn_centroids(queries, args.nprobe)
+    plan = dispatcher.create_search_outterloop_index_topology(sort_by_size=True)
+    plan_gen_start = time.perf_counter()
+    early_plan = plan.order_by_completion()
+    print(f"{len(plan)} shards, {args.num_query} queries; early completion ordering: {time.perf_counter() - plan_gen_start:.5f}s")
+
+    for name, mode_plan, stream in [("batch", plan, False), ("stream", plan, True), ("stream + early completion", early_plan, True)]:
+        runs = []
+        for _ in range(args.repeat):
+            store_cls = IndexStore if args.cold else ResidentIndexStore
+            index_store = store_cls(max_indexes=len(idx_paths) + 1)
+            if not args.cold:
+                for file_idx in plan.keys():
+                    index_store.add_index_from_path(idx_paths[file_idx])
+            runs.append(run(mode_plan, queries, idx_paths, index_store, args.k, stream))
+        p50, p99, runtime = np.mean(runs, axis=0)
+        print(f"{name:>25}: p50 {p50:.5f}s; p99 {p99:.5f}s; batch {runtime:.5f}s")
@@ -0,0 +1,92 @@
+'''
+Microbenchmark: merging shard results into the global top k
+
+Compare the old concat + full argsort merge (float64 final matrices) against ResultAccumulator,
+on synthetic index-major shard results (no faiss needed).
+
+python scripts/bench_topk_merge.py -nq 20000 -np 10 -ns 1000 -k 10
+'''
+
+import os
+import sys
+import time
+import argparse
+
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from utils.result_accumulator import ResultAccumulator
+
+
+def make_shard_results(num_queries, nprobe, num_shards, idx_k, seed=0):
+    # index-major topology with random shard assignment, faiss-like sorted results per shard
+    rng = np.random.default_rng(seed)
+    assign = np.argsort(rng.random((num_queries, num_shards)), axis=1)[:, :nprobe]
+    shard_results = []
+    for file_idx in range(num_shards):
+        q_idxs = np.nonzero((assign == file_idx).any(axis=1))[0]
+        if q_idxs.size == 0:
+            continue
+        D = np.sort(rng.random((q_idxs.size, idx_k), dtype=np.float32), axis=1)
+        I = rng.integers(0, 10000, (q_idxs.size, idx_k), dtype=np.int64)
+        shard_results.append((file_idx, q_idxs, D, I))
+    return shard_results
+
+def legacy_merge(shard_results, num_queries, k):
+    # copy of the merge used in search_outterloop_index before ResultAccumulator
+    final_D_matrix = np.ones((num_queries, k)) * np.inf
+    final_I_matrix = np.zeros((num_queries, k))
+    final_file_idx_matrix = np.zeros((num_queries, k))
+    for file_idx, q_idxs, D, I in shard_results:
+        file_idx_m = np.ones_like(D) * file_idx
+        prev_D = final_D_matrix[q_idxs]
+        prev_I = final_I_matrix[q_idxs]
+        prev_file_idx = final_file_idx_matrix[q_idxs]
+        D_concat = np.concatenate((prev_D, D), axis=1)
+        I_concat = np.concatenate((prev_I, I), axis=1)
+        file_idx_concat = np.concatenate((prev_file_idx, file_idx_m), axis=1)
+        sort_idx = np.argsort(D_concat, axis=1)
+        D_concat = np.take_along_axis(D_concat, sort_idx, axis=1)
+        I_concat = np.take_along_axis(I_concat, sort_idx, axis=1)
+        file_idx_concat = np.take_along_axis(file_idx_concat, sort_idx, axis=1)
+        final_D_matrix[q_idxs] = D_concat[:, :k]
+        final_I_matrix[q_idxs] = I_concat[:, :k]
+        final_file_idx_matrix[q_idxs] = file_idx_concat[:, :k]
+    return final_D_matrix, final_I_matrix.astype(int), final_file_idx_matrix.astype(int)
+
+def accumulator_merge(shard_results, num_queries, k):
+    results = ResultAccumulator(num_queries, k)
+    for file_idx, q_idxs, D, I in shard_results:
+        results.add(q_idxs, D, I, file_idx)
+    return results.result()
+
+def time_it(func, repeat, *args):
+    runtimes = []
+    for _ in range(repeat):
+        start_time = time.perf_counter()
+        out = func(*args)
+        runtimes.append(time.perf_counter() - start_time)
+    return min(runtimes), out
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark top k merge of shard results")
+    parser.add_argument("-nq", "--num_query", default=20000, help="number of queries", type=int,)
+    parser.add_argument("-np", "--nprobe", default=10, help="shards visited per query", type=int,)
+    parser.add_argument("-ns", "--num_shards", default=1000, help="number of shards", type=int,)
+    parser.add_argument("-k", default=10, help="top k results", type=int,)
+    parser.add_argument("-r", "--repeat", default=3, help="repeat and report the best run", type=int,)
+    args = parser.parse_args()
+
+    shard_results = make_shard_results(args.num_query, args.nprobe, args.num_shards, args.k)
+
+    legacy_time, legacy_out = time_it(legacy_merge, args.repeat, shard_results, args.num_query, args.k)
+    acc_time, acc_out = time_it(accumulator_merge, args.repeat, shard_results, args.num_query, args.k)
+
+    # same top k distances (ids can differ on ties)
+    assert np.allclose(legacy_out[0], acc_out[0])
+
+    print(f"{len(shard_results)} shard results, {args.num_query} queries, nprobe {args.nprobe}, k {args.k}")
+    print(f"legacy merge:      {legacy_time:.5f}s")
+    print(f"ResultAccumulator: {acc_time:.5f}s")
+    print(f"speedup:           {legacy_time / acc_time:.2f}x")
@@ -0,0 +1,74 @@
+'''
+Microbenchmark: search topology (plan) generation in Dispatcher
+
+Builds the index-major topology (sorted by batch size) and the query-major topology from a random
+(num_queries, nprobe) shard assignment, with the previous nested Python loops + sorted and the NumPy builder.
+No index files needed.
+
+python scripts/bench_topology.py -nq 20000 -np 10 -ns 1000
+'''
+
+import os
+import sys
+import time
+import argparse
+
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from utils.dispatcher import Dispatcher
+
+
+def legacy_index_topology(I):
+    # previous create_search_outterloop_index_topology + sorted in the entry scripts
+    stopology = {}
+    for q_idx, idxs in enumerate(I):
+        for idx in idxs:
+            if idx in stopology:
+                stopology[idx].append(q_idx)
+            else:
+                stopology[idx] = [q_idx]
+    return {k: v for k, v in sorted(stopology.items(), key=lambda item: len(item[1]), reverse=True)}
+
+def legacy_query_topology(I):
+    # previous create_search_outterloop_query_topology
+    stopology = {}
+    for i in range(len(I)):
+        stopology[i] = list(I[i])
+    return stopology
+
+def timeit(func, I, repeat):
+    runtimes = []
+    for _ in range(repeat):
+        start_time = time.perf_counter()
+        func(I)
+        runtimes.append(time.perf_counter() - start_time)
+    return min(runtimes)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark search topology generation")
+    parser.add_argument("-nq", "--num_query", default=20000, help="number of queries", type=int,)
+    parser.add_argument("-np", "--nprobe", default=10, help="shards per query", type=int,)
+    parser.add_argument("-ns", "--num_shards", default=1000, help="number of shards", type=int,)
+    parser.add_argument("-r", "--repeat", default=5, help="runs per builder, best is reported", type=int,)
+    parser.add_argument("--seed", default=0, help="random seed", type=int,)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    # nprobe distinct shards per query, like a centroid search
+    I = np.argsort(rng.random((args.num_query, args.num_shards)), axis=1)[:, :args.nprobe].astype(np.int64)
+
+    legacy = legacy_index_topology(I)
+    new = Dispatcher.search_plan(I, sort_by_size=True)
+    assert [len(v) for v in legacy.values()] == new.sizes.tolist()
+    assert all(np.array_equal(legacy[k], new[k]) for k in new)
+
+    print(f"{args.num_query} queries x nprobe {args.nprobe}, {args.num_shards} shards")
+    for name, legacy_func, new_func in [
+        ("index", legacy_index_topology, lambda I: Dispatcher.search_plan(I, sort_by_size=True)),
+        ("query", legacy_query_topology, lambda I: Dispatcher.search_plan(I, major="query")),
+    ]:
+        legacy_time = timeit(legacy_func, I, args.repeat)
+        new_time = timeit(new_func, I, args.repeat)
+        print(f"{name:>9}: legacy {legacy_time * 1e3:.3f} ms; numpy {new_time * 1e3:.3f} ms; speedup {legacy_time / new_time:.1f}x")
@@ -0,0 +1,78 @@
+'''
+Benchmark: serialization overhead of a query batch and its results, JSON lists vs the binary wire format (serve/wire.py)
+
+Request: (num_queries, dim) float32 queries. Response: D, I, file_idx of shape (num_queries, k).
+Times encode + decode on both sides (no network), .npz framing (np.savez / np.load) is shown for reference.
+
+python scripts/bench_wire.py -nq 10000 -d 128
+'''
+
+import io
+import os
+import sys
+import time
+import argparse
+
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from serve import wire
+
+
+def roundtrip_json(arrays, names, dtypes):
+    body = wire.encode_json(arrays)
+    decoded, _ = wire.decode_json(body, names=names, dtypes=dtypes)
+    return body, decoded
+
+def roundtrip_binary(arrays, names, dtypes):
+    body = wire.encode(arrays)
+    decoded, _ = wire.decode(body)
+    return body, decoded
+
+def roundtrip_npz(arrays, names, dtypes):
+    buffer = io.BytesIO()
+    np.savez(buffer, **arrays)
+    body = buffer.getvalue()
+    with np.load(io.BytesIO(body)) as npz:
+        decoded = {name: npz[name] for name in names}
+    return body, decoded
+
+def bench(func, arrays, dtypes, repeat):
+    names = list(arrays.keys())
+    runtimes = []
+    for _ in range(repeat):
+        start_time = time.perf_counter()
+        body, decoded = func(arrays, names, dtypes)
+        runtimes.append(time.perf_counter() - start_time)
+    for name in names:
+        assert np.array_equal(decoded[name], arrays[name]), name
+    return np.median(runtimes), len(body)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serialization overhead of query batches and results")
+    parser.add_argument("-nq", "--num_query", default=10000, help="number of queries", type=int,)
+    parser.add_argument("-d", "--dim", default=128, help="dimension of embeddings", type=int,)
+    parser.add_argument("-k", default=10, help="top k results", type=int,)
+    parser.add_argument("-r", "--repeat", default=5, help="runs per format", type=int,)
+    parser.add_argument("--seed", default=0, help="random seed", type=int,)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    request = {"queries": rng.uniform(-1, 1, (args.num_query, args.dim)).astype(np.float32)}
+    response = {
+        "D": rng.uniform(0, 10, (args.num_query, args.k)).astype(np.float32),
+        "I": rng.integers(0, 10**6, (args.num_query, args.k)),
+        "file_idx": rng.integers(0, 1000, (args.num_query, args.k)),
+    }
+    dtypes = {"I": np.int64, "file_idx": np.int64}
+
+    print(f"request {args.num_query}x{args.dim} float32; response D/I/file_idx {args.num_query}x{args.k}")
+    baseline = None
+    for name, func in [("json", roundtrip_json), ("npz", roundtrip_npz), ("binary", roundtrip_binary)]:
+        request_time, request_bytes = bench(func, request, dtypes, args.repeat)
+        response_time, response_bytes = bench(func, response, dtypes, args.repeat)
+        total = request_time + response_time
+        baseline = total if baseline is None else baseline
+        print(f"{name:>6}: request {request_time*1e3:.2f}ms ({request_bytes/2**20:.2f} MB); "
+              f"response {response_time*1e3:.2f}ms ({response_bytes/2**20:.2f} MB); speedup {baseline / total:.1f}x")
@@ -0,0 +1,32 @@
+#!/bin/bash
+
+NUM_QUERIES=15000
+K=10
+NPROBE=10
+MIXTURES_RATIO=0.000
+
+mkdir -p logs
+
+# -mi below the working set of the batch (a 15000 queries batch touches most shards)
+for ST in query index_async
+do
+    for MI in 50 100 200 400
+    do
+        for EVICT in LRU LFU topology
+        do
+            echo $ST $MI $EVICT
+            if [ "$EVICT" == "topology" ]; then
+                EVICT_ARGS="--evict topology"
+            else
+                EVICT_ARGS="--ranking_policy $EVICT"
+            fi
+            python query_shard_idx.py -nq $NUM_QUERIES -k $K --nprobe $NPROBE \
+                                        --search_topology $ST \
+                                        --max_index_store $MI \
+                                        --mixtures_ratio $MIXTURES_RATIO \
+                                        $EVICT_ARGS \
+                                        --log logs/st_${ST}_${MI}_${EVICT}.log \
+                                        --seed 0 | tail -n 2
+        done
+    done
+done
@@ -0,0 +1,30 @@
+#!/bin/bash
+
+NUM_QUERIES=15000
+MAX_INDEX_STORE=100
+RANDOM_MRS=100
+TRACE=logs/shard_trace.json
+
+mkdir -p logs
+
+# record the shard access trace once (LRU run), BELADY replays it as an online policy
+# both print the offline OPT hit rate of the trace at -mi, the upper bound for every policy
+for RP in LRU LFU ARC 2Q WTINYLFU BELADY
+do
+    echo $RP
+    if [ "$RP" == "BELADY" ]; then
+        TRACE_ARGS="--trace $TRACE"
+    elif [ "$RP" == "LRU" ]; then
+        TRACE_ARGS="--save_trace $TRACE"
+    else
+        TRACE_ARGS=""
+    fi
+    python squery_shard_idx.py --random_mixtures_ratios $RANDOM_MRS \
+                            -mi $MAX_INDEX_STORE \
+                            --nprobe 10 \
+                            -nq $NUM_QUERIES \
+                            --ranking_policy $RP \
+                            --log logs/rp_${RP}.log \
+                            $TRACE_ARGS \
+                            --seed 42 | tail -n 3
+done
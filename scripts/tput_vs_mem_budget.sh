@@ -5,15 +5,20 @@ NUM_QUERIES=15000
 K=10
 NPROBE=10
 MIXTURES_RATIO=0.000
+# count cap high enough that only the memory budget (MB) limits the store
+# (ARC, 2Q and W-TinyLFU are sized from budget / mean shard size, see IndexStore.policy_capacity)
+MAX_INDEX_STORE=100000
 
-for i in 2 10 20 30 40 50 60 70 80 90 100 110 120 130 140 150
+# one default shard (10000 x 128 float32, IVF) is ~5 MB
+for MB in 10 50 100 150 200 250 300 350 400 450 500 550 600 650 700 750
 do
-    echo $i
+    echo $MB
     python query_shard_idx.py -nq $NUM_QUERIES -k $K --nprobe $NPROBE \
                                 --search_topology $ST \
-                                --max_index_store $i \
+                                --max_index_store $MAX_INDEX_STORE \
+                                --mem_budget_mb $MB \
                                 --mixtures_ratio $MIXTURES_RATIO \
-                                --log logs/st_${ST}_${i}_batch.log \
+                                --log logs/st_${ST}_${MB}mb_batch.log \
                                 --seed 0
     # rm logs/app.log
 done
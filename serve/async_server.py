@@ -0,0 +1,112 @@
+'''
+Asyncio vector search server: concurrent requests are coalesced into one dispatcher batch (serve/batcher.py)
+
+python serve/async_server.py -idx shards/idxs/ -mi 100 --max_batch_size 4096 --max_wait_ms 2
+
+Same endpoints and wire formats as serve/server.py, so serve/client.py and serve/loadgen.py work unchanged:
+POST /vector_search, GET /stats
+'''
+
+import os
+import sys
+import logging
+import argparse
+
+from aiohttp import web
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from serve import wire
+from serve.engine import SearchEngine
+from utils.dispatcher import prune_ratio_arg
+from serve.batcher import CoalescingBatcher
+
+
+async def vector_search(request):
+    batcher = request.app['batcher']
+    binary = request.content_type == wire.CONTENT_TYPE
+    body = await request.read()
+    try:
+        if binary:
+            # read-only views of the request body, no copy
+            arrays, meta = wire.decode(body)
+        else:
+            arrays, meta = wire.decode_json(body, names=['queries'])
+        queries = arrays['queries']
+    except (ValueError, KeyError) as e:
+        return web.json_response({'error': f'Bad request, "queries" array required: {e}'}, status=400)
+
+    if queries.ndim != 2:
+        return web.json_response({'error': f'queries must be 2-d (num_queries, dim), got shape {queries.shape}'}, status=400)
+
+    try:
+        k, nprobe = SearchEngine.check_search_params(meta.get('k'), meta.get('nprobe'))
+    except ValueError as e:
+        return web.json_response({'error': f'Bad request: {e}'}, status=400)
+
+    try:
+        D, I, file_idx = await batcher.search(queries, k=k, nprobe=nprobe)
+    except Exception as e:
+        return web.json_response({'error': f'An error occurred searching the queries: {e}'}, status=500)
+
+    results = {'D': D, 'I': I, 'file_idx': file_idx}
+    if binary:
+        return web.Response(body=wire.encode(results), content_type=wire.CONTENT_TYPE)
+    return web.Response(body=wire.encode_json(results), content_type=wire.JSON_CONTENT_TYPE)
+
+async def stats(request):
+    batcher = request.app['batcher']
+    stats = batcher.engine.stats()
+    stats.update({'batches': batcher.num_batches, 'coalesced_requests': batcher.num_requests})
+    return web.json_response(stats)
+
+def create_app(engine, max_batch_size=4096, max_wait_ms=2.):
+    app = web.Application(client_max_size=1024**3)
+    app['batcher'] = CoalescingBatcher(engine, max_batch_size=max_batch_size, max_wait_ms=max_wait_ms)
+
+    async def start_batcher(app):
+        app['batcher'].start()
+
+    async def stop_batcher(app):
+        await app['batcher'].stop()
+        engine.close()
+
+    app.on_startup.append(start_batcher)
+    app.on_cleanup.append(stop_batcher)
+    app.router.add_post('/vector_search', vector_search)
+    app.router.add_get('/stats', stats)
+    return app
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Asyncio vector search server with request coalescing")
+    parser.add_argument("-idx", "--idx_root", required=False, default="shards/idxs/", help="dir to index files", type=str,)
+    parser.add_argument("-np", "--nprobe", default=10, help="default number of shards to visit per query", type=int,)
+    parser.add_argument("-k", default=10, help="default top k results", type=int,)
+    parser.add_argument("-pr", "--prune_ratio", default=None, help="adaptive nprobe: skip shards whose centroid distance > ratio x the nearest one (>= 1)", type=prune_ratio_arg,)
+    parser.add_argument("-mi", "--max_index_store", default=1000, help="max indexes to store", type=int,)
+    parser.add_argument("-rp", "--ranking_policy", default="LFU", help="index ranking policy", type=str,
+                        choices=["LRU", "LFU", "ARC", "2Q", "WTINYLFU"],)
+    parser.add_argument("--evict", default="rank", choices=["rank", "topology"], help="evict by the ranking policy or the search topology")
+    parser.add_argument("-mb", "--mem_budget_mb", default=None, help="memory budget (MB) for loaded indexes", type=float,)
+    parser.add_argument("--mmap", action="store_true", help="mmap IVF inverted lists instead of reading them into RAM")
+    parser.add_argument("-nl", "--num_loaders", default=4, help="number of concurrent index loader threads", type=int,)
+    parser.add_argument("-sw", "--search_workers", default=1, help="number of shards searched concurrently", type=int,)
+    parser.add_argument("-omp", "--omp_threads", default=3, help="faiss OMP thread budget", type=int,)
+    parser.add_argument("-sh", "--shard_workers", default=0, help="worker processes owning a partition of the shards (0: in-process)", type=int,)
+    parser.add_argument("-bs", "--max_batch_size", default=4096, help="max queries coalesced into one batch (1: per-request execution)", type=int,)
+    parser.add_argument("-mw", "--max_wait_ms", default=2., help="max time a request waits for others to join its batch", type=float,)
+    parser.add_argument("--log", required=False, default="logs/server.log", help="log file", type=str,)
+    parser.add_argument("--host", default="127.0.0.1", help="host to bind", type=str,)
+    parser.add_argument("--port", default=5000, help="port to bind", type=int,)
+    args = parser.parse_args()
+
+    os.makedirs(os.path.dirname(args.log) or ".", exist_ok=True)
+    time_format = "%Y-%m-%d %H:%M:%S"
+    logging.basicConfig(filename=args.log, level=logging.INFO, format="%(asctime)s.%(msecs)03d,%(message)s", datefmt=time_format)
+
+    engine = SearchEngine(args.idx_root, k=args.k, nprobe=args.nprobe, max_index_store=args.max_index_store,
+                          ranking_policy=args.ranking_policy, evict=args.evict, mem_budget_mb=args.mem_budget_mb,
+                          mmap=args.mmap, num_loaders=args.num_loaders, search_workers=args.search_workers,
+                          omp_threads=args.omp_threads, shard_workers=args.shard_workers,
+                          prune_ratio=args.prune_ratio)
+    web.run_app(create_app(engine, max_batch_size=args.max_batch_size, max_wait_ms=args.max_wait_ms), host=args.host, port=args.port)
@@ -0,0 +1,125 @@
+'''
+Request coalescing (dynamic batching) in front of the SearchEngine
+
+Concurrent requests are queued and merged into one dispatcher batch: a batch is closed when it holds max_batch_size
+queries or max_wait_ms after its first request arrived, whichever comes first. The merged batch is searched
+(index-major topology, shards are loaded and searched once for all callers), then D/I/file_idx rows are split back.
+Requests that cannot share a search (different k, nprobe or dim) are searched as separate batches.
+'''
+
+import time
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+
+class CoalescingBatcher:
+    '''
+    asyncio front-end, start() and search() must run on the same event loop
+    '''
+    def __init__(self, engine, max_batch_size=4096, max_wait_ms=2.):
+        '''
+        args:
+            - engine: SearchEngine
+            - max_batch_size: close the batch once it holds this many queries (1: no coalescing, per-request execution)
+            - max_wait_ms: close the batch this long after its first request arrived
+        '''
+        self.engine = engine
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1e3
+        # [(queries, k, nprobe, future, arrival time)], arrival order
+        self.pending = []
+        self.pending_queries = 0
+        self.wakeup = None
+        self.task = None
+        # the engine searches one batch at a time, a single thread keeps the event loop free
+        self.executor = ThreadPoolExecutor(max_workers=1)
+        self.num_batches = 0
+        self.num_requests = 0
+
+    def start(self):
+        self.wakeup = asyncio.Event()
+        self.task = asyncio.get_running_loop().create_task(self.run())
+
+    async def stop(self):
+        self.task.cancel()
+        try:
+            await self.task
+        except asyncio.CancelledError:
+            pass
+        self.executor.shutdown()
+
+    async def search(self, queries, k=None, nprobe=None):
+        '''
+        Queue a request, return its (D, I, file_idx) once the batch it was merged into is searched
+        '''
+        future = asyncio.get_running_loop().create_future()
+        self.pending.append((queries, k, nprobe, future, time.perf_counter()))
+        self.pending_queries += queries.shape[0]
+        self.wakeup.set()
+        return await future
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            if len(self.pending) == 0:
+                await self.wakeup.wait()
+            self.wakeup.clear()
+
+            # wait for more requests until the batch is full or its first request waited max_wait
+            while self.pending_queries < self.max_batch_size:
+                timeout = self.pending[0][-1] + self.max_wait - time.perf_counter()
+                if timeout <= 0:
+                    break
+                try:
+                    await asyncio.wait_for(self.wakeup.wait(), timeout)
+                except asyncio.TimeoutError:
+                    break
+                self.wakeup.clear()
+
+            batch = self.take_batch()
+            for key, requests in self.group(batch).items():
+                await self.execute(loop, key, requests)
+
+    def take_batch(self):
+        # first requests up to max_batch_size queries (at least one request), the rest waits for the next batch
+        size, end = 0, 0
+        while end < len(self.pending) and (end == 0 or size + self.pending[end][0].shape[0] <= self.max_batch_size):
+            size += self.pending[end][0].shape[0]
+            end += 1
+        batch, self.pending = self.pending[:end], self.pending[end:]
+        self.pending_queries -= size
+        return batch
+
+    def group(self, batch):
+        # {(k, nprobe, dim): [request, ...]}, only requests with the same search parameters are merged
+        # (None is the engine default, a request without k merges with one asking for engine.k)
+        groups = {}
+        for request in batch:
+            queries, k, nprobe = request[:3]
+            k = self.engine.k if k is None else k
+            nprobe = self.engine.nprobe if nprobe is None else nprobe
+            groups.setdefault((k, nprobe, queries.shape[1]), []).append(request)
+        return groups
+
+    async def execute(self, loop, key, requests):
+        k, nprobe, _ = key
+        queries = np.concatenate([request[0] for request in requests]) if len(requests) > 1 else requests[0][0]
+        try:
+            D, I, file_idx = await loop.run_in_executor(self.executor, self.engine.search, queries, k, nprobe)
+        except Exception as e:
+            for request in requests:
+                if not request[3].done():
+                    request[3].set_exception(e)
+            return
+
+        self.num_batches += 1
+        self.num_requests += len(requests)
+        # split the rows back to each caller (views, no copy)
+        start = 0
+        for request in requests:
+            end = start + request[0].shape[0]
+            if not request[3].done():
+                request[3].set_result((D[start:end], I[start:end], file_idx[start:end]))
+            start = end
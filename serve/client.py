@@ -1,44 +1,61 @@
 '''
 Client-side code for sending a NumPy query batch to a server via a POST request.
+
+python serve/client.py -nq 100 -k 10
 '''
 
+import os
 import sys
 import argparse
 import requests
 
 import numpy as np
 
-sys.path.append('..')
-from utils.vdb_utils import query_index_file, random_queries_mix_distribs
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from serve import wire
+from utils.vdb_utils import random_queries_mix_distribs
 
-def send_array_to_server(url, array):
+def send_queries_to_server(url, queries, k=None, nprobe=None, session=None, binary=True):
     """
-    Sends a NumPy array to a server via POST request and returns the processed array.
+    Sends a NumPy query batch to the server via POST request and returns the top k results.
 
     Parameters:
-    - url: The URL of the server endpoint expecting the array.
-    - array: The NumPy array to send.
+    - url: The URL of the server endpoint (/vector_search).
+    - queries: (num_queries, dim) NumPy array to search.
+    - k, nprobe: None for the server defaults.
+    - session: optional requests.Session, reuses the connection across requests.
+    - binary: send and receive raw array buffers (serve/wire.py), JSON lists otherwise.
 
     Returns:
-    - A NumPy array returned by the server, or None if an error occurred.
+    - (D, I, file_idx) NumPy arrays of shape (num_queries, k), or None if an error occurred.
     """
+    post = requests.post if session is None else session.post
+    meta = {key: value for key, value in [('k', k), ('nprobe', nprobe)] if value is not None}
     try:
-        # Convert the NumPy array to a list for JSON serialization
-        array_list = array.tolist()
-        
-        # Send the array to the server as JSON and receive the response
-        response = requests.post(url, json={'array': array_list})
-        
+        if binary:
+            body = wire.encode({'queries': np.asarray(queries, dtype=np.float32)}, meta)
+            content_type = wire.CONTENT_TYPE
+        else:
+            body = wire.encode_json({'queries': queries}, meta)
+            content_type = wire.JSON_CONTENT_TYPE
+
+        # Send the queries to the server and receive the response
+        response = post(url, data=body, headers={'Content-Type': content_type})
+
         # Check if the request was successful
         response.raise_for_status()
-        
-        # Convert the response data back into a NumPy array
-        processed_array = np.array(response.json()['processed_array'])
-        return processed_array
+
+        # Decode the response data into NumPy arrays
+        if binary:
+            results, _ = wire.decode(response.content)
+        else:
+            results, _ = wire.decode_json(response.content, names=['D', 'I', 'file_idx'],
+                                          dtypes={'I': np.int64, 'file_idx': np.int64})
+        return results['D'], results['I'], results['file_idx']
 
     except requests.RequestException as e:
         print(f"Request error: {e}")
-    except ValueError as e:
+    except (ValueError, KeyError) as e:
         print(f"Error processing response data: {e}")
     return None
 
@@ -59,16 +76,21 @@ def batch_query_generator(num_queries, dim, mixtures_ratio, seed):
 
 def main(args):
     # The server URL
-    url = 'http://127.0.0.1:5000/vector_search'
+    url = args.url
     
     # Create a NumPy array to send
     query_batch = batch_query_generator(args.num_query, args.dim, args.mixtures_ratio, args.seed)
     
     print("Sending query_batch ({}) to server:".format(query_batch.shape))
-    topk_results = send_array_to_server(url, query_batch)
+    topk_results = send_queries_to_server(url, query_batch, k=args.k, nprobe=args.nprobe, binary=not args.json)
     
     if topk_results is not None:
-        print("Responses from server: {}".format(topk_results.shape))
+        D, I, file_idx = topk_results
+        print("Responses from server: D {}, I {}, file_idx {}".format(D.shape, I.shape, file_idx.shape))
+        if args.verbose:
+            print(D)
+            print(I)
+            print(file_idx)
     else:
         print("Failed to receive a valid response from the server.")
     return topk_results
@@ -79,10 +101,11 @@ if __name__ == "__main__":
     parser.add_argument("-k", default=3, help="top k results", type=int,)
     parser.add_argument("-nq", "--num_query", default=5, help="number of queries", type=int,)
     parser.add_argument("-mr", "--mixtures_ratio", default=0., help="mixtures ratio for random queries", type=float,)
-    parser.add_argument("-st", "--search_topology", default="index", 
-                        help="search topology: <index>, <query> or <index_async>", type=str,)
+    parser.add_argument("--url", default="http://127.0.0.1:5000/vector_search", help="server endpoint", type=str,)
+    parser.add_argument("--json", action="store_true", help="send JSON lists instead of the binary wire format")
     parser.add_argument("-d", "--dim", default=128, help="dimension of embeddings", type=int,)
     parser.add_argument("--seed", default=None, help="random seed", type=int,)
+    parser.add_argument("--verbose", action="store_true", help="print the results")
     args = parser.parse_args()
     
     topk_results = main(args)
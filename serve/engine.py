@@ -0,0 +1,212 @@
+'''
+Serving engine: one long-lived IndexStore, IndexManager, Dispatcher and loader pool shared by all requests
+
+Every request is a query batch searched with the index_async topology (same flow as squery_shard_idx.py):
+    1. route the batch to its shards (centroid search, concurrent with other requests)
+    2. drop the stale shards, search the ones in DRAM first, prefetch the rest in plan order
+    3. search, then reload the hot shards (index_manager ranking) for the next request
+Steps 2-3 own the store's plan, protected set and load queue, so concurrent requests are searched one at a time.
+With shard_workers > 0, steps 2-3 run in worker processes that each own a partition of the shards (utils/shard_workers.py).
+Shard updates committed by a ShardUpdater are picked up at the start of the next request (refresh).
+'''
+
+import time
+import numbers
+import threading
+
+import faiss
+import numpy as np
+
+from utils.index_store import IndexStore, ThreadDataLoaderPool
+from utils.dispatcher import Dispatcher
+from utils.centroid_router import CentroidRouter
+from utils.index_manager import IndexManager
+from utils.search_by_topology import search_outterloop_index_async
+from utils.shard_workers import ShardWorkerPool
+from utils.shard_catalog import ShardCatalog
+
+
+class SearchEngine:
+    '''
+    Sharded vector search over the indexes of idx_root, thread safe
+    '''
+    def __init__(self, idx_root, k=10, nprobe=10, max_index_store=1000, ranking_policy="LFU", evict="rank",
+                 mem_budget_mb=None, mmap=False, num_loaders=4, search_workers=1, omp_threads=3, shard_workers=0, prune_ratio=None,
+                 verbose=False):
+        '''
+        args:
+            - idx_root: dir to index files (see create_shard_idx.py)
+            - k, nprobe: defaults of every request
+            - prune_ratio: adaptive nprobe, skip shards whose centroid is prune_ratio x farther than the nearest (Dispatcher.prune_shards)
+            - max_index_store, ranking_policy, evict, mem_budget_mb, mmap: IndexStore / IndexManager settings
+            - num_loaders: index loader threads
+            - search_workers, omp_threads: shards searched concurrently and their faiss OMP thread budget
+            - shard_workers: 0 searches in this process, N > 0 partitions the shards across N worker processes
+              (max_index_store, mem_budget_mb and omp_threads are split across them)
+        '''
+        if prune_ratio is not None and not prune_ratio >= 1:
+            raise ValueError(f"prune_ratio must be >= 1, got {prune_ratio}")
+        self.k = k
+        self.nprobe = nprobe
+        self.prune_ratio = prune_ratio
+        self.max_index_store = max_index_store
+        self.search_workers = search_workers
+        self.omp_threads = omp_threads
+        faiss.omp_set_num_threads(omp_threads)
+
+        # shard ids from the catalog (create_shard_idx.py), or the directory listing without one
+        self.idx_root = idx_root
+        self.catalog = ShardCatalog.open(idx_root)
+        self.idx_paths, self.centriod_idx_paths = self.catalog.paths, self.catalog.centroid_index_path
+        self.idxpath2id_map = {idx_path: idx for idx, idx_path in enumerate(self.idx_paths)}
+
+        self.dispatcher = Dispatcher(self.centriod_idx_paths, verbose=verbose, catalog=self.catalog)
+
+        # the shards are searched either here (local store and loaders) or by the worker processes, never both
+        self.index_manager = self.index_store = self.index_loader = self.shard_workers = None
+        if shard_workers > 0:
+            self.shard_workers = ShardWorkerPool(self.idx_paths, shard_workers, max_index_store=max_index_store,
+                                                 mem_budget_mb=mem_budget_mb, ranking_policy=ranking_policy, evict=evict, mmap=mmap,
+                                                 num_loaders=num_loaders, omp_threads=max(1, omp_threads // shard_workers))
+        else:
+            self.index_manager = IndexManager(policy=ranking_policy, capacity=max_index_store)
+            self.index_store = IndexStore(max_indexes=max_index_store, index_manager=self.index_manager, mmap=mmap,
+                                          mem_budget_mb=mem_budget_mb, evict_policy=evict, catalog=self.catalog)
+            self.index_loader = ThreadDataLoaderPool(self.index_store, self.idx_paths, num_loaders=num_loaders)
+            self.index_store.set_index_loader(self.index_loader)
+            self.index_loader.start()
+
+        # one search at a time owns the store's plan and load queue
+        self.search_lock = threading.Lock()
+        self.stats_lock = threading.Lock()
+        self.num_requests = 0
+        self.num_queries = 0
+        self.search_time = 0.
+        self.num_refreshes = 0
+
+    @staticmethod
+    def check_search_params(k=None, nprobe=None):
+        '''
+        Request parameters, raises ValueError unless each is None (engine default) or an integer >= 1
+        return:
+            - k, nprobe as int (or None)
+        '''
+        params = []
+        for name, value in [("k", k), ("nprobe", nprobe)]:
+            if value is not None and (isinstance(value, bool) or not isinstance(value, numbers.Integral) or value < 1):
+                raise ValueError(f"{name} must be an integer >= 1, got {value!r}")
+            params.append(None if value is None else int(value))
+        return tuple(params)
+
+    def search(self, queries, k=None, nprobe=None):
+        '''
+        args:
+            - queries: (num_queries, dim) float32
+            - k, nprobe: None for the engine defaults, else integers >= 1 (ValueError)
+        return:
+            - D, I, file_idx: (num_queries, k), file_idx is the shard (position in self.idx_paths) of every result
+        '''
+        # committed shard updates, one stat when nothing changed
+        k, nprobe = self.check_search_params(k, nprobe)
+        self.refresh()
+        k = self.k if k is None else k
+        nprobe = self.nprobe if nprobe is None else nprobe
+        queries = np.ascontiguousarray(queries, dtype=np.float32)
+
+        # stateless, overlaps with the search of another request
+        D, I = self.dispatcher.route(queries, nprobe)
+        if self.prune_ratio is not None:
+            I = self.dispatcher.prune_shards(D, I, self.prune_ratio)
+        rstopology = self.dispatcher.search_plan(I, sort_by_size=True, shard_bytes=self.dispatcher.shard_bytes)
+
+        if self.shard_workers is not None:
+            with self.search_lock:
+                start_time = time.perf_counter()
+                D, I, file_idx = self.shard_workers.search(queries, rstopology, k)
+                runtime = time.perf_counter() - start_time
+            self.update_stats(queries.shape[0], runtime)
+            return D, I, file_idx
+
+        with self.search_lock:
+            start_time = time.perf_counter()
+            index_store, index_loader, idx_paths = self.index_store, self.index_loader, self.idx_paths
+
+            # indexes already in DRAM first, drop the ones this request does not need
+            rstopology = index_store.cleanup(stopology=rstopology, idxpath2id_map=self.idxpath2id_map)
+            index_loader.pause_loading()
+            index_loader.update_files_to_load([idx_paths[idx] for idx in rstopology.keys()])
+            index_store.set_search_plan([idx_paths[idx] for idx in rstopology.keys()])
+            index_loader.resume_loading()
+
+            D, I, file_idx = search_outterloop_index_async(rstopology, queries, k, k, idx_paths, index_store,
+                                                           num_workers=self.search_workers, omp_threads=self.omp_threads)
+
+            # warm the store for the next request
+            index_loader.pause_loading()
+            index_loader.update_files_to_load(self.index_manager.get_head_index(k=self.max_index_store))
+            index_loader.resume_loading()
+            runtime = time.perf_counter() - start_time
+
+        self.update_stats(queries.shape[0], runtime)
+        return D, I, file_idx
+
+    def refresh(self):
+        '''
+        Pick up committed shard updates (utils/shard_updater.py) without a restart: if the catalog file changed, reload it
+        and the router, and drop the resident copies of the updated shards (reloaded from their new files when needed)
+
+        return:
+            - paths of the invalidated shards
+        '''
+        if not self.catalog.is_stale():
+            return []
+        with self.search_lock:
+            # another request may have refreshed meanwhile
+            if not self.catalog.is_stale():
+                return []
+            catalog = ShardCatalog.load(self.idx_root)
+            if catalog is None or catalog.paths != self.idx_paths:
+                raise RuntimeError(f"shard set of {self.idx_root} changed, restart the engine")
+            changed = self.catalog.changed_paths(catalog)
+            self.dispatcher.router = CentroidRouter.from_file(catalog.centroid_index_path)
+            self.catalog = self.dispatcher.catalog = catalog
+            if self.shard_workers is not None:
+                if len(changed) > 0:
+                    self.shard_workers.invalidate([self.idxpath2id_map[idx_path] for idx_path in changed])
+            else:
+                self.index_store.catalog = catalog
+                for idx_path in changed:
+                    self.index_store.invalidate(idx_path)
+        with self.stats_lock:
+            self.num_refreshes += 1
+        return changed
+
+    def update_stats(self, num_queries, runtime):
+        with self.stats_lock:
+            self.num_requests += 1
+            self.num_queries += num_queries
+            self.search_time += runtime
+
+    def stats(self):
+        with self.stats_lock:
+            return {
+                "requests": self.num_requests,
+                "queries": self.num_queries,
+                "search_time": self.search_time,
+                # local store only, None with shard workers (each worker has its own)
+                "hit_rate": None if self.index_store is None else self.index_store.hit_rate(),
+                "hits": None if self.index_store is None else self.index_store.hits,
+                "misses": None if self.index_store is None else self.index_store.misses,
+                "loaded_indexes": None if self.index_store is None else self.index_store.num_indexes,
+                "num_shards": len(self.idx_paths),
+                "shard_workers": 0 if self.shard_workers is None else self.shard_workers.num_workers,
+                "catalog_version": self.catalog.version,
+                "refreshes": self.num_refreshes,
+            }
+
+    def close(self):
+        if self.shard_workers is not None:
+            self.shard_workers.close()
+        else:
+            self.index_loader.stop_loading()
+            self.index_loader.join()
@@ -0,0 +1,83 @@
+'''
+Load generator: concurrent clients send query batches to the server, report throughput and latency percentiles
+
+Every client is a thread with its own connection, sending its requests back to back (closed loop).
+Query batches are generated before the clock starts.
+
+python serve/server.py -idx shards/idxs/ &
+python serve/loadgen.py -c 8 -nr 200 -nq 16
+'''
+
+import os
+import sys
+import time
+import argparse
+import threading
+
+import numpy as np
+import requests
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from serve.client import send_queries_to_server, batch_query_generator
+
+
+def run_client(url, batches, k, nprobe, binary, latencies, failures):
+    session = requests.Session()
+    for queries in batches:
+        start_time = time.perf_counter()
+        results = send_queries_to_server(url, queries, k=k, nprobe=nprobe, session=session, binary=binary)
+        latencies.append(time.perf_counter() - start_time)
+        if results is None:
+            failures.append(1)
+
+
+def generate_load(url, num_clients, num_requests, num_queries, dim, k=None, nprobe=None, mixtures_ratio=0., seed=None, binary=True):
+    '''
+    args:
+        - num_clients: concurrent clients
+        - num_requests: total requests, split across the clients
+        - num_queries: queries per request
+        - binary: binary wire format (serve/wire.py), JSON otherwise
+    return:
+        - runtime (s), latencies (s) of every request, number of failed requests
+    '''
+    rng = np.random.default_rng(seed)
+    client_batches = [[] for _ in range(num_clients)]
+    for i in range(num_requests):
+        batch_seed = None if seed is None else int(rng.integers(2**31))
+        client_batches[i % num_clients].append(batch_query_generator(num_queries, dim, mixtures_ratio, batch_seed))
+
+    latencies, failures = [], []
+    threads = [threading.Thread(target=run_client, args=(url, batches, k, nprobe, binary, latencies, failures))
+               for batches in client_batches]
+    start_time = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    runtime = time.perf_counter() - start_time
+    return runtime, np.array(latencies), len(failures)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Measure QPS and latency of the vector search server")
+    parser.add_argument("--url", default="http://127.0.0.1:5000/vector_search", help="server endpoint", type=str,)
+    parser.add_argument("-c", "--num_clients", nargs="+", default=[1, 4, 16], help="concurrent clients, one run each (-c 1 4 16)", type=int,)
+    parser.add_argument("-nr", "--num_requests", default=100, help="requests per run", type=int,)
+    parser.add_argument("-nq", "--num_query", default=16, help="queries per request", type=int,)
+    parser.add_argument("-np", "--nprobe", default=None, help="shards to visit per query (server default if not set)", type=int,)
+    parser.add_argument("-k", default=None, help="top k results (server default if not set)", type=int,)
+    parser.add_argument("-mr", "--mixtures_ratio", default=0., help="mixtures ratio for random queries", type=float,)
+    parser.add_argument("--json", action="store_true", help="send JSON lists instead of the binary wire format")
+    parser.add_argument("-d", "--dim", default=128, help="dimension of embeddings", type=int,)
+    parser.add_argument("--seed", default=0, help="random seed", type=int,)
+    args = parser.parse_args()
+
+    print(f"{args.num_requests} requests x {args.num_query} queries")
+    for num_clients in args.num_clients:
+        runtime, latencies, num_failed = generate_load(args.url, num_clients, args.num_requests, args.num_query, args.dim,
+                                                       k=args.k, nprobe=args.nprobe, mixtures_ratio=args.mixtures_ratio, seed=args.seed,
+                                                       binary=not args.json)
+        p50, p95, p99 = np.percentile(latencies, [50, 95, 99]) * 1e3
+        print(f"clients {num_clients:>3}: {args.num_requests / runtime:.1f} requests/s; {args.num_requests * args.num_query / runtime:.1f} queries/s; "
+              f"latency p50 {p50:.2f}ms; p95 {p95:.2f}ms; p99 {p99:.2f}ms; failed {num_failed}")
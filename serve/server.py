@@ -1,40 +1,97 @@
-from flask import Flask, request, jsonify
-import numpy as np
+'''
+Vector search server: query batches in, top k (D, I, shard) out, searched by a long-lived SearchEngine
 
-# app = Flask(__name__)
-app = Flask("Vector_search server")
+python serve/server.py -idx shards/idxs/ -mi 100
+
+POST /vector_search, the response uses the request's format (see serve/wire.py)
+    - binary: arrays {queries}, meta {k, nprobe} -> arrays {D, I, file_idx}
+    - JSON: {"queries": [[...], ...], "k": 10, "nprobe": 10} -> {"D": [[...]], "I": [[...]], "file_idx": [[...]]}
+GET /stats -> engine counters (requests, hit rate, ...)
+'''
+
+import os
+import sys
+import logging
+import argparse
 
-def process_array(arr):
-    """
-    Example processing function that multiplies each element by 2.
-    
-    Parameters:
-    - arr: NumPy array to process.
-    
-    Returns:
-    - Processed NumPy array.
-    """
-    return arr * 10
+from flask import Flask, Response, request, jsonify
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from serve import wire
+from serve.engine import SearchEngine
+from utils.dispatcher import prune_ratio_arg
+
+app = Flask("Vector_search server")
+engine = None
 
 @app.route('/vector_search', methods=['POST'])
-def handle_array():
-    if not request.json or 'array' not in request.json:
-        return jsonify({'error': 'Bad request, JSON with "array" key required'}), 400
-    
+def vector_search():
+    binary = request.mimetype == wire.CONTENT_TYPE
+    try:
+        if binary:
+            # read-only views of the request body, no copy
+            arrays, meta = wire.decode(request.get_data())
+        else:
+            arrays, meta = wire.decode_json(request.get_data(), names=['queries'])
+        queries = arrays['queries']
+    except (ValueError, KeyError) as e:
+        return jsonify({'error': f'Bad request, "queries" array required: {e}'}), 400
+
+    if queries.ndim != 2:
+        return jsonify({'error': f'queries must be 2-d (num_queries, dim), got shape {queries.shape}'}), 400
+
     try:
-        # Convert the JSON array to a NumPy array
-        input_array = np.array(request.json['array'])
-        print("Received array from client with shape: {}\n".format(input_array.shape))
-        
-        # Process the array
-        processed_array = process_array(input_array)
-        
-        # Convert the NumPy array back to a list for JSON serialization
-        processed_list = processed_array.tolist()
-        
-        return jsonify({'processed_array': processed_list})
+        k, nprobe = SearchEngine.check_search_params(meta.get('k'), meta.get('nprobe'))
+    except ValueError as e:
+        return jsonify({'error': f'Bad request: {e}'}), 400
+
+    try:
+        D, I, file_idx = engine.search(queries, k=k, nprobe=nprobe)
     except Exception as e:
-        return jsonify({'error': f'An error occurred processing the array: {e}'}), 500
+        return jsonify({'error': f'An error occurred searching the queries: {e}'}), 500
+
+    results = {'D': D, 'I': I, 'file_idx': file_idx}
+    if binary:
+        return Response(wire.encode(results), mimetype=wire.CONTENT_TYPE)
+    return Response(wire.encode_json(results), mimetype=wire.JSON_CONTENT_TYPE)
+
+@app.route('/stats', methods=['GET'])
+def stats():
+    return jsonify(engine.stats())
+
 
 if __name__ == '__main__':
-    app.run(debug=True, port=5000)
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Vector search server over sharded indexes")
+    parser.add_argument("-idx", "--idx_root", required=False, default="shards/idxs/", help="dir to index files", type=str,)
+    parser.add_argument("-np", "--nprobe", default=10, help="default number of shards to visit per query", type=int,)
+    parser.add_argument("-k", default=10, help="default top k results", type=int,)
+    parser.add_argument("-pr", "--prune_ratio", default=None, help="adaptive nprobe: skip shards whose centroid distance > ratio x the nearest one (>= 1)", type=prune_ratio_arg,)
+    parser.add_argument("-mi", "--max_index_store", default=1000, help="max indexes to store", type=int,)
+    parser.add_argument("-rp", "--ranking_policy", default="LFU", help="index ranking policy", type=str,
+                        choices=["LRU", "LFU", "ARC", "2Q", "WTINYLFU"],)
+    parser.add_argument("--evict", default="rank", choices=["rank", "topology"], help="evict by the ranking policy or the search topology")
+    parser.add_argument("-mb", "--mem_budget_mb", default=None, help="memory budget (MB) for loaded indexes", type=float,)
+    parser.add_argument("--mmap", action="store_true", help="mmap IVF inverted lists instead of reading them into RAM")
+    parser.add_argument("-nl", "--num_loaders", default=4, help="number of concurrent index loader threads", type=int,)
+    parser.add_argument("-sw", "--search_workers", default=1, help="number of shards searched concurrently", type=int,)
+    parser.add_argument("-omp", "--omp_threads", default=3, help="faiss OMP thread budget", type=int,)
+    parser.add_argument("-sh", "--shard_workers", default=0, help="worker processes owning a partition of the shards (0: in-process)", type=int,)
+    parser.add_argument("--log", required=False, default="logs/server.log", help="log file", type=str,)
+    parser.add_argument("--host", default="127.0.0.1", help="host to bind", type=str,)
+    parser.add_argument("--port", default=5000, help="port to bind", type=int,)
+    args = parser.parse_args()
+
+    os.makedirs(os.path.dirname(args.log) or ".", exist_ok=True)
+    time_format = "%Y-%m-%d %H:%M:%S"
+    logging.basicConfig(filename=args.log, level=logging.INFO, format="%(asctime)s.%(msecs)03d,%(message)s", datefmt=time_format)
+
+    engine = SearchEngine(args.idx_root, k=args.k, nprobe=args.nprobe, max_index_store=args.max_index_store,
+                          ranking_policy=args.ranking_policy, evict=args.evict, mem_budget_mb=args.mem_budget_mb,
+                          mmap=args.mmap, num_loaders=args.num_loaders, search_workers=args.search_workers,
+                          omp_threads=args.omp_threads, shard_workers=args.shard_workers,
+                          prune_ratio=args.prune_ratio)
+    try:
+        # concurrent requests: one thread each, routing overlaps, the engine serializes the search
+        app.run(host=args.host, port=args.port, threaded=True)
+    finally:
+        engine.close()
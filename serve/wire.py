@@ -0,0 +1,104 @@
+'''
+Wire format of query batches and results between serve/client.py and serve/server.py
+
+    - binary (CONTENT_TYPE): raw array buffers behind a small header, decoded with np.frombuffer (no copy, no parsing)
+        magic (4 bytes) | header length (uint32 little endian) | JSON header | padding | buffer 0 | padding | buffer 1 ...
+        header: {"arrays": [{"name", "dtype", "shape", "offset"}, ...], "meta": {...}}, buffers are 64-byte aligned
+    - JSON (JSON_CONTENT_TYPE): fallback, nested lists ({name: array.tolist(), **meta})
+'''
+
+import json
+import struct
+
+import numpy as np
+
+CONTENT_TYPE = "application/x-ndarrays"
+JSON_CONTENT_TYPE = "application/json"
+MAGIC = b"NDA1"
+PREFIX = struct.Struct("<4sI")
+ALIGN = 64
+
+
+def align(offset):
+    return (offset + ALIGN - 1) // ALIGN * ALIGN
+
+def encode(arrays, meta=None):
+    '''
+    args:
+        - arrays: {name: np.ndarray}, numeric dtypes only
+        - meta: JSON serializable dict sent along (k, nprobe, ...)
+    return:
+        - bytearray, the arrays are copied once (into the body)
+    '''
+    arrays = {name: np.ascontiguousarray(array) for name, array in arrays.items()}
+    specs = []
+    offset = 0
+    for name, array in arrays.items():
+        offset = align(offset)
+        specs.append({"name": name, "dtype": array.dtype.str, "shape": list(array.shape), "offset": offset})
+        offset += array.nbytes
+    header = json.dumps({"arrays": specs, "meta": meta or {}}).encode()
+    data_start = align(PREFIX.size + len(header))
+
+    body = bytearray(data_start + offset)
+    PREFIX.pack_into(body, 0, MAGIC, len(header))
+    body[PREFIX.size:PREFIX.size+len(header)] = header
+    out = np.frombuffer(body, dtype=np.uint8)
+    for spec, array in zip(specs, arrays.values()):
+        start = data_start + spec["offset"]
+        out[start:start+array.nbytes] = array.reshape(-1).view(np.uint8)
+    return body
+
+def decode(body):
+    '''
+    args:
+        - body: bytes-like from encode
+    return:
+        - ({name: np.ndarray}, meta), the arrays are read-only views of body (zero copy)
+    '''
+    body = memoryview(body)
+    if len(body) < PREFIX.size:
+        raise ValueError("truncated body")
+    magic, header_len = PREFIX.unpack_from(body, 0)
+    if magic != MAGIC:
+        raise ValueError(f"bad magic {bytes(magic)!r}, not a {CONTENT_TYPE} body")
+    header = json.loads(bytes(body[PREFIX.size:PREFIX.size+header_len]))
+    if not isinstance(header, dict) or not isinstance(header.get("arrays"), list) or not isinstance(header.get("meta"), dict):
+        raise ValueError("bad header, expected {\"arrays\": [...], \"meta\": {...}}")
+    data_start = align(PREFIX.size + header_len)
+
+    arrays = {}
+    for spec in header["arrays"]:
+        # malformed fields are a bad request (ValueError), not a server error
+        try:
+            name, dtype, offset = spec["name"], np.dtype(spec["dtype"]), int(spec["offset"])
+            shape = [int(n) for n in spec["shape"]]
+        except (KeyError, TypeError, ValueError) as e:
+            raise ValueError(f"bad array header {spec!r}: {e}")
+        if not isinstance(name, str) or offset < 0 or any(n < 0 for n in shape):
+            raise ValueError(f"bad array header {spec!r}")
+        if dtype.hasobject:
+            raise ValueError(f"unsupported dtype {dtype}")
+        count = int(np.prod(shape, dtype=np.int64))
+        start = data_start + offset
+        if start + count * dtype.itemsize > len(body):
+            raise ValueError(f"truncated body, array {name}")
+        arrays[name] = np.frombuffer(body, dtype=dtype, count=count, offset=start).reshape(shape)
+    return arrays, header["meta"]
+
+def encode_json(arrays, meta=None):
+    return json.dumps({**(meta or {}), **{name: np.asarray(array).tolist() for name, array in arrays.items()}}).encode()
+
+def decode_json(body, names, dtypes=None):
+    '''
+    args:
+        - names: keys holding arrays, the other keys are returned as meta
+        - dtypes: {name: dtype}, default float32
+    '''
+    dtypes = dtypes or {}
+    obj = json.loads(body) if isinstance(body, (bytes, bytearray, str)) else body
+    if not isinstance(obj, dict):
+        raise ValueError("bad body, expected a JSON object")
+    arrays = {name: np.array(obj[name], dtype=dtypes.get(name, np.float32)) for name in names}
+    meta = {key: value for key, value in obj.items() if key not in names}
+    return arrays, meta
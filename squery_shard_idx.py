@@ -10,31 +10,58 @@ import faiss
 # import asyncio
 import logging
 import argparse
-import threading
 
 import numpy as np
-from pprint import pprint
+from concurrent.futures import ThreadPoolExecutor
 
-from utils.index_store import IndexStore, ThreadDataLoader, ProcessDataLoader
-from utils.dispatcher import Dispatcher
+from utils.index_store import IndexStore, ThreadDataLoaderPool
+from utils.dispatcher import Dispatcher, prune_ratio_arg
+from utils.shard_catalog import ShardCatalog
 from utils.index_manager import IndexManager
-from utils.vdb_utils import random_floats, random_normal_vectors, query_index_file, random_queries_mix_distribs
-from utils.search_by_topology import search_outterloop_index, search_outterloop_query, search_outterloop_index_async, query_to_index_stopology
+from utils.ranking_policies import opt_hit_rate, demand_hit_rate
+from utils.read_write import save_json_to_file, load_json
+from utils.vdb_utils import random_queries_mix_distribs
+from utils.search_by_topology import search_outterloop_index_async
 
 
-faiss.omp_set_num_threads(3)
+def generate_and_route(dispatcher, mr, num_queries, dim, nprobe, seed, prune_ratio=None):
+    '''
+    Generate a query batch and route it to the shards: (queries, search topology sorted by batch size)
+    '''
+    qb = random_queries_mix_distribs(num_queries, dim, mixtures_ratio=mr, low=-1, high=1, seed=seed)
+    D, I = dispatcher.route(qb, nprobe)
+    if prune_ratio is not None:
+        I = dispatcher.prune_shards(D, I, prune_ratio)
+    # sort rs topology by length of values
+    rstopology = dispatcher.search_plan(I, sort_by_size=True, shard_bytes=dispatcher.shard_bytes)
+    return qb, rstopology
+
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Query shard index for vector database")
     parser.add_argument("-idx", "--idx_root", required=False, default="shards/idxs/", help="dir to index files", type=str,)
     parser.add_argument("-np", "--nprobe", default=10, help="a small number (nprobe) of subsets to visit", type=int,)
     parser.add_argument("-k", default=10, help="top k results", type=int,)
+    parser.add_argument("-pr", "--prune_ratio", default=None, help="adaptive nprobe: skip shards whose centroid distance > ratio x the nearest one (>= 1)", type=prune_ratio_arg,)
     parser.add_argument("-nq", "--num_query", default=10000, help="number of queries", type=int,)
     parser.add_argument("-num_mr", "--random_mixtures_ratios", default=None, help="generate random mixtures ratios", type=int,)
     parser.add_argument("-mr", "--mixtures_ratios", nargs="+", default=[0.], help="mixtures ratio for random queries (-mr 0. 0.001 0.1)", type=float,)
-    parser.add_argument("-rp", "--ranking_policy", required=False, default="LRU", help="LRU or LFU", type=str,)
+    parser.add_argument("-rp", "--ranking_policy", required=False, default="LRU", help="LRU, LFU, ARC, 2Q, WTINYLFU or BELADY (needs --trace)", type=str,
+                        choices=["LRU", "LFU", "ARC", "2Q", "WTINYLFU", "BELADY"],)
+    parser.add_argument("--evict_unused", action="store_true", help="at capacity, evict resident shards the batch does not use before searching")
+    parser.add_argument("--evict", default="rank", choices=["rank", "topology"], 
+                        help="evict by the ranking policy, or the shard used farthest in the batch's search topology")
+    parser.add_argument("--trace", default=None, help="BELADY: shard access trace (json) recorded with --save_trace", type=str,)
+    parser.add_argument("--save_trace", default=None, help="save the shard access trace (json) of this run", type=str,)
+    parser.add_argument("--lfu_decay", default=None, help="LFU: halve frequencies every N shard accesses", type=int,)
     parser.add_argument("--log", required=False, default="logs/app.log", help="log file", type=str,)
     parser.add_argument("-mi", "--max_index_store", default=1000, help="max indexes to store", type=int,)
+    parser.add_argument("-mb", "--mem_budget_mb", default=None, help="memory budget (MB) for loaded indexes, evict by ranking to fit", type=float,)
+    parser.add_argument("-omp", "--omp_threads", default=3, help="faiss OMP thread budget (split across search workers)", type=int,)
+    parser.add_argument("-sw", "--search_workers", default=1, help="number of shards searched concurrently (index_async)", type=int,)
+    parser.add_argument("-nl", "--num_loaders", default=4, help="number of concurrent index loader threads", type=int,)
+    parser.add_argument("-la", "--lookahead", action="store_true", help="route batch i+1 while batch i is searching, prefetch and protect its shards")
+    parser.add_argument("--mmap", action="store_true", help="mmap IVF inverted lists instead of reading them into RAM")
     parser.add_argument("-d", "--dim", default=128, help="dimension of embeddings", type=int,)
     parser.add_argument("--seed", default=None, help="random seed", type=int,)
     parser.add_argument("--verbose", action="store_true", help="increase output verbosity")
@@ -50,8 +77,13 @@ if __name__ == "__main__":
     max_index_store = args.max_index_store
     search_topology = "index_async"
     seed = args.seed
+    omp_threads = args.omp_threads
+    search_workers = args.search_workers
+    num_loaders = args.num_loaders
     num_random_mixtures_ratios = args.random_mixtures_ratios
 
+    faiss.omp_set_num_threads(omp_threads)
+
     if args.verbose:
         print(args)
 
@@ -73,21 +105,21 @@ if __name__ == "__main__":
     idx_k = k
     
     # parse shard index files
-    idx_paths = []
-    centriod_idx_paths = ""
-    for f in os.listdir(index_root):
-        if "centroid" in f:
-            centriod_idx_paths = os.path.join(index_root, f)
-        else:
-            idx_paths.append(os.path.join(index_root, f))    
+    # shard ids from the catalog (create_shard_idx.py), or the directory listing without one
+    catalog = ShardCatalog.open(index_root)
+    idx_paths, centriod_idx_paths = catalog.paths, catalog.centroid_index_path
 
     idxpath2id_map = {idx_path: idx for idx, idx_path in enumerate(idx_paths)}
 
     # init index manager and store
-    index_manager = IndexManager(policy=rank_policy)
-    index_store = IndexStore(max_indexes=max_index_store, index_manager=index_manager)
-    dispatcher = Dispatcher(centriod_idx_paths, index_store, verbose=args.verbose)
-    index_loader = ThreadDataLoader(index_store, idx_paths)
+    # same seed and arguments replay the same batches, the order may still drift where the store contents differ
+    trace = load_json(args.trace) if args.trace is not None else None
+    index_manager = IndexManager(policy=rank_policy, decay_interval=args.lfu_decay, capacity=max_index_store, 
+                                 trace=trace, record_trace=args.save_trace is not None)
+    index_store = IndexStore(max_indexes=max_index_store, index_manager=index_manager, mmap=args.mmap, 
+                             mem_budget_mb=args.mem_budget_mb, evict_policy=args.evict, catalog=catalog)
+    dispatcher = Dispatcher(centriod_idx_paths, verbose=args.verbose, catalog=catalog)
+    index_loader = ThreadDataLoaderPool(index_store, idx_paths, num_loaders=num_loaders)
     index_loader.start()
 
     index_store.set_index_loader(index_loader)
@@ -99,36 +131,52 @@ if __name__ == "__main__":
     tputs_list = []
     serve_start_time = time.perf_counter()
 
-    # for i, qb in enumerate(query_batches):
-    for i, mr in enumerate(mixtures_ratios):
-        qb = random_queries_mix_distribs(num_queries, dim, mixtures_ratio=mr, low=-1, high=1, seed=seed)
+    # lookahead: a single routing thread, batch i+1 is generated and routed while batch i is searching
+    router = ThreadPoolExecutor(max_workers=1) if args.lookahead else None
+    next_batch = None
 
-        num_queries_list.append(qb.shape[0])
+    def route_and_prefetch(mr):
+        # runs on the router thread: queue the next batch's shards behind the current ones, keep them out of eviction
+        qb, rstopology = generate_and_route(dispatcher, mr, num_queries, dim, nprobe, seed, args.prune_ratio)
+        next_idx_paths = [idx_paths[idx] for idx in rstopology.keys()]
+        index_store.protect(next_idx_paths)
+        index_loader.extend_files_to_load(next_idx_paths)
+        return qb, rstopology
 
+    # for i, qb in enumerate(query_batches):
+    for i, mr in enumerate(mixtures_ratios):
         # start loading hot idx here if ranking exists
         index_loader.resume_loading()
 
         # print(len(index_store.indexes))
 
-        dispatcher.search_knn_centroids(qb, nprobe)
-        rstopology = dispatcher.create_search_outterloop_index_topology()
-        
-        # sort rs topology by length of values
-        rstopology = {k: v for k, v in sorted(rstopology.items(), key=lambda item: len(item[1]), reverse=True)}
+        if next_batch is not None:
+            # routed in the background during the previous batch
+            qb, rstopology = next_batch.result()
+        else:
+            qb, rstopology = generate_and_route(dispatcher, mr, num_queries, dim, nprobe, seed, args.prune_ratio)
+        num_queries_list.append(qb.shape[0])
         
         # need update, want to reorder stopology so that DRAM-idx start first, then sort by batch size
         # print(len(rstopology))
         # print(list(rstopology.keys())[:10])
-        rstopology = index_store.cleanup(stopology=rstopology, idxpath2id_map=idxpath2id_map)
+        rstopology = index_store.cleanup(stopology=rstopology, idxpath2id_map=idxpath2id_map, evict_unused=args.evict_unused)
         # print(list(rstopology.keys())[:10])
 
         # print(len(rstopology))
         index_loader.pause_loading()
         index_loader.update_files_to_load([idx_paths[idx] for idx in rstopology.keys()])
+        index_store.set_search_plan([idx_paths[idx] for idx in rstopology.keys()])
+        # the current batch releases its shards after searching them (the centroid router is pinned in the dispatcher)
+        index_store.protect([])
         index_loader.resume_loading()
+
+        if router is not None and i < len(mixtures_ratios) - 1:
+            next_batch = router.submit(route_and_prefetch, mixtures_ratios[i+1])
         
         start_time = time.perf_counter()
-        D_matrix, I_matrix, file_idx_matrix = search_outterloop_index_async(rstopology, qb, idx_k, k, idx_paths, index_store)
+        D_matrix, I_matrix, file_idx_matrix = search_outterloop_index_async(rstopology, qb, idx_k, k, idx_paths, index_store, 
+                                                                             num_workers=search_workers, omp_threads=omp_threads)
         end_time = time.perf_counter()
         qb_runtime = end_time - start_time
 
@@ -138,12 +186,14 @@ if __name__ == "__main__":
         avg_tputs_list.append(avg_tput)
         # print(f"Runtime: {qb_runtime:.8f}s")
         # print(f"avg_tput: {avg_tput:.2f} queries/s; curr_tput: {curr_tput:.2f} queries/s")
-        print(f"served: {end_time-serve_start_time:.5f} s; tput: {curr_tput:.3f} queries/s; avgtput: {avg_tput:.3f} queries/s")
+        print(f"served: {end_time-serve_start_time:.5f} s; tput: {curr_tput:.3f} queries/s; avgtput: {avg_tput:.3f} queries/s; hit rate: {index_store.hit_rate():.3f}")
 
         index_loader.pause_loading()
-        hot_idxs = index_manager.get_head_index(k=max_index_store-1)
-        hot_idxs_with_centroid = [centriod_idx_paths] + hot_idxs
-        index_loader.update_files_to_load(hot_idxs_with_centroid)
+        hot_idxs = index_manager.get_head_index(k=max_index_store)
+        if next_batch is not None and next_batch.done() and next_batch.exception() is None:
+            # the next batch's shards are known, load them before the hot ones
+            hot_idxs = [idx_paths[idx] for idx in next_batch.result()[1].keys()] + hot_idxs
+        index_loader.update_files_to_load(hot_idxs)
         # print("Hot idxs:", hot_idxs[-5:])
         index_loader.resume_loading()
 
@@ -153,10 +203,22 @@ if __name__ == "__main__":
         if i == len(mixtures_ratios) - 1:
             index_loader.stop_loading()
             index_loader.join()
+            if router is not None:
+                router.shutdown()
 
     serve_runtime = time.perf_counter() - serve_start_time
     # print(f"serve time: {serve_runtime:.8f}s")
-    print(f"avg tput: {np.mean(tputs_list):.2f} queries/s\n")
+    # upper bound: offline OPT over the shard accesses, same capacity, demand loads only (no loaders)
+    opt_trace = trace if trace is not None else (index_manager.access_trace if args.save_trace is not None else None)
+    if opt_trace is not None:
+        print(f"offline demand paging, capacity {max_index_store}: {rank_policy} hit rate "
+              f"{demand_hit_rate(rank_policy, opt_trace, max_index_store, decay_interval=args.lfu_decay):.4f}; "
+              f"OPT bound {opt_hit_rate(opt_trace, max_index_store):.4f}")
+    print(f"{rank_policy}: avg tput: {np.mean(tputs_list):.2f} queries/s; hit rate: {index_store.hit_rate():.4f} "
+          f"({index_store.hits} hits, {index_store.misses} misses)\n")
+
+    if args.save_trace is not None:
+        save_json_to_file(args.save_trace, index_manager.access_trace)
 
     if args.verbose:
         print()
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# import the repo modules (utils, serve, create_shard_idx) like the scripts do
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
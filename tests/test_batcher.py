@@ -0,0 +1,90 @@
+'''
+CoalescingBatcher: concurrent requests are merged into one engine search per (k, nprobe, dim)
+'''
+
+import asyncio
+import threading
+
+import numpy as np
+
+from serve.batcher import CoalescingBatcher
+
+
+class FakeEngine:
+    # SearchEngine.search interface, row r of a batch answers with distance = its first query value
+    def __init__(self, k=10, nprobe=5):
+        self.k = k
+        self.nprobe = nprobe
+        self.calls = []
+        self.lock = threading.Lock()
+
+    def search(self, queries, k=None, nprobe=None):
+        k = self.k if k is None else k
+        nprobe = self.nprobe if nprobe is None else nprobe
+        with self.lock:
+            self.calls.append((queries.shape[0], k, nprobe))
+        D = np.repeat(queries[:, :1], k, axis=1)
+        I = np.tile(np.arange(k), (queries.shape[0], 1))
+        return D, I, np.zeros_like(I)
+
+def search_all(engine, requests, **batcher_args):
+    async def run():
+        batcher = CoalescingBatcher(engine, **batcher_args)
+        batcher.start()
+        try:
+            return await asyncio.gather(*[batcher.search(queries, k=k, nprobe=nprobe) for queries, k, nprobe in requests])
+        finally:
+            await batcher.stop()
+    return asyncio.run(run())
+
+def queries(value, num=2, dim=4):
+    return np.full((num, dim), value, dtype=np.float32)
+
+
+def test_same_parameters_are_one_search():
+    engine = FakeEngine()
+    results = search_all(engine, [(queries(i), None, None) for i in range(4)], max_wait_ms=50.)
+    assert engine.calls == [(8, 10, 5)]
+    # rows are split back to their caller
+    for i, (D, I, file_idx) in enumerate(results):
+        assert D.shape == (2, 10) and (D == i).all()
+
+def test_default_and_explicit_default_are_merged():
+    engine = FakeEngine(k=10, nprobe=5)
+    search_all(engine, [(queries(0), None, None), (queries(1), 10, None), (queries(2), 10, 5), (queries(3), None, 5)],
+               max_wait_ms=50.)
+    assert engine.calls == [(8, 10, 5)]
+
+def test_different_k_or_nprobe_are_separate_searches():
+    engine = FakeEngine(k=10, nprobe=5)
+    results = search_all(engine, [(queries(0), None, None), (queries(1), 3, None), (queries(2), None, 8), (queries(3), 3, None)],
+                         max_wait_ms=50.)
+    assert sorted(engine.calls) == sorted([(2, 10, 5), (4, 3, 5), (2, 10, 8)])
+    assert [D.shape[1] for D, _, _ in results] == [10, 3, 10, 3]
+    for i, (D, _, _) in enumerate(results):
+        assert (D == i).all()
+
+def test_different_dims_are_separate_searches():
+    engine = FakeEngine()
+    search_all(engine, [(queries(0, dim=4), None, None), (queries(1, dim=8), None, None)], max_wait_ms=50.)
+    assert sorted(engine.calls) == [(2, 10, 5), (2, 10, 5)]
+
+def test_max_batch_size_splits_batches():
+    engine = FakeEngine()
+    search_all(engine, [(queries(i), None, None) for i in range(4)], max_batch_size=4, max_wait_ms=50.)
+    assert [num for num, _, _ in engine.calls] == [4, 4]
+
+def test_engine_error_reaches_every_caller():
+    class FailingEngine(FakeEngine):
+        def search(self, queries, k=None, nprobe=None):
+            raise RuntimeError("boom")
+
+    async def run():
+        batcher = CoalescingBatcher(FailingEngine(), max_wait_ms=20.)
+        batcher.start()
+        try:
+            return await asyncio.gather(batcher.search(queries(0)), batcher.search(queries(1)), return_exceptions=True)
+        finally:
+            await batcher.stop()
+    results = asyncio.run(run())
+    assert all(isinstance(result, RuntimeError) for result in results)
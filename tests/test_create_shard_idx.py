@@ -0,0 +1,47 @@
+'''
+create_shard_idx.py --resume: resumes a partial build only with the same build args (build_manifest.json)
+'''
+
+import os
+
+import pytest
+
+from create_shard_idx import build_shards, MANIFEST_FILE
+
+NUM_SHARDS = 2
+CLUSTER_SIZE = 500
+DIM = 4
+
+
+@pytest.fixture
+def roots(tmp_path):
+    npy_root, idx_root = tmp_path / "npys", tmp_path / "idxs"
+    npy_root.mkdir()
+    idx_root.mkdir()
+    build_shards(str(npy_root), str(idx_root), NUM_SHARDS, CLUSTER_SIZE, DIM, seed=0, verbose=False)
+    return str(npy_root), str(idx_root)
+
+
+def test_resume_same_args(roots):
+    *_, num_resumed = build_shards(*roots, NUM_SHARDS, CLUSTER_SIZE, DIM, seed=0, resume=True, verbose=False)
+    assert num_resumed == NUM_SHARDS
+
+@pytest.mark.parametrize("num_shards, cluster_size, dim, seed", [(NUM_SHARDS, CLUSTER_SIZE, 8, 0), (3, CLUSTER_SIZE, DIM, 0),
+                                                                 (NUM_SHARDS, 600, DIM, 0), (NUM_SHARDS, CLUSTER_SIZE, DIM, 1)])
+def test_resume_refuses_other_args(roots, num_shards, cluster_size, dim, seed):
+    with pytest.raises(ValueError, match="build args differ"):
+        build_shards(*roots, num_shards, cluster_size, dim, seed=seed, resume=True, verbose=False)
+    # the manifest of the partial build is kept
+    *_, num_resumed = build_shards(*roots, NUM_SHARDS, CLUSTER_SIZE, DIM, seed=0, resume=True, verbose=False)
+    assert num_resumed == NUM_SHARDS
+
+def test_resume_refuses_build_without_manifest(roots):
+    os.remove(os.path.join(roots[1], MANIFEST_FILE))
+    with pytest.raises(ValueError, match=MANIFEST_FILE):
+        build_shards(*roots, NUM_SHARDS, CLUSTER_SIZE, DIM, seed=0, resume=True, verbose=False)
+
+def test_rebuild_without_resume_overwrites_manifest(roots):
+    *_, num_resumed = build_shards(*roots, NUM_SHARDS, CLUSTER_SIZE, 8, seed=0, verbose=False)
+    assert num_resumed == 0
+    *_, num_resumed = build_shards(*roots, NUM_SHARDS, CLUSTER_SIZE, 8, seed=0, resume=True, verbose=False)
+    assert num_resumed == NUM_SHARDS
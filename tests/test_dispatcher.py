@@ -0,0 +1,33 @@
+'''
+Dispatcher.prune_shards: adaptive nprobe, prune_ratio must be >= 1
+'''
+
+import argparse
+
+import numpy as np
+import pytest
+
+from utils.dispatcher import Dispatcher, prune_ratio_arg
+
+
+D = np.array([[1., 1.5, 3., 10.]], dtype=np.float32)
+I = np.array([[4, 2, 7, 1]])
+
+def test_prune_shards():
+    assert Dispatcher.prune_shards(D, I, 2.).tolist() == [[4, 2, -1, -1]]
+    assert Dispatcher.prune_shards(D, I, np.inf).tolist() == I.tolist()
+    assert Dispatcher.prune_shards(D, I, 1., min_nprobe=2).tolist() == [[4, 2, -1, -1]]
+
+@pytest.mark.parametrize("prune_ratio", [0.5, 0., -1., np.nan])
+def test_prune_shards_rejects_ratio_below_one(prune_ratio):
+    with pytest.raises(ValueError):
+        Dispatcher.prune_shards(D, I, prune_ratio)
+
+def test_prune_ratio_arg():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-pr", "--prune_ratio", default=None, type=prune_ratio_arg,)
+    assert parser.parse_args(["-pr", "1.5"]).prune_ratio == 1.5
+    assert parser.parse_args([]).prune_ratio is None
+    for value in ["0.9", "-2", "nan", "x"]:
+        with pytest.raises(SystemExit):
+            parser.parse_args(["-pr", value])
@@ -0,0 +1,147 @@
+'''
+Victims of the ranking policies on small hand-computed traces
+A demand access is access() then admit() (IndexStore: get_index ranks, the load admits), a prefetch is admit() alone.
+'''
+
+from utils.ranking_policies import LFUPolicy, ARCPolicy, TwoQPolicy, WTinyLFUPolicy, opt_hit_rate, demand_hit_rate
+
+
+def demand(policy, *keys, rank=None):
+    for key in keys:
+        if rank is None:
+            policy.access(key)
+        else:
+            policy.access(key, rank)
+        policy.admit(key)
+
+def evict_victim(policy):
+    victim = policy.victim()
+    policy.evict(victim)
+    return victim
+
+
+def test_lfu_victim_is_least_frequent():
+    policy = LFUPolicy()
+    demand(policy, "a", "b", "c", rank=1)
+    policy.access("a", 1)
+    policy.access("a", 1)
+    policy.access("c", 1)
+    # a: 3, b: 1, c: 2
+    assert evict_victim(policy) == "b"
+    assert evict_victim(policy) == "c"
+    assert policy.residents() == ["a"]
+
+def test_lfu_rank_is_the_increment():
+    # IndexStore passes the number of queries of the access
+    policy = LFUPolicy()
+    demand(policy, "a", rank=1)
+    demand(policy, "b", rank=50)
+    policy.access("a", 10)
+    assert policy.victim() == "a"
+
+def test_lfu_decay_halves_frequencies():
+    policy = LFUPolicy(decay_interval=4)
+    demand(policy, "a", "a", "a", rank=1)
+    # 4th access: a 3 -> 1, b 1 -> 0
+    demand(policy, "b", rank=1)
+    assert policy.ranks() == {"a": 1, "b": 0}
+    assert policy.victim() == "b"
+
+def test_arc_recency_then_ghost_hit():
+    policy = ARCPolicy(2)
+    demand(policy, "a", "b")
+    # second use: a moves to T2
+    policy.access("a")
+    assert policy.ranks() == {"a": 2, "b": 1}
+    # |T1| = 1 > p = 0: T1 LRU
+    assert evict_victim(policy) == "b"
+    demand(policy, "c")
+    assert evict_victim(policy) == "c"
+    # b is a B1 ghost: back into T2, p grows
+    demand(policy, "b")
+    assert policy.p == 1
+    assert policy.ranks()["b"] == 2
+    # T1 empty: T2 LRU
+    assert policy.victim() == "a"
+
+def test_arc_prefetch_is_not_a_use():
+    policy = ARCPolicy(4)
+    policy.admit("x")
+    policy.access("x")
+    assert policy.ranks() == {"x": 1}
+    policy.access("x")
+    assert policy.ranks() == {"x": 2}
+    # evicted before any use: no ghost
+    policy.admit("y")
+    policy.evict("y")
+    assert "y" not in policy.B1 and "y" not in policy.B2
+
+def test_2q_a1in_then_am():
+    # capacity 4: kin 1, kout 2
+    policy = TwoQPolicy(4)
+    demand(policy, "a", "b")
+    # A1in holds 2 > kin: FIFO head
+    assert evict_victim(policy) == "a"
+    assert list(policy.A1out) == ["a"]
+    # back while in A1out: Am
+    demand(policy, "a")
+    assert policy.ranks() == {"a": 2, "b": 1}
+    # A1in within kin and Am not empty: Am LRU
+    assert policy.victim() == "a"
+    demand(policy, "c")
+    assert policy.victim() == "b"
+
+def test_2q_prefetch_is_not_a_use():
+    policy = TwoQPolicy(4)
+    demand(policy, "a", "b")
+    evict_victim(policy)
+    # prefetched out of A1out: stays in A1in until its first use
+    policy.admit("a")
+    assert policy.ranks()["a"] == 1
+    policy.access("a")
+    assert policy.ranks()["a"] == 2
+    # evicted before any use: no new ghost
+    policy.admit("p")
+    policy.evict("p")
+    assert "p" not in policy.A1out
+
+def test_wtinylfu_admission_by_frequency():
+    # capacity 4: window 1, main 3
+    policy = WTinyLFUPolicy(4)
+    demand(policy, "a", "b", "c", "d")
+    assert list(policy.window) == ["d"] and list(policy.probation) == ["a", "b", "c"]
+    # window within its size: main victim (probation LRU)
+    assert policy.victim() == "a"
+    # window overflow with a full main: the rarer of (window candidate d, main victim a) goes, ties keep main
+    demand(policy, "e")
+    assert list(policy.window) == ["d", "e"]
+    assert policy.victim() == "d"
+
+    policy = WTinyLFUPolicy(4)
+    demand(policy, "a", "b", "c", "d")
+    for _ in range(3):
+        policy.access("d")
+    demand(policy, "e")
+    # d is more frequent than a: admitted in its place
+    assert policy.victim() == "a"
+    # evicting the main victim admits the candidate
+    policy.evict("a")
+    assert list(policy.window) == ["e"] and list(policy.probation) == ["b", "c", "d"]
+
+def test_wtinylfu_victim_is_pure():
+    policy = WTinyLFUPolicy(4)
+    demand(policy, "a", "b", "c", "d", "e")
+    state = (list(policy.window), list(policy.probation), list(policy.protected), policy.sketch.table.copy())
+    for _ in range(3):
+        policy.victim()
+    assert (list(policy.window), list(policy.probation), list(policy.protected)) == state[:3]
+    assert (policy.sketch.table == state[3]).all()
+
+def test_opt_bounds_every_policy():
+    trace = list("abcabdabcdabeacbd")
+    for capacity in [1, 2, 3]:
+        bound = opt_hit_rate(trace, capacity)
+        for policy in ["LRU", "LFU", "ARC", "2Q", "WTINYLFU"]:
+            assert demand_hit_rate(policy, trace, capacity) <= bound
+        assert demand_hit_rate("BELADY", trace, capacity) == bound
+    assert opt_hit_rate(list("abcabdabcd"), 2) == 0.3
@@ -0,0 +1,104 @@
+'''
+ResultAccumulator against the legacy merge (concatenate every shard result, argsort, keep the first k)
+'''
+
+import numpy as np
+
+from utils.result_accumulator import ResultAccumulator
+
+
+def legacy_merge(shard_results, num_queries):
+    # shard_results: [(file_idx, q_idxs, D, I)], per query: concat in shard order, argsort, no truncation
+    rows = {q: ([], [], []) for q in range(num_queries)}
+    for file_idx, q_idxs, D, I in shard_results:
+        for row, q in enumerate(q_idxs):
+            rows[q][0].append(D[row])
+            rows[q][1].append(I[row])
+            rows[q][2].append(np.full(D.shape[1], file_idx))
+    merged = []
+    for q in range(num_queries):
+        D, I, file_idx = (np.concatenate(parts) for parts in rows[q])
+        sort_idx = np.argsort(D)
+        merged.append((D[sort_idx], I[sort_idx], file_idx[sort_idx]))
+    return merged
+
+def accumulate(shard_results, num_queries, k, buffer_shards=10):
+    results = ResultAccumulator(num_queries, k, buffer_shards=buffer_shards)
+    for file_idx, q_idxs, D, I in shard_results:
+        results.add(q_idxs, D, I, file_idx)
+    return results.result()
+
+def random_shard_results(rng, num_queries, num_shards, idx_k, num_values=None):
+    shard_results = []
+    for file_idx in range(num_shards):
+        q_idxs = np.sort(rng.choice(num_queries, size=rng.integers(1, num_queries + 1), replace=False))
+        if num_values is None:
+            D = rng.random((len(q_idxs), idx_k), dtype=np.float32)
+        else:
+            # few distinct values: many ties
+            D = rng.integers(0, num_values, (len(q_idxs), idx_k)).astype(np.float32)
+        D.sort(axis=1)
+        I = rng.integers(0, 1000, (len(q_idxs), idx_k))
+        shard_results.append((file_idx, q_idxs, D, I))
+    return shard_results
+
+def assert_same_topk(merged, D, I, file_idx, k):
+    for q, (legacy_D, legacy_I, legacy_file_idx) in enumerate(merged):
+        n = min(k, len(legacy_D))
+        np.testing.assert_array_equal(D[q, :n], legacy_D[:n])
+        # ties may come out in another order: same (distance, shard, id) multiset within every distance
+        got = sorted(zip(D[q, :n].tolist(), file_idx[q, :n].tolist(), I[q, :n].tolist()))
+        kth = legacy_D[n - 1]
+        # entries strictly below the k-th distance are the same, ties at the k-th distance may be any of the tied ones
+        below = sorted((d, f, i) for d, f, i in zip(legacy_D.tolist(), legacy_file_idx.tolist(), legacy_I.tolist()) if d < kth)
+        assert [entry for entry in got if entry[0] < kth] == below
+        tied = {(d, f, i) for d, f, i in zip(legacy_D.tolist(), legacy_file_idx.tolist(), legacy_I.tolist()) if d == kth}
+        assert all(entry in tied for entry in got if entry[0] == kth)
+
+
+def test_matches_legacy_merge():
+    rng = np.random.default_rng(0)
+    shard_results = random_shard_results(rng, num_queries=20, num_shards=15, idx_k=10)
+    D, I, file_idx = accumulate(shard_results, 20, k=10, buffer_shards=2)
+    assert_same_topk(legacy_merge(shard_results, 20), D, I, file_idx, k=10)
+
+def test_matches_legacy_merge_with_ties():
+    rng = np.random.default_rng(1)
+    shard_results = random_shard_results(rng, num_queries=20, num_shards=12, idx_k=5, num_values=4)
+    D, I, file_idx = accumulate(shard_results, 20, k=5, buffer_shards=1)
+    assert_same_topk(legacy_merge(shard_results, 20), D, I, file_idx, k=5)
+
+def test_k_larger_than_the_results():
+    rng = np.random.default_rng(2)
+    shard_results = random_shard_results(rng, num_queries=6, num_shards=2, idx_k=3)
+    k = 10
+    D, I, file_idx = accumulate(shard_results, 6, k=k)
+    merged = legacy_merge(shard_results, 6)
+    assert_same_topk(merged, D, I, file_idx, k)
+    for q, (legacy_D, _, _) in enumerate(merged):
+        # missing results are inf / -1
+        assert np.isinf(D[q, len(legacy_D):]).all()
+        assert (I[q, len(legacy_D):] == -1).all() and (file_idx[q, len(legacy_D):] == -1).all()
+
+def test_idx_k_wider_than_the_buffer():
+    rng = np.random.default_rng(3)
+    shard_results = random_shard_results(rng, num_queries=8, num_shards=4, idx_k=40)
+    D, I, file_idx = accumulate(shard_results, 8, k=5, buffer_shards=1)
+    assert_same_topk(legacy_merge(shard_results, 8), D, I, file_idx, k=5)
+
+def test_faiss_missing_results_stay_empty():
+    # faiss pads with id -1 (and a huge distance) when a shard has fewer than idx_k vectors
+    D = np.array([[0.5, 3.4e38]], dtype=np.float32)
+    I = np.array([[7, -1]])
+    results = ResultAccumulator(1, 2)
+    results.add(np.array([0]), D, I, 3)
+    D_out, I_out, file_idx = results.result()
+    assert I_out.tolist() == [[7, -1]] and file_idx.tolist() == [[3, -1]]
+
+def test_kth_distance_is_running_upper_bound():
+    results = ResultAccumulator(2, 2)
+    assert np.isinf(results.kth_distance([0, 1])).all()
+    results.add(np.array([0, 1]), np.array([[1., 4.], [2., 3.]], dtype=np.float32), np.array([[0, 1], [2, 3]]), 0)
+    np.testing.assert_array_equal(results.kth_distance([0, 1]), [4., 3.])
+    results.add(np.array([0]), np.array([[0.5, 2.]], dtype=np.float32), np.array([[4, 5]]), 1)
+    np.testing.assert_array_equal(results.kth_distance([0]), [1.])
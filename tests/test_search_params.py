@@ -0,0 +1,28 @@
+'''
+Request parameters k / nprobe: None or an integer >= 1, anything else is a 400 (not a 500 from the search)
+'''
+
+import numpy as np
+import pytest
+
+from serve.engine import SearchEngine
+
+
+@pytest.mark.parametrize("k, nprobe", [(None, None), (1, 1), (10, None), (None, 64), (np.int64(5), np.int32(3))])
+def test_accepts(k, nprobe):
+    checked = SearchEngine.check_search_params(k, nprobe)
+    assert checked == (k if k is None else int(k), nprobe if nprobe is None else int(nprobe))
+    assert all(value is None or type(value) is int for value in checked)
+
+@pytest.mark.parametrize("params", [{"k": 0}, {"k": -3}, {"k": 2.5}, {"k": 10.}, {"k": "10"}, {"k": True},
+                                    {"nprobe": 0}, {"nprobe": -1}, {"nprobe": [4]}, {"nprobe": None, "k": {}}])
+def test_rejects(params):
+    with pytest.raises(ValueError):
+        SearchEngine.check_search_params(**params)
+
+@pytest.mark.parametrize("params", [{"k": 0}, {"nprobe": -1}, {"k": "ten"}])
+def test_server_returns_400(params):
+    pytest.importorskip("flask")
+    from serve import server
+    response = server.app.test_client().post('/vector_search', json={"queries": [[0.] * 8], **params})
+    assert response.status_code == 400
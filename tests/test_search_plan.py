@@ -0,0 +1,33 @@
+'''
+SearchPlan.order_by_completion: the greedy cap keeps the greedy prefix and every shard
+'''
+
+import numpy as np
+
+from utils.search_plan import SearchPlan
+
+
+def random_plan(num_shards=50, num_queries=400, nprobe=4, seed=0):
+    rng = np.random.default_rng(seed)
+    I = np.stack([rng.choice(num_shards, nprobe, replace=False) for _ in range(num_queries)])
+    return SearchPlan.from_pairs(I.ravel(), np.repeat(np.arange(num_queries), nprobe), sort_by_size=True)
+
+def test_completion_starts_with_largest_shard():
+    plan = random_plan()
+    ordered = plan.order_by_completion()
+    assert ordered.ids[0] == plan.ids[np.argmax(plan.sizes)]
+    assert sorted(ordered.ids.tolist()) == sorted(plan.ids.tolist())
+
+def test_completion_cap_keeps_greedy_prefix():
+    plan = random_plan()
+    full = plan.order_by_completion(max_greedy=None)
+    capped = plan.order_by_completion(max_greedy=10)
+    assert np.array_equal(full.ids[:10], capped.ids[:10])
+    assert sorted(capped.ids.tolist()) == sorted(plan.ids.tolist())
+    # every shard keeps its queries
+    for shard_id in plan.keys():
+        assert np.array_equal(np.sort(capped[shard_id]), np.sort(plan[shard_id]))
+
+def test_completion_cap_above_num_shards():
+    plan = random_plan(num_shards=8)
+    assert np.array_equal(plan.order_by_completion(max_greedy=100).ids, plan.order_by_completion(max_greedy=None).ids)
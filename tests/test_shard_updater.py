@@ -0,0 +1,91 @@
+'''
+ShardUpdater: append / delete in place, then a running SearchEngine picks the update up (refresh) without a restart
+'''
+
+import os
+
+import numpy as np
+import pytest
+
+from create_shard_idx import build_shards
+from serve.engine import SearchEngine
+from utils.centroid_router import build_router_index
+from utils.shard_catalog import ShardCatalog
+from utils.shard_updater import ShardUpdater
+from utils.vdb_utils import read_index, save_index
+
+NUM_SHARDS = 3
+DIM = 8
+
+
+@pytest.fixture
+def idx_root(tmp_path):
+    npy_root, idx_root = tmp_path / "npys", tmp_path / "idxs"
+    npy_root.mkdir()
+    idx_root.mkdir()
+    shards, centroids, radii, _ = build_shards(str(npy_root), str(idx_root), NUM_SHARDS, 4000, DIM, seed=0, verbose=False)
+    save_index(build_router_index(centroids), str(idx_root / "embeds_centroids.index"))
+    ShardCatalog(str(idx_root), shards, centroid_index="embeds_centroids.index", centroids=centroids, radii=radii, dim=DIM).save()
+    return str(idx_root)
+
+def near(catalog, shard_id, num, offset=0.05):
+    return (catalog.centroids[shard_id] + offset).astype(np.float32)[None].repeat(num, axis=0)
+
+
+def test_append_then_delete(idx_root):
+    updater = ShardUpdater(idx_root)
+    num_vectors = updater.catalog.shards[1]["num_vectors"]
+    vectors = near(updater.catalog, 1, 3, offset=5.)
+    ids = updater.append(1, vectors)
+    assert ids.tolist() == [num_vectors, num_vectors + 1, num_vectors + 2]
+    version = updater.commit()
+
+    catalog = ShardCatalog.load(idx_root)
+    assert catalog.version == version == 2
+    assert catalog.shards[1]["num_vectors"] == num_vectors + 3
+    assert catalog.shards[1]["version"] == 1 and catalog.shards[1]["next_id"] == num_vectors + 3
+    # the radius still bounds every vector of the shard
+    distances = np.linalg.norm(vectors - catalog.centroids[1], axis=1)
+    assert (distances <= catalog.radii[1] + 1e-4).all()
+    index = read_index(catalog.paths[1])
+    D, I = index.search(vectors[:1], 1)
+    assert I[0, 0] in ids
+
+    assert updater.delete(1, [ids[0], 10**9]) == 1
+    updater.commit()
+    catalog = ShardCatalog.load(idx_root)
+    assert catalog.shards[1]["num_vectors"] == num_vectors + 2
+    # removed ids are never given again
+    assert updater.append(1, vectors[:1]).tolist() == [num_vectors + 3]
+
+def test_commit_without_changes_keeps_the_version(idx_root):
+    updater = ShardUpdater(idx_root)
+    assert updater.commit() == ShardCatalog.load(idx_root).version
+    assert updater.delete(0, [10**9]) == 0
+    assert updater.commit() == 1
+
+def test_running_engine_refresh(idx_root):
+    engine = SearchEngine(idx_root, k=5, nprobe=NUM_SHARDS, max_index_store=NUM_SHARDS, num_loaders=1, omp_threads=1)
+    try:
+        updater = ShardUpdater(idx_root)
+        vector = near(updater.catalog, 0, 1, offset=0.)
+        # shard 0 is resident after this search
+        engine.search(vector)
+
+        [new_id] = updater.append(0, vector)
+        updater.commit()
+        D, I, file_idx = engine.search(vector)
+        assert (I[0, 0], file_idx[0, 0]) == (new_id, 0) and D[0, 0] < 1e-4
+        assert engine.stats()["catalog_version"] == 2 and engine.stats()["refreshes"] == 1
+
+        updater.delete(0, [new_id])
+        updater.commit()
+        D, I, file_idx = engine.search(vector)
+        assert not ((I[0] == new_id) & (file_idx[0] == 0)).any()
+    finally:
+        engine.close()
+
+def test_updater_needs_a_catalog(tmp_path):
+    with pytest.raises(ValueError):
+        ShardUpdater(str(tmp_path))
+    assert not os.path.exists(tmp_path / "catalog.json")
@@ -0,0 +1,91 @@
+'''
+Binary wire format: round trip and rejection of malformed bodies (ValueError, a 400 in the servers)
+'''
+
+import json
+
+import numpy as np
+import pytest
+
+from serve import wire
+
+
+def body_with_header(header, data=b"\0" * 256):
+    header = json.dumps(header).encode()
+    return wire.PREFIX.pack(wire.MAGIC, len(header)) + header + data
+
+
+def test_round_trip():
+    arrays = {
+        "queries": np.arange(12, dtype=np.float32).reshape(3, 4),
+        "I": np.array([[1, -1], [2, 3], [4, 5]], dtype=np.int64),
+        "empty": np.zeros((0, 4), dtype=np.float32),
+    }
+    # the servers decode the request bytes
+    decoded, meta = wire.decode(bytes(wire.encode(arrays, meta={"k": 2, "nprobe": 5})))
+    assert meta == {"k": 2, "nprobe": 5}
+    for name, array in arrays.items():
+        assert decoded[name].dtype == array.dtype
+        np.testing.assert_array_equal(decoded[name], array)
+    # zero copy views of the body
+    assert not decoded["queries"].flags.writeable
+
+def test_round_trip_non_contiguous():
+    array = np.arange(20, dtype=np.float32).reshape(4, 5)[:, ::2]
+    decoded, meta = wire.decode(wire.encode({"queries": array}))
+    np.testing.assert_array_equal(decoded["queries"], array)
+    assert meta == {}
+
+def test_json_round_trip():
+    D = np.array([[0.5, 1.5]], dtype=np.float32)
+    arrays, meta = wire.decode_json(wire.encode_json({"D": D}, meta={"k": 2}), names=["D"])
+    np.testing.assert_array_equal(arrays["D"], D)
+    assert meta == {"k": 2}
+
+@pytest.mark.parametrize("body", [
+    b"",
+    b"NDA",
+    b"XXXX" + b"\0" * 60,
+])
+def test_rejects_bad_prefix(body):
+    with pytest.raises(ValueError):
+        wire.decode(body)
+
+def test_rejects_truncated_array():
+    body = wire.encode({"queries": np.ones((4, 4), dtype=np.float32)})
+    with pytest.raises(ValueError):
+        wire.decode(body[:-8])
+
+@pytest.mark.parametrize("header", [
+    [1, 2],
+    {"arrays": 5, "meta": {}},
+    {"arrays": [], "meta": []},
+    {"arrays": []},
+    {"arrays": [5], "meta": {}},
+    {"arrays": [{"name": "q", "dtype": "f4", "shape": [1]}], "meta": {}},
+    {"arrays": [{"name": "q", "dtype": "zz", "shape": [1], "offset": 0}], "meta": {}},
+    {"arrays": [{"name": "q", "dtype": "O", "shape": [1], "offset": 0}], "meta": {}},
+    {"arrays": [{"name": "q", "dtype": "f4", "shape": None, "offset": 0}], "meta": {}},
+    {"arrays": [{"name": "q", "dtype": "f4", "shape": [-1], "offset": 0}], "meta": {}},
+    {"arrays": [{"name": "q", "dtype": "f4", "shape": [1], "offset": -64}], "meta": {}},
+    {"arrays": [{"name": ["q"], "dtype": "f4", "shape": [1], "offset": 0}], "meta": {}},
+    {"arrays": [{"name": "q", "dtype": "f4", "shape": [1000], "offset": 0}], "meta": {}},
+])
+def test_rejects_malformed_header(header):
+    with pytest.raises(ValueError):
+        wire.decode(body_with_header(header))
+
+def test_rejects_header_that_is_not_json():
+    body = wire.PREFIX.pack(wire.MAGIC, 5) + b"{nope" + b"\0" * 64
+    with pytest.raises(ValueError):
+        wire.decode(body)
+
+@pytest.mark.parametrize("body", [
+    b"[1, 2]",
+    b'{"queries": [[1, "a"]]}',
+    b'{"queries": [[1], [1, 2]]}',
+    b"not json",
+])
+def test_json_rejects_malformed_body(body):
+    with pytest.raises(ValueError):
+        wire.decode_json(body, names=["queries"])
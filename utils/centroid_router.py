@@ -0,0 +1,99 @@
+'''
+Centroid router: the index over all shard centroids that routes every query to its nprobe nearest shards
+
+It is loaded once and pinned, it never goes through the IndexStore (no ranking, eviction or reload).
+Index types (create_shard_idx.py --centroid_index):
+    - flat: exact, linear in the number of shards
+    - hnsw: graph, ~log(num_shards) per query, efSearch trades recall for latency
+    - ivf: centroids clustered into nlist lists, nprobe of them scanned per query
+'''
+
+import faiss
+import numpy as np
+
+from utils.vdb_utils import read_index, index_kind
+
+
+class CentroidRouter:
+    '''
+    Pinned centroid index, search() is thread safe (search parameters are set once, at load)
+    '''
+    def __init__(self, index, index_path=None, ef_search=None, ivf_nprobe=None):
+        '''
+        args:
+            - index: faiss index over the shard centroids, id = shard id
+            - ef_search: HNSW only, size of the search candidate list (None: keep the saved value)
+            - ivf_nprobe: IVF only, number of centroid lists scanned per query (None: keep the saved value)
+        '''
+        self.index = index
+        self.index_path = index_path
+        self.kind = index_kind(index)
+        if self.kind == "hnsw" and ef_search is not None:
+            faiss.downcast_index(index).hnsw.efSearch = ef_search
+        if self.kind == "ivf" and ivf_nprobe is not None:
+            faiss.extract_index_ivf(index).nprobe = ivf_nprobe
+
+    @classmethod
+    def from_file(cls, index_path, ef_search=None, ivf_nprobe=None):
+        return cls(read_index(index_path), index_path=index_path, ef_search=ef_search, ivf_nprobe=ivf_nprobe)
+
+    @property
+    def num_shards(self):
+        return self.index.ntotal
+
+    def search(self, queries, nprobe):
+        '''
+        return:
+            - D, I: (num_queries, nprobe) centroid distances and shard ids, -1 if fewer shards are found
+        '''
+        return self.index.search(np.ascontiguousarray(queries, dtype=np.float32), nprobe)
+
+
+def build_router_index(centroids, kind="flat", hnsw_m=32, ef_construction=200, ef_search=64, nlist=None, ivf_nprobe=16):
+    '''
+    Index over the shard centroids, row i of centroids is shard i
+
+    args:
+        - kind: flat, hnsw or ivf
+        - hnsw_m, ef_construction, ef_search: HNSW graph degree and candidate lists (saved with the index)
+        - nlist, ivf_nprobe: IVF lists (default 4 * sqrt(num_shards)) and lists scanned per query (saved with the index)
+    '''
+    centroids = np.ascontiguousarray(centroids, dtype=np.float32)
+    num_shards, dim = centroids.shape
+    if kind == "flat":
+        index = faiss.IndexFlatL2(dim)
+    elif kind == "hnsw":
+        index = faiss.IndexHNSWFlat(dim, hnsw_m)
+        index.hnsw.efConstruction = ef_construction
+        index.hnsw.efSearch = ef_search
+    elif kind == "ivf":
+        if nlist is None:
+            nlist = max(1, int(4 * np.sqrt(num_shards)))
+        nlist = min(nlist, num_shards)
+        quantizer = faiss.IndexFlatL2(dim)
+        index = faiss.IndexIVFFlat(quantizer, dim, nlist, faiss.METRIC_L2)
+        index.train(centroids)
+        index.nprobe = min(ivf_nprobe, nlist)
+    else:
+        raise ValueError("Invalid centroid index: {}".format(kind))
+    index.add(centroids)
+    return index
+
+def update_router_centroids(index, shard_ids, centroids):
+    '''
+    Move the centroids of shard_ids in place (router id = shard id), used by incremental shard updates
+        - flat: rows overwritten
+        - ivf: removed and re-added (to the list of their new position)
+        - hnsw: stored vectors overwritten, the graph keeps the old links (create_shard_idx.py --centroids_only rebuilds it)
+    '''
+    shard_ids = np.asarray(shard_ids, dtype=np.int64)
+    centroids = np.ascontiguousarray(centroids, dtype=np.float32).reshape(len(shard_ids), -1)
+    kind = index_kind(index)
+    if kind == "ivf":
+        ivf = faiss.extract_index_ivf(index)
+        ivf.remove_ids(faiss.IDSelectorArray(shard_ids))
+        ivf.add_with_ids(centroids, shard_ids)
+        return
+    flat = faiss.downcast_index(faiss.downcast_index(index).storage) if kind == "hnsw" else faiss.downcast_index(index)
+    xb = faiss.rev_swig_ptr(flat.get_xb(), flat.ntotal * flat.d).reshape(flat.ntotal, flat.d)
+    xb[shard_ids] = centroids
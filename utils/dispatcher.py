@@ -4,47 +4,130 @@ The dispatcher module
     - search knn centroids and return the search topology
 '''
 
-import logging
+import argparse
 
-from utils.vdb_utils import query_index_file
-from utils.search_by_topology import query_to_index_stopology
+import numpy as np
+
+from utils.logger import Logger
+from utils.search_plan import SearchPlan
+from utils.centroid_router import CentroidRouter
+
+def prune_ratio_arg(value):
+    # argparse type of -pr/--prune_ratio, see Dispatcher.prune_shards
+    prune_ratio = float(value)
+    if not prune_ratio >= 1:
+        raise argparse.ArgumentTypeError(f"prune ratio must be >= 1, got {value}")
+    return prune_ratio
 
 class Dispatcher:
     '''
     Dispatcher re-batch queries in a "intelligent" way, then search knn centroids and return a search topology
     '''
-    def __init__(self, centriod_idx_paths, index_store, verbose=True):
+    def __init__(self, centriod_idx_paths, verbose=True, router=None, catalog=None):
+        '''
+        args:
+            - centriod_idx_paths: centroid index (flat, HNSW or IVF, see create_shard_idx.py --centroid_index)
+            - router: CentroidRouter to use instead of loading centriod_idx_paths (e.g. with search parameters)
+            - catalog: ShardCatalog, index-major plans are ordered by queries per loaded byte (cost aware)
+        '''
         self.centriod_idx_paths = centriod_idx_paths
-        self.index_store = index_store
+        self.catalog = catalog
         self.verbose = verbose
+        # pinned for the lifetime of the dispatcher, never ranked or evicted like a data shard
+        self.router = router if router is not None else CentroidRouter.from_file(centriod_idx_paths)
+
+    @property
+    def shard_bytes(self):
+        # shard sizes for cost-aware plans, None without a catalog
+        return None if self.catalog is None else self.catalog.shard_bytes
 
     def batch_by_distruibution(self):
         pass
 
-    def search_knn_centroids(self, queries, nprobe):
-        self.D, self.I = query_index_file(self.centriod_idx_paths, queries, nprobe, self.index_store)
+    @Logger.log_route_time
+    def route(self, queries, nprobe):
+        '''
+        Stateless centroid routing, safe to run for the next batch while the current one is searching
+
+        return:
+            - D, I: (num_queries, nprobe) centroid distances and shard ids
+        '''
+        return self.router.search(queries, nprobe)
+
+    def search_knn_centroids(self, queries, nprobe, prune_ratio=None):
+        '''
+        prune_ratio: adaptive nprobe, see prune_shards (None: every query probes nprobe shards)
+        '''
+        self.D, self.I = self.route(queries, nprobe)
+        if prune_ratio is not None:
+            self.I = self.prune_shards(self.D, self.I, prune_ratio)
         if self.verbose:
             print("Top-k centroids")
             print(self.I)
             print()
 
     def create_search_outterloop_query_topology(self, queries):
-        stopology = {}
-        for i in range(len(queries)):
-            stopology[i] = list(self.I[i])
-        return stopology
+        # {q1: [idx1, idx2, ..], ...} as a query-major SearchPlan, shards in probe order
+        return self.search_plan(self.I[:len(queries)], major="query")
     
-    def create_search_outterloop_index_topology(self):
+    def create_search_outterloop_index_topology(self, sort_by_size=False):
         # stopology = self.create_search_outterloop_query_topology()
         # return query_to_index_stopology(stopology)
-        # self.I is a 2D array of shape (num_queries, k)
-        # {idx1: [q1, q2, ..], idx2: [q3, q4, ...]}
-        stopology = {}
-        for q_idx, idxs in enumerate(self.I):
-            for idx in idxs:
-                if idx in stopology:
-                    stopology[idx].append(q_idx)
-                else:
-                    stopology[idx] = [q_idx]
-        return stopology
-    
\ No newline at end of file
+        return self.search_plan(self.I, sort_by_size=sort_by_size, shard_bytes=self.shard_bytes)
+
+    @staticmethod
+    def prune_shards(D, I, prune_ratio, min_nprobe=1):
+        '''
+        Adaptive per-query nprobe: drop the shards whose centroid is much farther than the nearest one.
+        Shard j of a query is kept if D[j] <= prune_ratio * D[0] (squared L2), pruned shards become -1 (skipped by search_plan).
+
+        args:
+            - D, I: (num_queries, nprobe) centroid distances (ascending) and shard ids
+            - prune_ratio: >= 1, larger keeps more shards (inf: fixed nprobe)
+            - min_nprobe: the nearest min_nprobe shards are always kept
+        return:
+            - I with pruned shards set to -1
+        '''
+        if not prune_ratio >= 1:
+            raise ValueError(f"prune_ratio must be >= 1, got {prune_ratio}")
+        keep = D <= prune_ratio * D[:, :1]
+        keep[:, :min_nprobe] = True
+        return np.where(keep, I, -1)
+
+    @staticmethod
+    def lower_bounds(D, I, radii):
+        '''
+        Lower bound of the distance between a query and any vector of a probed shard (triangle inequality):
+        ||q - x|| >= ||q - c|| - r for every x of a shard with centroid c and radius r.
+
+        args:
+            - D, I: (num_queries, nprobe) squared L2 centroid distances and shard ids, -1 for no probe
+            - radii: (num_shards,) max L2 distance of a shard vector to its centroid (create_shard_idx.py)
+        return:
+            - (num_queries, nprobe) squared L2 lower bounds, inf for no probe
+        '''
+        radii = np.asarray(radii, dtype=np.float32)
+        bounds = np.maximum(np.sqrt(np.maximum(D, 0)) - radii[np.maximum(I, 0)], 0) ** 2
+        return np.where(I >= 0, bounds, np.inf).astype(np.float32)
+
+    @staticmethod
+    def search_plan(I, sort_by_size=False, major="index", shard_bytes=None):
+        '''
+        Build the search plan from the centroid search, argsort over I instead of looping over every (query, probe) pair.
+
+        args:
+            - I: (num_queries, nprobe) shard ids of each query, negative ids are skipped
+            - sort_by_size: index-major only, order shards by number of queries, largest first
+            - major: "index" ({idx1: [q1, q2, ..], idx2: [q3, q4, ...]}) or "query" ({q1: [idx1, idx2, ..]})
+            - shard_bytes: (num_shards,) shard sizes, sort_by_size orders by queries per byte (most work per load first)
+        '''
+        num_queries, nprobe = I.shape
+        shards = I.ravel()
+        q_all = np.repeat(np.arange(num_queries, dtype=np.int32), nprobe)
+        slots = np.tile(np.arange(nprobe, dtype=np.int16), num_queries)
+        valid = shards >= 0
+        if not valid.all():
+            shards, q_all, slots = shards[valid], q_all[valid], slots[valid]
+        if major == "query":
+            return SearchPlan.from_pairs(q_all, shards, slots=slots, major="query")
+        return SearchPlan.from_pairs(shards, q_all, slots=slots, sort_by_size=sort_by_size, id_costs=shard_bytes)
@@ -1,56 +1,83 @@
 '''
-Ranking policies: 
+Ranking policies:
     - LRU: Least Recently Used
     - LFU: Least Frequently Used
-    - Multi-Queue: Multiple queues for different priorities
-    - statistics-based: based on statistics of the index
+    - ARC: Adaptive Replacement Cache, recency / frequency lists with ghost entries
+    - 2Q: FIFO for first accesses, LRU for indexes that come back
+    - WTINYLFU: window LRU + segmented LRU main, admission by a count-min frequency sketch
+    - BELADY: offline oracle, replays a recorded access trace (upper bound on the hit rate)
+
+The data structures of each policy live in utils/ranking_policies.py
 '''
 
+from utils.ranking_policies import create_policy
+
 class IndexManager:
     """
     A class to manage index file rankings
     """
-    def __init__(self, policy='LFU'):
+    def __init__(self, policy='LFU', decay_interval=None, capacity=1000, trace=None, record_trace=False):
         '''
-        The manager keep track of all the indexes and their rankings. Always assume reverse=True, the ranking is in descending order
-        
+        The manager keep track of all the indexes and their rankings. Always assume reverse=True, the ranking is in descending order.
+        It also tracks which indexes are resident in the store, so the eviction victim is found in O(1).
+
         args:
-            - policy: str, the ranking policy to use, either LFU or LRU
+            - policy: str, the ranking policy to use, one of LFU, LRU, ARC, 2Q, WTINYLFU, BELADY
                 - LFU: Least Frequently Used
                 - LRU: Least Recently Used
+            - decay_interval: LFU only, halve all frequencies every decay_interval accesses (None: no decay)
+            - capacity: ARC, 2Q, WTINYLFU only, number of indexes the store can hold (IndexStore.policy_capacity sets it)
+            - trace: BELADY only, list of index paths in access order (see record_trace)
+            - record_trace: keep every accessed index path in self.trace
         '''
         self.policy = policy
+        self.decay_interval = decay_interval
+        self.capacity = capacity
+        self.trace = trace
+        self.ranking = create_policy(policy, decay_interval=decay_interval, capacity=capacity, trace=trace)
+        self.record_trace = record_trace
+        self.access_trace = []
 
-        self.rankings = []
-        self.ranking_dict = {}
-        self.ranking_updated = True
+    @property
+    def ranking_dict(self):
+        # {index_path: rank}, built on demand
+        return self.ranking.ranks()
 
     def update_index_rank(self, index_path, rank):
-        if self.policy == 'LFU' and index_path in self.ranking_dict:
-            self.ranking_dict[index_path] += rank
-        else:
-            self.ranking_dict[index_path] = rank
-        self.ranking_updated = False
+        '''
+        rank: access time for LRU, frequency increment for LFU, ignored by the other policies
+        '''
+        if self.record_trace:
+            self.access_trace.append(index_path)
+        self.ranking.access(index_path, rank)
+
+    def add_resident(self, index_path):
+        self.ranking.admit(index_path)
+
+    def remove_resident(self, index_path):
+        self.ranking.evict(index_path)
+
+    def get_victim(self):
+        # lowest ranked resident index, None if nothing is resident
+        return self.ranking.victim()
 
     def get_tail_index(self, k=1):
-        print("get_tail_index")
-        if not self.ranking_updated:
-            print('sort_rankings')
-            self.sort_rankings()
-        return self.rankings[-k:]
+        return self.ranking.tail(k)
 
     def get_head_index(self, k=1):
-        if not self.ranking_updated:
-            self.sort_rankings()
-        return self.rankings[:k]
-    
+        return self.ranking.head(k)
+
+    def set_capacity(self, capacity):
+        # ARC, 2Q and WTINYLFU size their lists from the capacity, rebuild them (residents are kept)
+        if capacity == self.capacity:
+            return
+        self.capacity = capacity
+        if self.policy in ['ARC', '2Q', 'WTINYLFU']:
+            self.reset_rankings()
+
     def reset_rankings(self):
-        self.rankings = []
-        self.ranking_dict = {}
-        self.ranking_updated = True
-
-    def sort_rankings(self):
-        # sort the ranking dict by value, 
-        # Set rankings list with sort keys: [idx10, idx22, ...] sort by values. 
-        self.rankings = sorted(self.ranking_dict, key=self.ranking_dict.get, reverse=True)
-        self.ranking_updated = True
+        # forget the rankings, keep track of what is resident
+        residents = self.ranking.residents()
+        self.ranking = create_policy(self.policy, decay_interval=self.decay_interval, capacity=self.capacity, trace=self.trace)
+        for index_path in residents:
+            self.ranking.admit(index_path)
@@ -4,13 +4,18 @@ Index store class
     - Add, get and remove indexes
 '''
 
+import os
 import time
+import heapq
 import asyncio
 import threading
 import multiprocessing
+from collections import deque
+from concurrent.futures import Future, wait, FIRST_COMPLETED
 
-import faiss
+import numpy as np
 from utils.logger import Logger
+from utils.vdb_utils import read_index, index_resident_bytes
 
 
 class ThreadDataLoader(threading.Thread):
@@ -52,13 +57,21 @@ class ThreadDataLoader(threading.Thread):
     def update_files_to_load(self, file_paths):
         self.file_paths_to_load = file_paths
 
+    def cancel(self, file_paths):
+        file_paths = set(file_paths)
+        self.file_paths_to_load = [f for f in self.file_paths_to_load if f not in file_paths]
+
     def parse_stopology(self, stopology):
         self.file_paths_to_load = [self.all_file_paths[idx] for idx in stopology.keys()]
 
     def fetch_data(self, file_path):
         # Add index to the store
         # if file_path not in self.index_store.indexes:
-        self.index_store.add_index_from_path(file_path)
+        try:
+            self.index_store.add_index_from_path(file_path)
+        except Exception as e:
+            # waiters get the exception from the load future
+            print(f"loading {file_path} failed: {e}")
         # print(f"Index {file_path} has been loaded.")
         try:
             self.file_paths_to_load.remove(file_path)
@@ -78,19 +91,183 @@ class ThreadDataLoader(threading.Thread):
         self.resume_loading()  # If it's paused, we need to resume it to allow it to exit
         # print("Stopping the loader...")
 
+class ThreadDataLoaderPool:
+    '''
+    A pool of loader threads, N shards are read concurrently
+        - Files are loaded in priority order: position in the search topology (first searched, first loaded)
+        - update_files_to_load replaces the queue, pending loads that are no longer needed are cancelled
+        - Loads already in flight are not interrupted
+    Same interface as ThreadDataLoader. Unlike it, an empty queue does not fall back to hot indexes, 
+    the caller sets them (see squery_shard_idx.py).
+    '''
+    def __init__(self, Index_store, all_file_paths:list, num_loaders=4):
+        self.keep_running = True
+        self.paused = threading.Event()
+        self.paused.set()  # Set initially to not paused
+        self.index_store = Index_store
+        self.all_file_paths = all_file_paths
+        self.num_loaders = num_loaders
+
+        # heap of (priority, file_path), entries not matching self.pending are cancelled (lazy deletion)
+        self.cond = threading.Condition()
+        self.queue = []
+        self.pending = {}
+        # bumped on every wake up (resume, new files), a loader only sleeps if nothing changed since it looked
+        self.resumes = 0
+        self.threads = [threading.Thread(target=self.run, daemon=True) for _ in range(num_loaders)]
+
+    def start(self):
+        for thread in self.threads:
+            thread.start()
+
+    def join(self):
+        for thread in self.threads:
+            thread.join()
+
+    def run(self):
+        while self.keep_running:
+            self.paused.wait()  # This will block if the loader is paused
+            seen = self.resumes
+
+            # never evict to prefetch, wait for the search to release a slot (remove_index resumes the loader)
+            # topology eviction: may replace indexes used later than the one to load (fills the store in plan order)
+            # NOTE: do not hold self.cond while touching the store lock, remove_index calls resume_loading with it held
+            if self.index_store.evict_policy != "topology" and self.index_store.at_capacity():
+                self.wait_for_resume(seen)
+                continue
+
+            item = self.next_file_path()
+            if item is None:
+                self.wait_for_resume(seen)
+                continue
+            self.fetch_data(*item, seen=seen)
+
+    def next_file_path(self):
+        with self.cond:
+            while len(self.queue) > 0:
+                priority, file_path = heapq.heappop(self.queue)
+                if self.pending.get(file_path) != priority:
+                    # cancelled or re-prioritized
+                    continue
+                del self.pending[file_path]
+                if file_path in self.index_store.indexes:
+                    # loaded (or loading) by someone else
+                    continue
+                return priority, file_path
+        return None
+
+    def fetch_data(self, priority, file_path, seen=None):
+        try:
+            if self.index_store.add_index_from_path(file_path, evict=self.index_store.evict_policy == "topology", prefetch=True):
+                return
+        except Exception as e:
+            # waiters get the exception from the load future, keep the loader alive
+            print(f"loading {file_path} failed: {e}")
+            return
+        if file_path not in self.index_store.indexes:
+            # the store filled up in the meantime (or it does not fit the memory budget yet), put it back
+            with self.cond:
+                if file_path not in self.pending:
+                    self.pending[file_path] = priority
+                    heapq.heappush(self.queue, (priority, file_path))
+            self.wait_for_resume(seen)
+
+    def wait_for_resume(self, seen=None, timeout=0.05):
+        with self.cond:
+            if seen is None or seen == self.resumes:
+                self.cond.wait(timeout=timeout)
+
+    def update_files_to_load(self, file_paths):
+        '''
+        Replace the load queue, priority is the position in file_paths
+        '''
+        with self.cond:
+            self.pending = {}
+            for priority, file_path in enumerate(file_paths):
+                self.pending.setdefault(file_path, priority)
+            self.queue = [(priority, file_path) for file_path, priority in self.pending.items()]
+            heapq.heapify(self.queue)
+            self.resumes += 1
+            self.cond.notify_all()
+
+    def extend_files_to_load(self, file_paths):
+        '''
+        Queue file_paths after everything already queued (lookahead prefetch of the next batch)
+        '''
+        with self.cond:
+            priority = max(self.pending.values(), default=-1) + 1
+            for file_path in file_paths:
+                if file_path not in self.pending:
+                    self.pending[file_path] = priority
+                    heapq.heappush(self.queue, (priority, file_path))
+                    priority += 1
+            self.resumes += 1
+            self.cond.notify_all()
+
+    def cancel(self, file_paths):
+        with self.cond:
+            for file_path in file_paths:
+                self.pending.pop(file_path, None)
+
+    def parse_stopology(self, stopology):
+        self.update_files_to_load([self.all_file_paths[idx] for idx in stopology.keys()])
+
+    def pause_loading(self):
+        self.paused.clear()  # Clearing the event to pause
+
+    def resume_loading(self):
+        self.paused.set()  # Setting the event to resume
+        with self.cond:
+            self.resumes += 1
+            self.cond.notify_all()
+
+    def stop_loading(self):
+        self.keep_running = False
+        self.resume_loading()  # If it's paused, we need to resume it to allow it to exit
+
 class IndexStore:
     '''
     A class to store indexes in memory for faster access
     '''
-    def __init__(self, max_indexes=1000, index_manager=None):
+    def __init__(self, max_indexes=1000, index_manager=None, mmap=False, mem_budget_mb=None, evict_policy="rank", catalog=None):
+        '''
+        args:
+            - max_indexes: max number of indexes in the store
+            - index_manager: IndexManager, used to rank indexes for eviction
+            - mmap: map IVF inverted lists from disk instead of reading them into RAM
+            - mem_budget_mb: max resident MB of loaded indexes, None means only max_indexes applies
+            - evict_policy: how the victim is chosen
+                - rank: lowest ranked index of the index_manager
+                - topology: Belady within the batch, the index whose next use in the search plan is farthest (or never), see set_search_plan
+            - catalog: ShardCatalog, byte size of every shard before its first load (no stat per load)
+        '''
         self.indexes = {}
         self.num_indexes = 0
         self.max_indexes = max_indexes
+        self.mmap = mmap
+        self.mem_budget_bytes = None if mem_budget_mb is None else int(mem_budget_mb * 2**20)
+        # resident bytes of each index in the store (estimate while loading), see vdb_utils.index_resident_bytes
+        self.index_bytes = {}
+        self.resident_bytes = 0
+        # measured size of every index loaded so far, used to estimate the next load
+        self.known_index_bytes = {}
+        self.catalog = catalog
+        # {index_path: Future} for indexes that are loading, resolved with the index (or the load exception)
+        self.load_futures = {}
         self.index_manager = index_manager
         self.index_loader = None
-        self.local_ranking_dict = {}
-        self.local_ranking_list = []
-        self.lock = threading.Lock()
+        # indexes prefetched for the next query batch, evicted only if nothing else can be
+        self.protected = set()
+        if evict_policy not in ["rank", "topology"]:
+            raise ValueError("Invalid evict policy: {}".format(evict_policy))
+        self.evict_policy = evict_policy
+        # {index_path: deque of positions in the search plan not searched yet}
+        self.plan_next = {}
+        # get_index calls that found the index loaded (hits) or had to wait for a load (misses)
+        self.hits = 0
+        self.misses = 0
+        # re-entrant: evict_index -> remove_index is called while holding the lock
+        self.lock = threading.RLock()
 
         '''
         Obtain rank_policy from index_manager
@@ -99,36 +276,78 @@ class IndexStore:
         '''
         if self.index_manager is not None:
             self.rank_policy = self.index_manager.policy
+            if self.catalog is not None:
+                self.index_manager.set_capacity(self.policy_capacity(self.catalog.paths))
+
+    def policy_capacity(self, index_paths):
+        '''
+        Number of indexes the store can hold, the capacity of the ranking policy: max_indexes, or fewer when the
+        memory budget binds (budget / mean estimated size of index_paths, serialized sizes before the first load).
+        Computed once, the policy is not resized as the measured sizes come in.
+        '''
+        if self.mem_budget_bytes is None or len(index_paths) == 0:
+            return self.max_indexes
+        mean_bytes = sum(self.estimate_index_bytes(index_path) for index_path in index_paths) / len(index_paths)
+        return max(1, min(self.max_indexes, int(self.mem_budget_bytes // max(mean_bytes, 1))))
 
     def set_index_loader(self, index_loader):
         self.index_loader = index_loader
 
-    def cleanup(self, stopology, idxpath2id_map):
+    def set_search_plan(self, index_paths):
+        '''
+        Order in which the batch will get its indexes (index-major: every shard once, query-major: with repeats).
+        The topology evict policy evicts the index used farthest in this plan.
+        '''
+        with self.lock:
+            self.plan_next = {}
+            for pos, index_path in enumerate(index_paths):
+                self.plan_next.setdefault(index_path, deque()).append(pos)
+
+    def advance_plan(self, index_path):
+        # the next planned use of index_path is happening now
+        with self.lock:
+            positions = self.plan_next.get(index_path)
+            if positions:
+                positions.popleft()
+                if len(positions) == 0:
+                    del self.plan_next[index_path]
+
+    def next_use(self, index_path):
+        positions = self.plan_next.get(index_path)
+        return positions[0] if positions else float('inf')
+
+    def cleanup(self, stopology, idxpath2id_map, evict_unused=False):
         '''
         rm idx that is not in stopology, used in serving
+
+        args:
+            - stopology: index-major SearchPlan
+            - evict_unused: remove resident indexes this plan does not use, lowest ranked first and only while the store
+              is at capacity. Off by default: indexes kept between batches (hot reload) stay cached for later batches
+        return:
+            - the plan reordered, indexes already in DRAM first
         '''
-        updated_stopology = stopology.copy()
         remove_idxs = []
-        dram_required_idxs = [] # [(idx: [q1,q2], ...)]
+        dram_required_idxs = [] # plan positions of the indexes already in DRAM
 
-        # BE CAREFUL: indexes: {full_idx_path: [q1]}, stopology: {idx: [q1]}
+        # BE CAREFUL: indexes: {full_idx_path: index}, stopology: {idx: [q1]}
         with self.lock:
-            for idx_path in self.indexes.keys():
+            for idx_path, index in self.indexes.items():
                 if "centroids" in idx_path:
                     # centroid will not present in stopology
                     continue
                 idx = idxpath2id_map[idx_path]
-                if idx not in updated_stopology.keys():
-                    remove_idxs.append(idx)
+                pos = stopology.position(idx)
+                if pos is None:
+                    if index != "loading":
+                        remove_idxs.append(idx_path)
                 else:
-                    dram_required_idxs.append( (idx, updated_stopology[idx]) )
-
-                    # Update later
-                    del updated_stopology[idx]
+                    dram_required_idxs.append(pos)
         
         # clear up unnecessary indexes
         # print("clean up: ", remove_idxs)
-        self.remove_multiple_indexes(remove_idxs)
+        if evict_unused:
+            self.evict_unused(remove_idxs)
 
         '''
         Locality aware batching
@@ -137,72 +356,195 @@ class IndexStore:
                 - finish faster quickly allow to load more indexes
             3. Append old st to the end
         '''
-        # dram_required_idxs = sorted(dram_required_idxs, key=lambda x: len(x[1]), reverse=False)
+        # dram_required_idxs = sorted(dram_required_idxs, key=lambda x: stopology.sizes[x], reverse=False)
         # print(len(dram_required_idxs))
-        dram_required_idxs.extend(list(updated_stopology.items()))
-        updated_stopology = dict(dram_required_idxs)
-        return updated_stopology
+        in_dram = np.zeros(len(stopology), dtype=bool)
+        in_dram[dram_required_idxs] = True
+        order = np.concatenate([np.array(dram_required_idxs, dtype=np.int64), np.flatnonzero(~in_dram)])
+        return stopology.reorder(order)
+
+    def evict_unused(self, index_paths):
+        # free slots for the plan, never below capacity: unused indexes may serve a later batch
+        if self.index_manager is not None:
+            # head is the highest ranked, unranked indexes go first
+            ranks = {index_path: pos for pos, index_path in enumerate(self.index_manager.get_head_index(k=len(self.indexes)))}
+            index_paths = sorted(index_paths, key=lambda index_path: -ranks.get(index_path, len(ranks)))
+        for index_path in index_paths:
+            if not self.at_capacity():
+                break
+            self.remove_index(index_path)
 
     @Logger.log_index_load_time
     def load_index(self, index_path):
-        # update index status, 1 means it is currently loading
+        # index status ("loading") is reserved by the caller, see add_index_from_path
+        return read_index(index_path, mmap=self.mmap)
+
+    def estimate_index_bytes(self, index_path):
+        # measured size if it has been loaded before, otherwise the serialized size (catalog, or the file)
+        if index_path in self.known_index_bytes:
+            return self.known_index_bytes[index_path]
+        nbytes = self.catalog.nbytes(index_path) if self.catalog is not None else None
+        return nbytes if nbytes is not None else os.path.getsize(index_path)
+
+    def make_room(self, nbytes, evict=True, for_index=None):
+        '''
+        Evict by ranking until one more index of nbytes fits. 
+        Return False if it does not fit (evict is False, or only loading indexes are left).
+        An empty store always admits, even an index larger than the budget.
+
+        args:
+            - for_index: prefetched index path, only evict indexes it would replace (see evict_index)
+        '''
         with self.lock:
+            while len(self.indexes) > 0 and self.at_capacity(nbytes):
+                if not evict or self.evict_index(for_index=for_index) is None:
+                    return False
+            return True
+
+    def reserve_index(self, index_path, evict=True, prefetch=False):
+        '''
+        Reserve a slot ("loading") for index_path, atomically, several threads can load at once.
+        The estimated size is charged to the memory budget until the index is loaded.
+
+        args:
+            - evict: make room if the store is at capacity, otherwise give up
+            - prefetch: nobody waits for index_path yet, never evict an index needed sooner than it
+        return:
+            - False if the index is already in the store, or it does not fit and evict is False
+        '''
+        nbytes = self.estimate_index_bytes(index_path)
+        with self.lock:
+            if index_path in self.indexes:
+                return False
+            if not self.make_room(nbytes, evict=evict, for_index=index_path if prefetch else None):
+                return False
             self.indexes[index_path] = "loading"
-        return faiss.read_index(index_path)
+            # reuse the future if an earlier load of this path is still in flight (removed while loading)
+            self.load_futures.setdefault(index_path, Future())
+            self.set_index_bytes(index_path, nbytes)
+            return True
 
-    def add_index_from_path(self, index_path):
+    def add_index_from_path(self, index_path, evict=True, prefetch=False):
         '''
         This design here is stupid. calling load_index will increase the num_indexes without respect to the capacity. 
-        So I also handle the capacity here.
+        So I also handle the capacity here, see reserve_index. Return True if the index has been loaded by this call.
         '''
-        if self.at_capacity():
-            self.evict_index()
-        self.add_index(index_path, self.load_index(index_path))
+        if not self.reserve_index(index_path, evict=evict, prefetch=prefetch):
+            return False
+        try:
+            index = self.load_index(index_path)
+        except Exception as e:
+            self.fail_load(index_path, e)
+            raise
+        self.add_index(index_path, index)
+        return True
+
+    def fail_load(self, index_path, exception):
+        # release the reserved slot and wake up the waiters with the exception
+        with self.lock:
+            if self.indexes.get(index_path) == "loading":
+                self.remove_index(index_path)
+            future = self.load_futures.pop(index_path, None)
+        if future is not None:
+            future.set_exception(exception)
 
     def add_index(self, index_path, index):
-        # handle evicting indexes if the store is at capacity
-        if self.at_capacity():
-            self.evict_index()
-        
+        nbytes = index_resident_bytes(index, index_path, mmap=self.mmap)
         with self.lock:
+            self.known_index_bytes[index_path] = nbytes
+            # handle evicting indexes if the store is at capacity, a reserved ("loading") path already holds a slot
+            if index_path not in self.indexes:
+                self.make_room(nbytes)
             # print("adding {}th idx".format(self.num_indexes))
             self.indexes[index_path] = index
             self.num_indexes = len(self.indexes)
+            self.set_index_bytes(index_path, nbytes)
+            if self.index_manager is not None:
+                self.index_manager.add_resident(index_path)
+            future = self.load_futures.pop(index_path, None)
+        if future is not None:
+            future.set_result(index)
+
+    def set_index_bytes(self, index_path, nbytes):
+        with self.lock:
+            self.resident_bytes += nbytes - self.index_bytes.get(index_path, 0)
+            self.index_bytes[index_path] = nbytes
 
     def get_index(self, index_path, query_shape=None):
         '''
         User trying to get index
             - User need it now
             - Do not evict this index
+            - Block until it is loaded, a failed load raises here
 
         args:
             - index_path: str, path to the index file
-            - query_size: int, use to update the ranking
+            - query_shape: shape of the query batch searched on the index, LFU adds its number of queries to the rank
         '''
-        if self.index_manager is not None:
-            if self.rank_policy == 'LFU':
-                self.index_manager.update_index_rank(index_path, query_shape[0]/1000.)
-            else:
-                self.index_manager.update_index_rank(index_path, time.perf_counter())
+        self.update_rank(index_path, query_shape)
+        self.count_access(index_path)
+        self.advance_plan(index_path)
 
         # evict before adding new index
         # if self.at_capacity():
             # self.evict_index()
 
-        if index_path not in self.indexes:
-            # print("NOT loaded yet. Loading now...")
-            self.add_index_from_path(index_path)
-        elif self.indexes[index_path] == "loading":
-            while self.indexes[index_path] == "loading":
-                time.sleep(0.000001)
-        
-        return self.indexes[index_path]
+        return self.wait_for_index(index_path)
+
+    def update_rank(self, index_path, query_shape=None):
+        if self.index_manager is not None:
+            with self.lock:
+                if self.rank_policy == 'LFU':
+                    # weighted by the queries of the access (baseline query_shape[0]/1000., same order),
+                    # LFU frequencies are integer buckets
+                    self.index_manager.update_index_rank(index_path, 1 if query_shape is None else max(1, int(query_shape[0])))
+                else:
+                    self.index_manager.update_index_rank(index_path, time.perf_counter())
+
+    def count_access(self, index_path):
+        with self.lock:
+            index = self.indexes.get(index_path)
+            if index is None or index_path in self.load_futures:
+                self.misses += 1
+            else:
+                self.hits += 1
+
+    def hit_rate(self):
+        total = self.hits + self.misses
+        return self.hits / total if total > 0 else 0.
+
+    def wait_for_index(self, index_path):
+        '''
+        Return the loaded index, load it now if nobody is loading it.
+        Waiters block on the load future (no busy waiting).
+        '''
+        while True:
+            with self.lock:
+                index = self.indexes.get(index_path)
+                future = self.load_futures.get(index_path)
+
+            if future is not None:
+                # loading (possibly removed from the store meanwhile), raises if the load failed
+                return future.result()
+            elif index is None:
+                # NOT loaded yet. Loading now...
+                if not self.add_index_from_path(index_path):
+                    # no room, everything left in the store is loading: wait for one of them
+                    with self.lock:
+                        loading_futures = list(self.load_futures.values())
+                    if len(loading_futures) > 0:
+                        wait(loading_futures, return_when=FIRST_COMPLETED)
+            else:
+                return index
 
     def remove_index(self, index_path):
         with self.lock:
             if index_path in self.indexes:
                 del self.indexes[index_path]
                 self.num_indexes -= 1
+                self.resident_bytes -= self.index_bytes.pop(index_path, 0)
+                if self.index_manager is not None:
+                    self.index_manager.remove_resident(index_path)
         
         if self.index_loader is not None:
             self.index_loader.resume_loading()
@@ -221,35 +563,100 @@ class IndexStore:
             print(e)
             print("delete index failed")
 
+    def invalidate(self, index_path):
+        '''
+        The file of index_path has been replaced by a new version (utils/shard_updater.py): drop the resident copy
+        and its measured size, the next get_index (or prefetch) loads the new file
+        '''
+        with self.lock:
+            future = self.load_futures.get(index_path)
+        if future is not None:
+            # a load in flight may have read the old file, let it finish and drop it
+            try:
+                future.result()
+            except Exception:
+                pass
+        with self.lock:
+            self.known_index_bytes.pop(index_path, None)
+        self.remove_index(index_path)
+
+    def protect(self, index_paths):
+        '''
+        Replace the set of protected indexes (lookahead: the shards of the next query batch)
+        '''
+        with self.lock:
+            self.protected = set(index_paths)
+
+    def release_index(self, index_path):
+        '''
+        The current batch is done with index_path: remove it, the loader must not bring it back for this batch.
+        If the next batch needs it (protected), it goes back to the end of the load queue instead.
+        '''
+        self.remove_index(index_path)
+        if self.index_loader is not None:
+            with self.lock:
+                protected = index_path in self.protected
+            if protected:
+                self.index_loader.extend_files_to_load([index_path])
+            else:
+                self.index_loader.cancel([index_path])
+
     def remove_multiple_indexes(self, index_paths):
         for index_path in index_paths:
             self.remove_index(index_path)
 
-    def at_capacity(self):
+    def at_capacity(self, nbytes=0):
+        '''
+        True if max_indexes is reached, or one more index of nbytes would exceed the memory budget
+        '''
         with self.lock:
             self.num_indexes = len(self.indexes)
             if self.num_indexes > self.max_indexes:
                 raise Exception("Index store is exceeding the maximum capacity!!! there is a bug in the code. {} > {}".format(self.num_indexes, self.max_indexes))
+            if self.mem_budget_bytes is not None and self.resident_bytes + max(nbytes, 1) > self.mem_budget_bytes:
+                return True
             return self.num_indexes >= self.max_indexes
     
-    def reset_local_ranking(self):
-        self.local_ranking_dict = {}
-        for index_path in self.indexes.keys():
-            # obtain ranking for DRAM-index from the index manager
-            try:
-                self.local_ranking_dict[index_path] = self.index_manager.ranking_dict[index_path]
-            except:
-                # index could be swapped out but have a ranking
-                self.local_ranking_dict[index_path] = 0
+    def evict_index(self, for_index=None):
+        '''
+        Remove the lowest ranked index (oldest without index manager), or the one used farthest in the search plan (topology).
+        Return its path, None if nothing can be evicted (everything is loading).
 
-    def evict_index(self):
-        if self.index_manager is not None:
-            self.reset_local_ranking()
-            self.local_ranking_list = sorted(self.local_ranking_dict, key=self.local_ranking_dict.get, reverse=True)
-            remove_ids_key = self.local_ranking_list[-1]
-        else:
-            remove_ids_key = list(self.indexes.keys())[0]
-        self.remove_index(remove_ids_key)
+        args:
+            - for_index: topology only, the index to make room for. Give up if every candidate is needed before it,
+                         the loader then fills the store in plan order instead of evicting what it just loaded
+        '''
+        with self.lock:
+            if self.evict_policy == "topology":
+                return self.evict_farthest_index(for_index)
+            if self.index_manager is not None:
+                # the manager only tracks loaded indexes, loading ones are never victims
+                remove_ids_key = self.index_manager.get_victim()
+            else:
+                remove_ids_key = next((index_path for index_path, index in self.indexes.items() if index != "loading"), None)
+            if remove_ids_key in self.protected:
+                # prefetched for the next batch, take any unprotected loaded index instead (the victim if there is none)
+                remove_ids_key = next((index_path for index_path, index in self.indexes.items() 
+                                       if index != "loading" and index_path not in self.protected), remove_ids_key)
+            if remove_ids_key is None:
+                return None
+            self.remove_index(remove_ids_key)
+            return remove_ids_key
+
+    def evict_farthest_index(self, for_index=None):
+        with self.lock:
+            # farthest next use first, then unprotected before protected
+            # an index being searched has been consumed from the plan, evicting it is safe: the searcher holds a reference
+            candidates = [index_path for index_path, index in self.indexes.items() if index != "loading"]
+            remove_ids_key = max(candidates, default=None, key=lambda index_path: (
+                self.next_use(index_path), index_path not in self.protected))
+            if remove_ids_key is None:
+                return None
+            if for_index is not None and self.next_use(remove_ids_key) <= self.next_use(for_index):
+                # Belady would not admit for_index
+                return None
+            self.remove_index(remove_ids_key)
+            return remove_ids_key
 
 
 
@@ -30,6 +30,17 @@ class Logger:
             return result
         return wrapper
 
+    @staticmethod
+    def log_route_time(func):
+        # centroid routing of a query batch: func(self, queries, ...), self has centriod_idx_paths
+        def wrapper(*args, **kwargs):
+            start_time = time.perf_counter()
+            result = func(*args, **kwargs)
+            elapsed_time = time.perf_counter() - start_time
+            logging.info(f"{start_time},Func:{func.__name__},{elapsed_time:.8f}s,{args[0].centriod_idx_paths},{args[1].shape[0]}")
+            return result
+        return wrapper
+
     @staticmethod
     def log_function_time(func):
         # A generic function to log the time taken by a function to execute
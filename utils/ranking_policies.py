@@ -0,0 +1,614 @@
+'''
+Ranking policies used by the IndexManager
+
+Every policy keeps two views:
+    - all indexes ever accessed, used for ranking (get_head_index: hot indexes to prefetch)
+    - resident indexes (loaded in the IndexStore), used to pick the eviction victim
+
+Policy interface:
+    - access(key, rank): key is requested (hit or miss)
+    - admit(key) / evict(key): key is loaded into / removed from the store
+    - victim(): resident key to evict, None if no resident key
+    - residents(): resident keys
+    - head(k) / tail(k): k hottest / coldest keys
+    - ranks(): {key: rank}
+'''
+
+import bisect
+import heapq
+import itertools
+from collections import OrderedDict, deque
+
+import numpy as np
+
+
+class LRUPolicy:
+    '''
+    Least Recently Used, ordered dicts (oldest first): O(1) access, admit, evict and victim
+    '''
+    def __init__(self):
+        # {key: last access time}
+        self.recency = OrderedDict()
+        self.resident = OrderedDict()
+
+    def access(self, key, rank):
+        self.recency[key] = rank
+        self.recency.move_to_end(key)
+        if key in self.resident:
+            self.resident.move_to_end(key)
+
+    def admit(self, key):
+        # a newly loaded index is the most recent resident
+        self.resident[key] = None
+        self.resident.move_to_end(key)
+
+    def evict(self, key):
+        self.resident.pop(key, None)
+
+    def victim(self):
+        return next(iter(self.resident), None)
+
+    def residents(self):
+        return list(self.resident)
+
+    def head(self, k):
+        return list(itertools.islice(reversed(self.recency), k))
+
+    def tail(self, k):
+        # coldest last, same order as head
+        return list(itertools.islice(iter(self.recency), k))[::-1]
+
+    def ranks(self):
+        return dict(self.recency)
+
+
+class FrequencyBuckets:
+    '''
+    Keys grouped by frequency: {freq: OrderedDict of keys, least recently bumped first}.
+    Sorted list of non-empty frequencies, the minimum is always freqs[0].
+    '''
+    def __init__(self):
+        self.buckets = {}
+        self.freqs = []
+
+    def add(self, key, freq):
+        bucket = self.buckets.get(freq)
+        if bucket is None:
+            # new frequency: with unit increments it is next to its neighbour, the insert is cheap
+            bucket = self.buckets[freq] = OrderedDict()
+            bisect.insort(self.freqs, freq)
+        bucket[key] = None
+
+    def remove(self, key, freq):
+        bucket = self.buckets[freq]
+        del bucket[key]
+        if len(bucket) == 0:
+            del self.buckets[freq]
+            del self.freqs[bisect.bisect_left(self.freqs, freq)]
+
+    def min_key(self):
+        if len(self.freqs) == 0:
+            return None
+        return next(iter(self.buckets[self.freqs[0]]))
+
+    def keys_desc(self):
+        for freq in reversed(self.freqs):
+            yield from reversed(self.buckets[freq])
+
+    def keys_asc(self):
+        for freq in self.freqs:
+            yield from self.buckets[freq]
+
+
+class LFUPolicy:
+    '''
+    Least Frequently Used, frequency buckets: O(1) victim, access moves a key to the next bucket
+        - frequency: sum of the access ranks (IndexStore: queries searched on the key per access)
+        - decay: every decay_interval accesses all frequencies are halved, so old popularity fades out
+    '''
+    def __init__(self, decay_interval=None):
+        self.freq = {}
+        self.all = FrequencyBuckets()
+        self.resident = FrequencyBuckets()
+        self.resident_keys = set()
+        self.decay_interval = decay_interval
+        self.num_access = 0
+
+    def access(self, key, rank=1):
+        freq = self.freq.get(key)
+        new_freq = (0 if freq is None else freq) + int(rank)
+        self.freq[key] = new_freq
+        if freq is not None:
+            self.all.remove(key, freq)
+        self.all.add(key, new_freq)
+        if key in self.resident_keys:
+            self.resident.remove(key, freq if freq is not None else 0)
+            self.resident.add(key, new_freq)
+
+        self.num_access += 1
+        if self.decay_interval is not None and self.num_access % self.decay_interval == 0:
+            self.decay()
+
+    def decay(self):
+        # halve every frequency, O(n) every decay_interval accesses
+        self.freq = {key: freq // 2 for key, freq in self.freq.items()}
+        self.all = FrequencyBuckets()
+        self.resident = FrequencyBuckets()
+        for key, freq in self.freq.items():
+            self.all.add(key, freq)
+        for key in self.resident_keys:
+            self.resident.add(key, self.freq.get(key, 0))
+
+    def admit(self, key):
+        if key in self.resident_keys:
+            return
+        self.resident_keys.add(key)
+        self.resident.add(key, self.freq.get(key, 0))
+
+    def evict(self, key):
+        if key not in self.resident_keys:
+            return
+        self.resident_keys.remove(key)
+        self.resident.remove(key, self.freq.get(key, 0))
+
+    def victim(self):
+        return self.resident.min_key()
+
+    def residents(self):
+        return list(self.resident_keys)
+
+    def head(self, k):
+        return list(itertools.islice(self.all.keys_desc(), k))
+
+    def tail(self, k):
+        return list(itertools.islice(self.all.keys_asc(), k))[::-1]
+
+    def ranks(self):
+        return dict(self.freq)
+
+
+class ARCPolicy:
+    '''
+    Adaptive Replacement Cache (Megiddo & Modha)
+        - T1: resident, seen once; T2: resident, seen at least twice (LRU ordered dicts)
+        - B1 / B2: ghosts of keys evicted from T1 / T2
+        - p: adaptive target size of T1, grows on a B1 ghost hit, shrinks on a B2 ghost hit
+    A key admitted before any access (prefetched by a loader) is not a use: it waits in T1 as prefetched,
+    its first access counts as the first use (and as the ghost hit, if it was a ghost), the second one promotes it.
+    '''
+    def __init__(self, capacity):
+        self.capacity = max(1, capacity)
+        self.p = 0.
+        self.T1, self.T2 = OrderedDict(), OrderedDict()
+        self.B1, self.B2 = OrderedDict(), OrderedDict()
+        # {key: ghost list it came from or None}, resident in T1 and not used yet
+        self.prefetched = {}
+        # accessed while not resident, the next admit is a demand load
+        self.requested = set()
+
+    def access(self, key, rank=None):
+        if key in self.prefetched:
+            ghost = self.prefetched.pop(key)
+            if ghost is None:
+                self.T1.move_to_end(key)
+            else:
+                self.adapt(ghost)
+                del self.T1[key]
+                self.T2[key] = None
+        elif key in self.T1:
+            del self.T1[key]
+            self.T2[key] = None
+        elif key in self.T2:
+            self.T2.move_to_end(key)
+        else:
+            self.requested.add(key)
+
+    def adapt(self, ghost):
+        # ghost hit in B1: favour recency, in B2: favour frequency
+        if ghost is self.B1:
+            self.p = min(self.capacity, self.p + max(len(self.B2) / max(len(self.B1), 1), 1))
+        else:
+            self.p = max(0., self.p - max(len(self.B1) / max(len(self.B2), 1), 1))
+
+    def admit(self, key):
+        if key in self.T1 or key in self.T2:
+            return
+        ghost = self.B1 if key in self.B1 else (self.B2 if key in self.B2 else None)
+        if key not in self.requested:
+            # prefetch: no use yet, the ghost hit waits for the first access
+            if ghost is not None:
+                del ghost[key]
+            self.prefetched[key] = ghost
+            self.T1[key] = None
+            return
+        self.requested.discard(key)
+        if ghost is not None:
+            self.adapt(ghost)
+            del ghost[key]
+            self.T2[key] = None
+        else:
+            self.T1[key] = None
+
+    def evict(self, key):
+        self.requested.discard(key)
+        if key in self.prefetched:
+            # never used: back to the ghost list it came from, if any
+            ghost = self.prefetched.pop(key)
+            del self.T1[key]
+            if ghost is not None:
+                ghost[key] = None
+        elif key in self.T1:
+            del self.T1[key]
+            self.B1[key] = None
+        elif key in self.T2:
+            del self.T2[key]
+            self.B2[key] = None
+        else:
+            return
+        # |T1| + |B1| <= c, total directory <= 2c
+        while len(self.B1) > 0 and len(self.T1) + len(self.B1) > self.capacity:
+            self.B1.popitem(last=False)
+        while len(self.B2) > 0 and len(self.T1) + len(self.T2) + len(self.B1) + len(self.B2) > 2 * self.capacity:
+            self.B2.popitem(last=False)
+
+    def victim(self):
+        if len(self.T1) > 0 and (len(self.T1) > self.p or len(self.T2) == 0):
+            return next(iter(self.T1))
+        return next(iter(self.T2), None)
+
+    def residents(self):
+        return list(self.T1) + list(self.T2)
+
+    def head(self, k):
+        keys = itertools.chain(reversed(self.T2), reversed(self.T1), reversed(self.B2), reversed(self.B1))
+        return list(itertools.islice(keys, k))
+
+    def tail(self, k):
+        keys = itertools.chain(self.B1, self.B2, self.T1, self.T2)
+        return list(itertools.islice(keys, k))[::-1]
+
+    def ranks(self):
+        # 2: frequent, 1: recent, 0: ghost
+        ranks = {key: 0 for key in itertools.chain(self.B1, self.B2)}
+        ranks.update({key: 1 for key in self.T1})
+        ranks.update({key: 2 for key in self.T2})
+        return ranks
+
+
+class TwoQPolicy:
+    '''
+    2Q (Johnson & Shasha), full version
+        - A1in: FIFO of resident keys seen once, at most kin_ratio of the capacity before it is preferred for eviction
+        - A1out: ghosts of keys evicted from A1in, at most kout_ratio of the capacity
+        - Am: LRU of resident keys that came back while in A1out
+    A key admitted before any access (prefetched by a loader) waits in A1in as prefetched, it only moves to Am
+    if its first access finds it was in A1out. Evicting it unused leaves no new ghost.
+    '''
+    def __init__(self, capacity, kin_ratio=0.25, kout_ratio=0.5):
+        self.kin = max(1, int(capacity * kin_ratio))
+        self.kout = max(1, int(capacity * kout_ratio))
+        self.A1in, self.A1out, self.Am = OrderedDict(), OrderedDict(), OrderedDict()
+        # {key: was in A1out}, resident in A1in and not used yet
+        self.prefetched = {}
+        # accessed while not resident, the next admit is a demand load
+        self.requested = set()
+
+    def access(self, key, rank=None):
+        if key in self.prefetched:
+            if self.prefetched.pop(key):
+                del self.A1in[key]
+                self.Am[key] = None
+        elif key in self.Am:
+            self.Am.move_to_end(key)
+        elif key not in self.A1in:
+            self.requested.add(key)
+
+    def admit(self, key):
+        if key in self.Am or key in self.A1in:
+            return
+        if key not in self.requested:
+            # prefetch: no use yet, coming back from A1out waits for the first access
+            self.prefetched[key] = key in self.A1out
+            self.A1out.pop(key, None)
+            self.A1in[key] = None
+            return
+        self.requested.discard(key)
+        if key in self.A1out:
+            del self.A1out[key]
+            self.Am[key] = None
+        else:
+            self.A1in[key] = None
+
+    def evict(self, key):
+        self.requested.discard(key)
+        if key in self.prefetched:
+            # never used: only a ghost if it was one before
+            was_ghost = self.prefetched.pop(key)
+            del self.A1in[key]
+            if was_ghost:
+                self.A1out[key] = None
+        elif key in self.A1in:
+            del self.A1in[key]
+            self.A1out[key] = None
+        else:
+            self.Am.pop(key, None)
+            return
+        if len(self.A1out) > self.kout:
+            self.A1out.popitem(last=False)
+
+    def victim(self):
+        if len(self.A1in) > 0 and (len(self.A1in) > self.kin or len(self.Am) == 0):
+            return next(iter(self.A1in))
+        return next(iter(self.Am), None)
+
+    def residents(self):
+        return list(self.A1in) + list(self.Am)
+
+    def head(self, k):
+        keys = itertools.chain(reversed(self.Am), reversed(self.A1in), reversed(self.A1out))
+        return list(itertools.islice(keys, k))
+
+    def tail(self, k):
+        keys = itertools.chain(self.A1out, self.A1in, self.Am)
+        return list(itertools.islice(keys, k))[::-1]
+
+    def ranks(self):
+        ranks = {key: 0 for key in self.A1out}
+        ranks.update({key: 1 for key in self.A1in})
+        ranks.update({key: 2 for key in self.Am})
+        return ranks
+
+
+class CountMinSketch:
+    '''
+    Frequency sketch for TinyLFU: depth x width saturating counters, halved every sample_size increments (aging)
+    '''
+    def __init__(self, capacity, depth=4, max_count=15):
+        width = 1
+        while width < 10 * max(1, capacity):
+            width *= 2
+        self.width = width
+        self.depth = depth
+        self.max_count = max_count
+        self.table = np.zeros((depth, width), dtype=np.uint8)
+        self.sample_size = 10 * max(1, capacity)
+        self.num_increments = 0
+
+    def cells(self, key):
+        return [hash((row, key)) % self.width for row in range(self.depth)]
+
+    def increment(self, key):
+        for row, col in enumerate(self.cells(key)):
+            if self.table[row, col] < self.max_count:
+                self.table[row, col] += 1
+        self.num_increments += 1
+        if self.num_increments >= self.sample_size:
+            self.table >>= 1
+            self.num_increments //= 2
+
+    def estimate(self, key):
+        return min(int(self.table[row, col]) for row, col in enumerate(self.cells(key)))
+
+
+class WTinyLFUPolicy:
+    '''
+    W-TinyLFU (Einziger et al., Caffeine)
+        - window: small LRU (window_ratio of the capacity) that new indexes enter
+        - main: segmented LRU, probation + protected (protected_ratio of the main space)
+        - admission: a key leaving the window only replaces the main victim if the sketch says it is more frequent
+    victim() only picks, the window candidate moves into main when a main slot is freed (admit / evict)
+    '''
+    def __init__(self, capacity, window_ratio=0.01, protected_ratio=0.8):
+        capacity = max(2, capacity)
+        self.window_size = max(1, int(capacity * window_ratio))
+        self.main_size = capacity - self.window_size
+        self.protected_size = max(1, int(self.main_size * protected_ratio))
+        self.sketch = CountMinSketch(capacity)
+        self.window, self.probation, self.protected = OrderedDict(), OrderedDict(), OrderedDict()
+        # all keys by recency, head() ranks recent keys by frequency
+        self.recency = OrderedDict()
+
+    def access(self, key, rank=None):
+        self.sketch.increment(key)
+        self.recency[key] = None
+        self.recency.move_to_end(key)
+        if key in self.window:
+            self.window.move_to_end(key)
+        elif key in self.probation:
+            # promote, demote the protected LRU if the segment is full
+            del self.probation[key]
+            self.protected[key] = None
+            if len(self.protected) > self.protected_size:
+                demoted, _ = self.protected.popitem(last=False)
+                self.probation[demoted] = None
+        elif key in self.protected:
+            self.protected.move_to_end(key)
+
+    def admit(self, key):
+        if key in self.window or key in self.probation or key in self.protected:
+            return
+        self.window[key] = None
+        self.fill_main()
+
+    def evict(self, key):
+        for segment in (self.window, self.probation, self.protected):
+            if key in segment:
+                del segment[key]
+                break
+        # a main slot freed for the window candidate admits it
+        self.fill_main()
+
+    def fill_main(self):
+        # move window overflow into main while there is room
+        while len(self.window) > self.window_size and len(self.probation) + len(self.protected) < self.main_size:
+            candidate, _ = self.window.popitem(last=False)
+            self.probation[candidate] = None
+
+    def main_victim(self):
+        return next(iter(self.probation), None) or next(iter(self.protected), None)
+
+    def victim(self):
+        # no state change (callers may probe without evicting): the window overflow only enters main on evict
+        main_victim = self.main_victim()
+        if len(self.window) > self.window_size and main_victim is not None:
+            candidate = next(iter(self.window))
+            # the sketch decides: the candidate replaces the main victim only if it is more frequent
+            return main_victim if self.sketch.estimate(candidate) > self.sketch.estimate(main_victim) else candidate
+        return main_victim or next(iter(self.window), None)
+
+    def residents(self):
+        return list(self.window) + list(self.probation) + list(self.protected)
+
+    def head(self, k):
+        recent = list(itertools.islice(reversed(self.recency), 4 * k))
+        return sorted(recent, key=self.sketch.estimate, reverse=True)[:k]
+
+    def tail(self, k):
+        old = list(itertools.islice(iter(self.recency), 4 * k))
+        return sorted(old, key=self.sketch.estimate, reverse=True)[-k:]
+
+    def ranks(self):
+        return {key: self.sketch.estimate(key) for key in self.recency}
+
+
+class BeladyPolicy:
+    '''
+    Belady / OPT as an online policy: replay a recorded access trace, evict the resident key used farthest in the future.
+    The trace must come from the same workload (same seed and arguments). Inside the IndexStore the hit rate also
+    depends on the loaders (a shard still loading counts as a miss), so it is not a bound:
+    opt_hit_rate gives the upper bound of a cache of the same capacity.
+    '''
+    def __init__(self, trace):
+        self.trace = list(trace)
+        self.t = 0
+        # {key: deque of future positions in the trace}
+        self.future = {}
+        for pos, key in enumerate(self.trace):
+            self.future.setdefault(key, deque()).append(pos)
+        self.resident = OrderedDict()
+
+    def next_use(self, key):
+        positions = self.future.get(key)
+        while positions and positions[0] < self.t:
+            positions.popleft()
+        return positions[0] if positions else float('inf')
+
+    def access(self, key, rank=None):
+        # follow the replay: jump to the next trace position of key, the order can drift from the recorded one
+        pos = self.next_use(key)
+        if pos != float('inf'):
+            self.future[key].popleft()
+            self.t = pos + 1
+
+    def admit(self, key):
+        self.resident[key] = None
+
+    def evict(self, key):
+        self.resident.pop(key, None)
+
+    def victim(self):
+        # O(resident), this is an offline bound, not a production policy
+        return max(self.resident, key=self.next_use, default=None)
+
+    def residents(self):
+        return list(self.resident)
+
+    def head(self, k):
+        # the next k distinct keys of the trace: perfect prefetching
+        head = OrderedDict()
+        for key in itertools.islice(self.trace, self.t, None):
+            head[key] = None
+            if len(head) >= k:
+                break
+        return list(head)
+
+    def tail(self, k):
+        keys = sorted(self.future, key=self.next_use)
+        return keys[-k:]
+
+    def ranks(self):
+        # sooner next use ranks higher
+        return {key: -self.next_use(key) for key in self.future}
+
+
+def opt_hit_rate(trace, capacity):
+    '''
+    Offline OPT (Belady) over an access trace: demand loads only (no prefetching), a miss evicts the resident key used
+    farthest in the future. Upper bound on the hit rate of any demand-paged cache of this capacity.
+
+    return:
+        - hits / accesses
+    '''
+    trace = list(trace)
+    if len(trace) == 0 or capacity < 1:
+        return 0.
+    # next position of the same key for every access
+    next_pos = [0] * len(trace)
+    last = {}
+    for pos in range(len(trace) - 1, -1, -1):
+        next_pos[pos] = last.get(trace[pos], len(trace))
+        last[trace[pos]] = pos
+
+    hits = 0
+    # {key: next use}, and a max-heap of (-next use, key) with lazy deletion
+    resident = {}
+    heap = []
+    for pos, key in enumerate(trace):
+        if key in resident:
+            hits += 1
+        elif len(resident) >= capacity:
+            while True:
+                neg_use, victim = heapq.heappop(heap)
+                if resident.get(victim) == -neg_use:
+                    del resident[victim]
+                    break
+        resident[key] = next_pos[pos]
+        heapq.heappush(heap, (-next_pos[pos], key))
+    return hits / len(trace)
+
+
+def demand_hit_rate(policy, trace, capacity, decay_interval=None):
+    '''
+    Offline hit rate of a ranking policy over an access trace, same setting as opt_hit_rate (demand loads, no loaders),
+    so it is comparable with the OPT bound: opt_hit_rate(trace, capacity) >= demand_hit_rate(policy, trace, capacity)
+
+    return:
+        - hits / accesses
+    '''
+    trace = list(trace)
+    if len(trace) == 0 or capacity < 1:
+        return 0.
+    ranking = create_policy(policy, decay_interval=decay_interval, capacity=capacity, trace=trace)
+    resident = set()
+    hits = 0
+    for pos, key in enumerate(trace):
+        # rank: access time for LRU, frequency increment for LFU (one per access, the trace has no query counts)
+        ranking.access(key, pos if policy == 'LRU' else 1)
+        if key in resident:
+            hits += 1
+            continue
+        if len(resident) >= capacity:
+            victim = ranking.victim()
+            ranking.evict(victim)
+            resident.discard(victim)
+        ranking.admit(key)
+        resident.add(key)
+    return hits / len(trace)
+
+
+def create_policy(policy, decay_interval=None, capacity=1000, trace=None):
+    if policy == 'LRU':
+        return LRUPolicy()
+    elif policy == 'LFU':
+        return LFUPolicy(decay_interval=decay_interval)
+    elif policy == 'ARC':
+        return ARCPolicy(capacity)
+    elif policy == '2Q':
+        return TwoQPolicy(capacity)
+    elif policy == 'WTINYLFU':
+        return WTinyLFUPolicy(capacity)
+    elif policy == 'BELADY':
+        if trace is None:
+            raise ValueError("BELADY needs a recorded access trace")
+        return BeladyPolicy(trace)
+    raise ValueError("Invalid ranking policy: {}".format(policy))
@@ -0,0 +1,157 @@
+'''
+Result accumulator
+    - Keep the candidates of every query while shard results stream in
+    - Preallocated float32 distances and a single packed int64 (shard, id) label array
+    - Shard results are scattered into a per-query candidate buffer (no sort per shard),
+      rows are only compacted (argpartition) to their top k when the buffer is full or at the end
+'''
+
+import threading
+import contextlib
+
+import numpy as np
+
+# labels are packed as (shard << ID_BITS) | id, ids inside a shard are < 2**32
+ID_BITS = 32
+ID_MASK = (1 << ID_BITS) - 1
+
+
+def pack_labels(file_idx, I):
+    '''
+    Pack shard index and in-shard ids into one int64 label array. Missing results (I == -1) stay -1.
+    file_idx is one shard (scalar) or the shard of every result (same shape as I).
+    '''
+    I = np.asarray(I, dtype=np.int64)
+    labels = (np.asarray(file_idx, dtype=np.int64) << ID_BITS) | (I & ID_MASK)
+    return np.where(I < 0, -1, labels)
+
+def unpack_labels(labels):
+    '''
+    Inverse of pack_labels, return (I, file_idx). Empty slots are -1 in both.
+    '''
+    empty = labels < 0
+    I = np.where(empty, -1, labels & ID_MASK)
+    file_idx = np.where(empty, -1, labels >> ID_BITS)
+    return I, file_idx
+
+
+class ResultAccumulator:
+    '''
+    Running top k results for a batch of queries, shared by all search topologies
+    '''
+    def __init__(self, num_queries, k, buffer_shards=10, thread_safe=False):
+        '''
+        args:
+            - num_queries: number of queries in the batch
+            - k: top k results (global)
+            - buffer_shards: number of k-wide shard results buffered per query before compacting
+            - thread_safe: serialize add/topk, needed when several search workers merge into one accumulator
+        '''
+        self.k = k
+        self.lock = threading.Lock() if thread_safe else contextlib.nullcontext()
+        self.width = k * (1 + buffer_shards)
+        self.D = np.full((num_queries, self.width), np.inf, dtype=np.float32)
+        self.labels = np.full((num_queries, self.width), -1, dtype=np.int64)
+        # number of used candidate columns per query
+        self.fill = np.zeros(num_queries, dtype=np.int64)
+
+    def add(self, q_idxs, D, I, file_idx):
+        '''
+        Add one shard result to the candidates of its queries
+
+        args:
+            - q_idxs: query indexes searched on the shard, unique, (m,)
+            - D, I: faiss search results for those queries, (m, idx_k)
+            - file_idx: index of the shard in idx_paths, or (m, idx_k) shard of every result (merging partial top k)
+        '''
+        q_idxs = np.asarray(q_idxs)
+        num_cols = D.shape[1]
+        if q_idxs.size == 0 or num_cols == 0:
+            return
+        labels = pack_labels(file_idx, I)
+        with self.lock:
+            self._add(q_idxs, D, labels, num_cols)
+
+    def _add(self, q_idxs, D, labels, num_cols):
+        if num_cols > self.width - self.k:
+            self.grow(num_cols)
+
+        # make room in rows that would overflow
+        full = self.fill[q_idxs] + num_cols > self.width
+        if full.any():
+            self.compact(q_idxs[full])
+
+        cols = self.fill[q_idxs][:, None] + np.arange(num_cols)
+        rows = q_idxs[:, None]
+        self.D[rows, cols] = D
+        self.labels[rows, cols] = labels
+        self.fill[q_idxs] += num_cols
+
+    def grow(self, num_cols):
+        # widen the candidate buffer, only needed when idx_k > k * buffer_shards
+        pad = self.k + num_cols - self.width
+        self.D = np.pad(self.D, ((0, 0), (0, pad)), constant_values=np.inf)
+        self.labels = np.pad(self.labels, ((0, 0), (0, pad)), constant_values=-1)
+        self.width += pad
+
+    def compact(self, q_idxs):
+        '''
+        Keep only the k best candidates (unsorted) in the first k columns of the given rows
+        '''
+        q_idxs = np.asarray(q_idxs)
+        if q_idxs.size == 0:
+            return
+        k = self.k
+        cand_D = self.D[q_idxs]
+        part_idx = np.argpartition(cand_D, k - 1, axis=1)[:, :k]
+        self.D[q_idxs, :k] = np.take_along_axis(cand_D, part_idx, axis=1)
+        self.labels[q_idxs, :k] = np.take_along_axis(self.labels[q_idxs], part_idx, axis=1)
+        self.D[q_idxs, k:] = np.inf
+        self.labels[q_idxs, k:] = -1
+        self.fill[q_idxs] = k
+
+    def kth_distance(self, q_idxs):
+        '''
+        Running k-th smallest distance of the given rows (inf while a row has fewer than k candidates),
+        an upper bound of its final k-th distance
+        '''
+        q_idxs = np.asarray(q_idxs)
+        with self.lock:
+            cand_D = self.D[q_idxs]
+        return np.partition(cand_D, self.k - 1, axis=1)[:, self.k - 1]
+
+    def topk(self, q_idxs=None):
+        '''
+        Sorted top k of the given rows (all rows if None)
+
+        return:
+            - D: (num, k) float32 distances
+            - I: (num, k) in-shard ids
+            - file_idx: (num, k) shard indexes
+        '''
+        if q_idxs is None:
+            q_idxs = np.arange(self.D.shape[0])
+        q_idxs = np.asarray(q_idxs)
+        with self.lock:
+            self.compact(q_idxs[self.fill[q_idxs] > self.k])
+            D = self.D[q_idxs, :self.k]
+            labels = self.labels[q_idxs, :self.k]
+
+        sort_idx = np.argsort(D, axis=1)
+        D = np.take_along_axis(D, sort_idx, axis=1)
+        labels = np.take_along_axis(labels, sort_idx, axis=1)
+        I, file_idx = unpack_labels(labels)
+        return D, I, file_idx
+
+    def result(self, out=None):
+        '''
+        Final (D, I, file_idx) matrices of shape (num_queries, k)
+
+        args:
+            - out: (D, I, file_idx) arrays to write the result into (e.g. a SharedArena slab), returned as is
+        '''
+        if out is None:
+            return self.topk()
+        for dst, src in zip(out, self.topk()):
+            dst[...] = src
+        return out
@@ -3,14 +3,21 @@ This module contains functions to search a batch of queries or index shards by a
 
 Search topology 1: {query_idx1: [idx1, idx2...]} # naive search, can serve as a ground truth and baseline
 Search topology 2: {idx1: [query_idx1, query_idx2...]} # intellegent batching
+Search topology 3: topology 1 in micro-batches, each micro-batch searched index-major # query order with batched faiss calls
+Search topology 4: topology 2 in rounds of probe rank, shards that cannot improve the running top k are skipped # early termination
 '''
 
 # import asyncio
-import time
+import threading
+import contextlib
+from concurrent.futures import ThreadPoolExecutor
 
+import faiss
 import numpy as np
 
 from utils.vdb_utils import query_index_file
+from utils.search_plan import SearchPlan
+from utils.result_accumulator import ResultAccumulator
 # from utils.index_store import AsyncDataLoader, ThreadDataLoader, ProcessDataLoader
 
 # fix random seed
@@ -34,47 +41,98 @@ def search_outterloop_query(stopology, queries, idx_k, k, idx_paths, index_store
     Search a batch of queries: looping over queries 
 
     args:
-        - search topology: {qidx1: [idx1,...]}
+        - search topology: {qidx1: [idx1,...]}, query-major SearchPlan
         - query: (num, dim)
         - idx_k: k for each index search
         - k: top k results (global)
         - idx_paths: list of index paths
     '''
-    # result_matrix: init ndarray with shape (num_queries, k)
-    final_D_matrix = np.zeros((queries.shape[0], k))
-    final_I_matrix = np.zeros((queries.shape[0], k))
-    final_file_idx_matrix = np.zeros((queries.shape[0], k))
+    results = ResultAccumulator(queries.shape[0], k)
 
     # loop over queries
     for q_idx, idxs in stopology.items():
         # select query make shape (1, dim)
         query = queries[q_idx].reshape(1, -1)
-        D_concat = np.array([])
-        I_concat = np.array([])
-        file_idx_concat = np.array([])
 
-        # loop over idxs for each query
-        for j, file_idx in enumerate(idxs):
+        # loop over idxs for each query, merge each shard result into the running top k
+        for file_idx in idxs.tolist():
             D, I = query_index_file(idx_paths[file_idx], query, idx_k, index_store)
-            # make file_idx_matrix
-            file_idx_m = np.ones_like(D) * file_idx
-            D_concat = np.concatenate((D_concat, D), axis=1) if D_concat.size else D
-            I_concat = np.concatenate((I_concat, I), axis=1) if I_concat.size else I
-            file_idx_concat = np.concatenate((file_idx_concat, file_idx_m), axis=1) if file_idx_concat.size else file_idx_m
-
-        # Sort Overwrite D_concat, I_concat, and file_idx_concat. 
-        sort_idx = np.argsort(D_concat, axis=1)
-        D_concat = np.take_along_axis(D_concat, sort_idx, axis=1)
-        I_concat = np.take_along_axis(I_concat, sort_idx, axis=1)
-        file_idx_concat = np.take_along_axis(file_idx_concat, sort_idx, axis=1)
-        
-        # update final matrix with top k
-        final_D_matrix[q_idx] = D_concat[:, :k]
-        final_I_matrix[q_idx] = I_concat[:, :k]
-        final_file_idx_matrix[q_idx] = file_idx_concat[:, :k]
-    return final_D_matrix, final_I_matrix.astype(int), final_file_idx_matrix.astype(int)
+            results.add([q_idx], D, I, file_idx)
+    return results.result()
     
 
+def micro_batch_plans(stopology, micro_batch):
+    '''
+    Split a query-major plan into micro-batches of consecutive queries, each one as an index-major SearchPlan
+
+    args:
+        - search topology: query-major SearchPlan
+        - micro_batch: number of queries per micro-batch
+    return:
+        - [SearchPlan, ...], shards ascending within a micro-batch
+    '''
+    plans = []
+    for start in range(0, len(stopology), micro_batch):
+        end = min(start + micro_batch, len(stopology))
+        lo, hi = stopology.offsets[start], stopology.offsets[end]
+        q_idxs = np.repeat(stopology.ids[start:end], stopology.sizes[start:end])
+        slots = None if stopology.slots is None else stopology.slots[lo:hi]
+        plans.append(SearchPlan.from_pairs(stopology.indices[lo:hi], q_idxs, slots=slots))
+    return plans
+
+def outstanding_shards(stopology, num_queries):
+    '''
+    Number of shards to search for every query of an index-major topology
+    '''
+    if isinstance(stopology, SearchPlan):
+        q_all = stopology.indices
+    else:
+        q_all = np.concatenate([np.asarray(q_idxs, dtype=np.int64) for q_idxs in stopology.values()] + [np.zeros(0, dtype=np.int64)])
+    return np.bincount(q_all, minlength=num_queries).astype(np.int32)
+
+def complete_queries(outstanding, q_idxs, results, on_result, lock=None):
+    '''
+    One more shard is done for q_idxs, emit the final top k of the queries that have no shard left
+
+    args:
+        - outstanding: (num_queries,) shards left per query, updated in place
+        - on_result: callback(q_idxs, D, I, file_idx) or None
+        - lock: guards outstanding when several workers complete shards
+    '''
+    q_idxs = np.asarray(q_idxs)
+    with lock if lock is not None else contextlib.nullcontext():
+        outstanding[q_idxs] -= 1
+        done = q_idxs[outstanding[q_idxs] == 0]
+    # done rows get no more shard results, reading them outside the lock is safe
+    if on_result is not None and len(done) > 0:
+        on_result(done, *results.topk(done))
+
+def search_outterloop_query_batched(stopology, queries, idx_k, k, idx_paths, index_store, micro_batch=256, on_result=None):
+    '''
+    Search a batch of queries in query order, micro_batch queries at a time: 
+    one faiss call per shard per micro-batch instead of one per (query, shard).
+    A query is emitted (on_result) as soon as all of its shards are searched.
+
+    args:
+        - search topology: {qidx1: [idx1,...]}, query-major SearchPlan
+        - queries: (num, dim)
+        - idx_k: k for each index search
+        - k: top k results (global)
+        - idx_paths: list of index paths
+        - micro_batch: number of queries per micro-batch
+        - on_result: callback(q_idxs, D, I, file_idx) with the final results of completed queries
+    '''
+    results = ResultAccumulator(queries.shape[0], k)
+    outstanding = np.zeros(queries.shape[0], dtype=np.int32)
+    outstanding[stopology.ids] = stopology.sizes
+
+    for plan in micro_batch_plans(stopology, micro_batch):
+        for file_idx, q_idxs in plan.items():
+            D, I = query_index_file(idx_paths[file_idx], queries[q_idxs], idx_k, index_store)
+            results.add(q_idxs, D, I, file_idx)
+            complete_queries(outstanding, q_idxs, results, on_result)
+    return results.result()
+
 def batch_queries_by_stopology(stopology, queries):
     '''
     This function take in a outterloop index topology and a global query batch. 
@@ -99,16 +157,13 @@ def search_outterloop_index(stopology, queries, idx_k, k, idx_paths, index_store
     Search a batch of index: looping over index shards
 
     args:
-        - search topology: {index1: [q1,q2...]}
+        - search topology: {index1: [q1,q2...]}, index-major SearchPlan
         - queries: (num, dim)
         - idx_k: k for each index search
         - k: top k results (global)
         - idx_paths: list of index paths
     '''
-    # result_matrix: init ndarray with shape (num_queries, k)
-    final_D_matrix = np.ones((queries.shape[0], k)) * np.inf
-    final_I_matrix = np.zeros((queries.shape[0], k))
-    final_file_idx_matrix = np.zeros((queries.shape[0], k))
+    results = ResultAccumulator(queries.shape[0], k)
 
     # batch queries by stopology: {idx1, [q1_data, q2_data...]}
     # stopology_queries_dict = batch_queries_by_stopology(stopology, queries)
@@ -121,79 +176,198 @@ def search_outterloop_index(stopology, queries, idx_k, k, idx_paths, index_store
 
         # query_batch_order = q_idxs
         D, I = query_index_file(idx_paths[file_idx], query_batch, idx_k, index_store)
-        index_store.remove_index(idx_paths[file_idx])
-        file_idx_m = np.ones_like(D) * file_idx
-        
-        # merge and compare results in final matrix (D), then save top k
-        prev_D = final_D_matrix[q_idxs]
-        prev_I = final_I_matrix[q_idxs]
-        prev_file_idx = final_file_idx_matrix[q_idxs]
-        # merge and sort
-        D_concat = np.concatenate((prev_D, D), axis=1)
-        I_concat = np.concatenate((prev_I, I), axis=1)
-        file_idx_concat = np.concatenate((prev_file_idx, file_idx_m), axis=1)
-        # sort
-        sort_idx = np.argsort(D_concat, axis=1)
-        D_concat = np.take_along_axis(D_concat, sort_idx, axis=1)
-        I_concat = np.take_along_axis(I_concat, sort_idx, axis=1)
-        file_idx_concat = np.take_along_axis(file_idx_concat, sort_idx, axis=1)
-        # update final matrix with top k
-        final_D_matrix[q_idxs] = D_concat[:, :k]
-        final_I_matrix[q_idxs] = I_concat[:, :k]
-        final_file_idx_matrix[q_idxs] = file_idx_concat[:, :k]
-    return final_D_matrix, final_I_matrix.astype(int), final_file_idx_matrix.astype(int)
-
-
-def search_outterloop_index_async(stopology, queries, idx_k, k, idx_paths, index_store):
+        index_store.release_index(idx_paths[file_idx])
+
+        # merge into the running top k
+        results.add(q_idxs, D, I, file_idx)
+    return results.result()
+
+
+def search_outterloop_index_async(stopology, queries, idx_k, k, idx_paths, index_store, num_workers=1, omp_threads=None, on_result=None, out=None):
     # print("search task is starting")
     '''
     Search a batch of index: looping over index shards (async). Overlapping IO and computation.
 
     args:
-        - search topology: {index1: [q1,q2...]}
+        - search topology: {index1: [q1,q2...]}, index-major SearchPlan
         - queries: (num, dim)
         - idx_k: k for each index search
         - k: top k results (global)
         - idx_paths: list of index paths
+        - num_workers: number of shards searched concurrently (faiss releases the GIL)
+        - omp_threads: total faiss OMP thread budget, split across the workers
+        - on_result: callback(q_idxs, D, I, file_idx), called with the final top k of every query as soon as its last shard is searched
+        - out: (D, I, file_idx) arrays of shape (num, k) to write the final result into (shared memory), None to allocate
     '''
-    # result_matrix: init ndarray with shape (num_queries, k)
-    final_D_matrix = np.ones((queries.shape[0], k)) * np.inf
-    final_I_matrix = np.zeros((queries.shape[0], k))
-    final_file_idx_matrix = np.zeros((queries.shape[0], k))
+    if num_workers > 1:
+        return search_outterloop_index_parallel(stopology, queries, idx_k, k, idx_paths, index_store, num_workers, omp_threads, 
+                                                on_result=on_result, out=out)
+
+    results = ResultAccumulator(queries.shape[0], k)
+    outstanding = outstanding_shards(stopology, queries.shape[0]) if on_result is not None else None
 
     # batch queries by stopology: {idx1, [q1_data, q2_data...]}
     # stopology_queries_dict = batch_queries_by_stopology(stopology, queries)
 
     # loop over index shards
     for file_idx, q_idxs in stopology.items():
-        # loop over q_idxs for each index
-        # query_batch = stopology_queries_dict[file_idx]
-        query_batch = queries[q_idxs]
-        
-        # if index is loading wait
-        while idx_paths[file_idx] in index_store.indexes and index_store.indexes[idx_paths[file_idx]]=="loading":
-            time.sleep(0.000001)
+        search_shard(file_idx, q_idxs, queries, idx_k, idx_paths, index_store, results)
+        if outstanding is not None:
+            complete_queries(outstanding, q_idxs, results, on_result)
+    return results.result(out=out)
 
-        D, I = query_index_file(idx_paths[file_idx], query_batch, idx_k, index_store)
-        index_store.remove_index(idx_paths[file_idx])
-        # time.sleep(0.01)
-        file_idx_m = np.ones_like(D) * file_idx
-        
-        # merge and compare results in final matrix (D), then save top k
-        prev_D = final_D_matrix[q_idxs]
-        prev_I = final_I_matrix[q_idxs]
-        prev_file_idx = final_file_idx_matrix[q_idxs]
-        # merge and sort
-        D_concat = np.concatenate((prev_D, D), axis=1)
-        I_concat = np.concatenate((prev_I, I), axis=1)
-        file_idx_concat = np.concatenate((prev_file_idx, file_idx_m), axis=1)
-        # sort
-        sort_idx = np.argsort(D_concat, axis=1)
-        D_concat = np.take_along_axis(D_concat, sort_idx, axis=1)
-        I_concat = np.take_along_axis(I_concat, sort_idx, axis=1)
-        file_idx_concat = np.take_along_axis(file_idx_concat, sort_idx, axis=1)
-        # update final matrix with top k
-        final_D_matrix[q_idxs] = D_concat[:, :k]
-        final_I_matrix[q_idxs] = I_concat[:, :k]
-        final_file_idx_matrix[q_idxs] = file_idx_concat[:, :k]
-    return final_D_matrix, final_I_matrix.astype(int), final_file_idx_matrix.astype(int)
+
+def search_shard(file_idx, q_idxs, queries, idx_k, idx_paths, index_store, results):
+    '''
+    Search one shard for its queries, release the shard and merge the result into the accumulator
+    '''
+    query_batch = queries[q_idxs]
+
+    # blocks while the index is loading
+    D, I = query_index_file(idx_paths[file_idx], query_batch, idx_k, index_store)
+    # time.sleep(0.01)
+
+    # searched, the loader must not bring it back for this batch (unless the next batch needs it, see IndexStore.protect)
+    index_store.release_index(idx_paths[file_idx])
+
+    # merge into the running top k
+    results.add(q_idxs, D, I, file_idx)
+
+
+def search_outterloop_index_parallel(stopology, queries, idx_k, k, idx_paths, index_store, num_workers, omp_threads=None, on_result=None, out=None):
+    '''
+    Same as search_outterloop_index_async, but num_workers threads search shards concurrently.
+    Shards are submitted in topology order, so workers follow the loader. 
+
+    args:
+        - num_workers: size of the search thread pool
+        - omp_threads: total faiss OMP thread budget, each worker gets omp_threads // num_workers (at least 1)
+    '''
+    if omp_threads is None:
+        omp_threads = faiss.omp_get_max_threads()
+    worker_omp_threads = max(1, omp_threads // num_workers)
+
+    results = ResultAccumulator(queries.shape[0], k, thread_safe=True)
+    outstanding = outstanding_shards(stopology, queries.shape[0]) if on_result is not None else None
+    outstanding_lock = threading.Lock()
+
+    def search_and_complete(file_idx, q_idxs):
+        search_shard(file_idx, q_idxs, queries, idx_k, idx_paths, index_store, results)
+        if outstanding is not None:
+            complete_queries(outstanding, q_idxs, results, on_result, lock=outstanding_lock)
+
+    # omp_set_num_threads is per calling thread, set it once in each worker
+    with ThreadPoolExecutor(max_workers=num_workers, initializer=faiss.omp_set_num_threads, initargs=(worker_omp_threads,)) as executor:
+        futures = [executor.submit(search_and_complete, file_idx, q_idxs) for file_idx, q_idxs in stopology.items()]
+        for future in futures:
+            # re-raise worker exceptions
+            future.result()
+    return results.result(out=out)
+
+
+def bounded_rounds(stopology):
+    '''
+    Split an index-major plan into one plan per probe rank: round s holds the s-th nearest shard of every query,
+    shards of a round keep their order in stopology.
+
+    return:
+        - [(slot, SearchPlan), ...] ascending slot
+    '''
+    if stopology.slots is None:
+        raise ValueError("bounded search needs the probe rank of every plan entry (Dispatcher.search_plan)")
+    # plan position of every shard, keeps the loader order within a round
+    plan_rank = np.repeat(np.arange(len(stopology.ids)), stopology.sizes)
+    rounds = []
+    for slot in np.unique(stopology.slots).tolist():
+        mask = stopology.slots == slot
+        order = np.argsort(plan_rank[mask], kind="stable")
+        plan = SearchPlan.from_pairs(plan_rank[mask][order], stopology.indices[mask][order])
+        # from_pairs groups by plan rank (ascending), map the ranks back to shard ids
+        plan.ids = stopology.ids[plan.ids]
+        rounds.append((slot, plan))
+    return rounds
+
+def rounds_fit(rounds, idx_paths, index_store):
+    # every round's shards can be resident together (max_indexes and the memory budget, estimated sizes)
+    for _, plan in rounds:
+        if len(plan) > index_store.max_indexes:
+            return False
+        if index_store.mem_budget_bytes is not None and \
+                sum(index_store.estimate_index_bytes(idx_paths[file_idx]) for file_idx in plan.keys()) > index_store.mem_budget_bytes:
+            return False
+    return True
+
+def search_outterloop_index_bounded(stopology, queries, idx_k, k, idx_paths, index_store, lower_bounds, stats=None, out=None):
+    '''
+    Search a batch of index with early termination: the shards of every query are visited nearest centroid first
+    (one round per probe rank) and a (shard, query) pair is skipped when the shard's lower bound cannot beat the
+    query's running k-th distance. Every shard vector is at least lower_bound away, so the result equals
+    search_outterloop_index over the same plan (up to distance ties).
+
+    Sets the search plan of the index store and, if the store has a loader, feeds it one round at a time
+    (only shards with a query left to search). When the store can not hold the shards of a round, rounds would reload
+    shards over and over: the shards are searched once each in stopology order instead (fewer pairs skipped).
+
+    args:
+        - search topology: {index1: [q1,q2...]}, index-major SearchPlan with slots (Dispatcher.search_plan)
+        - queries: (num, dim)
+        - idx_k: k for each index search
+        - k: top k results (global)
+        - idx_paths: list of index paths
+        - lower_bounds: (num, nprobe) squared L2 lower bound of every probed shard, Dispatcher.lower_bounds
+        - stats: dict, "searched" / "skipped" (query, shard) pairs and "shards_skipped" (never searched) are added to it,
+          "index_major" is set if the search fell back to stopology order
+        - out: (D, I, file_idx) arrays of shape (num, k) to write the final result into, None to allocate
+    '''
+    results = ResultAccumulator(queries.shape[0], k)
+    rounds = bounded_rounds(stopology)
+    index_major = not rounds_fit(rounds, idx_paths, index_store)
+    if index_major:
+        # one "round" per shard, probe rank per entry
+        rounds = [(stopology.slots[stopology.offsets[i]:stopology.offsets[i+1]],
+                   SearchPlan([file_idx], [0, len(q_idxs)], q_idxs)) for i, (file_idx, q_idxs) in enumerate(stopology.items())]
+    index_store.set_search_plan([idx_paths[file_idx] for _, plan in rounds for file_idx in plan.keys()])
+    index_loader = index_store.index_loader
+    if index_major and index_loader is not None:
+        index_loader.update_files_to_load([idx_paths[file_idx] for file_idx in stopology.keys()])
+
+    # last round that needs each shard, it is released (no reload for this batch) after that
+    last_round = {}
+    for round_idx, (_, plan) in enumerate(rounds):
+        for file_idx in plan.keys():
+            last_round[file_idx] = round_idx
+
+    def searchable(file_idx, q_idxs, slot):
+        # the running k-th distance only decreases, pairs skipped here stay skippable
+        keep = lower_bounds[q_idxs, slot] <= results.kth_distance(q_idxs)
+        return q_idxs[keep], int((~keep).sum())
+
+    searched = skipped = 0
+    searched_shards = set()
+    for round_idx, (slot, plan) in enumerate(rounds):
+        if not index_major and index_loader is not None:
+            # load this round only, shards whose queries are all skipped already are left out
+            index_loader.update_files_to_load([idx_paths[file_idx] for file_idx, q_idxs in plan.items()
+                                               if len(searchable(file_idx, q_idxs, slot)[0]) > 0])
+        for file_idx, q_idxs in plan.items():
+            q_idxs, num_skipped = searchable(file_idx, q_idxs, slot)
+            skipped += num_skipped
+            if len(q_idxs) > 0:
+                D, I = query_index_file(idx_paths[file_idx], queries[q_idxs], idx_k, index_store)
+                results.add(q_idxs, D, I, file_idx)
+                searched += len(q_idxs)
+                searched_shards.add(file_idx)
+            else:
+                # not needed now, the topology eviction must see its next use
+                index_store.advance_plan(idx_paths[file_idx])
+                if index_loader is not None:
+                    index_loader.cancel([idx_paths[file_idx]])
+            if last_round[file_idx] == round_idx:
+                index_store.release_index(idx_paths[file_idx])
+
+    if stats is not None:
+        stats["searched"] = stats.get("searched", 0) + searched
+        stats["skipped"] = stats.get("skipped", 0) + skipped
+        stats["shards_skipped"] = stats.get("shards_skipped", 0) + len(last_round) - len(searched_shards)
+        stats["index_major"] = index_major
+    return results.result(out=out)
@@ -0,0 +1,179 @@
+'''
+Search plan: the search topology in CSR form
+    - index-major: shard -> queries that probe it (search_outterloop_index, search_outterloop_index_async)
+    - query-major: query -> shards it probes (search_outterloop_query)
+
+Replaces the {idx: [q1, q2, ...]} dict of Python lists, keeps its dict-like API (keys, items, [], len, in).
+'''
+
+import numpy as np
+
+
+class SearchPlan:
+    '''
+    ids[i] maps to indices[offsets[i]:offsets[i+1]], in plan order.
+    slots[j] is the probe rank of indices[j] for its query (0: nearest centroid).
+    '''
+    def __init__(self, ids, offsets, indices, slots=None, major="index"):
+        '''
+        args:
+            - ids: (num_ids,) shard ids (index-major) or query ids (query-major)
+            - offsets: (num_ids + 1,) start of every id in indices
+            - indices: (num_entries,) query ids (index-major) or shard ids (query-major)
+            - slots: (num_entries,) probe rank of every entry, None if unknown
+            - major: "index" or "query"
+        '''
+        self.ids = np.asarray(ids, dtype=np.int32)
+        self.offsets = np.asarray(offsets, dtype=np.int64)
+        self.indices = np.asarray(indices, dtype=np.int32)
+        self.slots = None if slots is None else np.asarray(slots, dtype=np.int16)
+        self.major = major
+        self.positions = None
+
+    @classmethod
+    def from_pairs(cls, ids, values, slots=None, sort_by_size=False, major="index", id_costs=None):
+        '''
+        Group (ids[j], values[j]) pairs by id. Negative ids are skipped (no probe).
+        Values keep their input order within an id, ids are ascending or by group size (largest first, ties by id).
+        With id_costs (cost of every id, e.g. shard bytes), sort_by_size orders by group size per cost instead.
+        '''
+        ids = np.asarray(ids).ravel()
+        values = np.asarray(values).ravel()
+        valid = ids >= 0
+        if not valid.all():
+            ids, values = ids[valid], values[valid]
+            slots = None if slots is None else np.asarray(slots).ravel()[valid]
+
+        counts = np.bincount(ids)
+        group_ids = np.flatnonzero(counts)
+        counts = counts[group_ids]
+        if sort_by_size:
+            keys = counts if id_costs is None else counts / np.maximum(np.asarray(id_costs)[group_ids], 1)
+            group_order = np.argsort(-keys, kind="stable")
+            group_ids, counts = group_ids[group_order], counts[group_order]
+
+        # position of every group in the plan; int16 keys let numpy use a radix sort
+        rank_dtype = np.int16 if len(group_ids) <= np.iinfo(np.int16).max else np.int32
+        group_rank = np.zeros(len(ids) and int(ids.max()) + 1, dtype=rank_dtype)
+        group_rank[group_ids] = np.arange(len(group_ids))
+        order = np.argsort(group_rank[ids], kind="stable")
+
+        offsets = np.zeros(len(counts) + 1, dtype=np.int64)
+        np.cumsum(counts, out=offsets[1:])
+        slots = None if slots is None else np.asarray(slots).ravel()[order]
+        return cls(group_ids, offsets, values[order], slots=slots, major=major)
+
+    @property
+    def sizes(self):
+        # batch size of every id (number of queries per shard, index-major)
+        return np.diff(self.offsets)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __iter__(self):
+        return iter(self.ids.tolist())
+
+    def keys(self):
+        return self.ids.tolist()
+
+    def values(self):
+        for i in range(len(self.ids)):
+            yield self.indices[self.offsets[i]:self.offsets[i+1]]
+
+    def items(self):
+        # (id, indices view) in plan order, no copies
+        for i, id_ in enumerate(self.ids.tolist()):
+            yield id_, self.indices[self.offsets[i]:self.offsets[i+1]]
+
+    def position(self, id_):
+        # position of id_ in the plan, None if it is not in the plan
+        if self.positions is None:
+            self.positions = {id_: i for i, id_ in enumerate(self.ids.tolist())}
+        return self.positions.get(int(id_))
+
+    def __contains__(self, id_):
+        return self.position(id_) is not None
+
+    def __getitem__(self, id_):
+        i = self.position(id_)
+        if i is None:
+            raise KeyError(id_)
+        return self.indices[self.offsets[i]:self.offsets[i+1]]
+
+    def get_slots(self, id_):
+        i = self.position(id_)
+        return self.slots[self.offsets[i]:self.offsets[i+1]]
+
+    def reorder(self, order):
+        '''
+        New plan with the ids at positions order (a permutation, or a subset to drop the others)
+        '''
+        order = np.asarray(order, dtype=np.int64)
+        sizes = self.sizes[order]
+        offsets = np.zeros(len(order) + 1, dtype=np.int64)
+        np.cumsum(sizes, out=offsets[1:])
+        # gather the segments without a Python loop: entry j of segment i comes from self.offsets[order[i]] + j
+        gather = np.repeat(self.offsets[order] - offsets[:-1], sizes) + np.arange(offsets[-1])
+        slots = None if self.slots is None else self.slots[gather]
+        return SearchPlan(self.ids[order], offsets, self.indices[gather], slots=slots, major=self.major)
+
+    def sort_by_size(self):
+        # largest batch first
+        return self.reorder(np.argsort(-self.sizes, kind="stable"))
+
+    def order_by_completion(self, max_greedy=1024):
+        '''
+        Index-major only: reorder the shards so that queries complete early (lower time to result when streaming).
+        Greedy: next shard is the one with the largest sum of 1 / (shards left) over its queries,
+        a query with one shard left weighs the most, completed queries weigh nothing. Starts with the largest shard.
+        Cost: each pick is a vectorized argmax over every shard plus a rescoring of the shards sharing its queries,
+        O(S^2) overall. A heap with lazy updates is slower here (one push per rescored shard, in Python),
+        so the greedy is capped instead.
+            args:
+                - max_greedy: number of shards picked greedily (None: all), the rest follow by their last score
+        '''
+        num_queries = int(self.indices.max()) + 1 if len(self.indices) > 0 else 0
+        remaining = np.bincount(self.indices, minlength=num_queries).astype(np.float64)
+        # query -> shard positions in this plan
+        by_query = SearchPlan.from_pairs(self.indices, np.repeat(np.arange(len(self.ids)), self.sizes), major="query")
+        query_row = np.full(num_queries, -1, dtype=np.int64)
+        query_row[by_query.ids] = np.arange(len(by_query.ids))
+
+        with np.errstate(divide="ignore"):
+            weights = np.where(remaining > 0, 1. / remaining, 0.)
+        score = np.add.reduceat(weights[self.indices], self.offsets[:-1]) if len(self.ids) > 0 else np.zeros(0)
+        order = []
+        num_greedy = len(self.ids) if max_greedy is None else min(max_greedy, len(self.ids))
+        for _ in range(num_greedy):
+            pos = int(np.argmax(score))
+            order.append(pos)
+            q_idxs = self.indices[self.offsets[pos]:self.offsets[pos+1]]
+            r = remaining[q_idxs]
+            delta = np.where(r > 1, 1. / np.maximum(r - 1, 1), 0.) - 1. / r
+            remaining[q_idxs] -= 1
+
+            # update the score of every shard of these queries
+            rows = query_row[q_idxs]
+            sizes = by_query.sizes[rows]
+            starts = np.repeat(by_query.offsets[rows] - np.cumsum(sizes) + sizes, sizes)
+            entries = starts + np.arange(sizes.sum())
+            np.add.at(score, by_query.indices[entries], np.repeat(delta, sizes))
+            # picked shards stay at -inf
+            score[pos] = -np.inf
+        if num_greedy < len(self.ids):
+            # past the cap: remaining shards by descending score, ties keep the plan order (as argmax would)
+            rest = np.argsort(-score, kind="stable")[:len(self.ids) - num_greedy]
+            order.extend(rest.tolist())
+        return self.reorder(order)
+
+    def transpose(self):
+        # index-major <=> query-major, indices of every new id follow the current plan order
+        owners = np.repeat(self.ids, self.sizes)
+        return SearchPlan.from_pairs(self.indices, owners, slots=self.slots, major="query" if self.major == "index" else "index")
+
+    def query_major(self):
+        return self if self.major == "query" else self.transpose()
+
+    def index_major(self):
+        return self if self.major == "index" else self.transpose()
@@ -0,0 +1,179 @@
+'''
+Shard catalog: what is known about every shard before loading it, written by create_shard_idx.py
+
+    idx_root/catalog.json            shard id, path, vector count, byte size, radius and index type of every shard, dim
+    idx_root/catalog_centroids.npy   centroid of every shard (row = shard id)
+
+Shards updated in place (utils/shard_updater.py) get a new shard version and the catalog version is bumped,
+running readers compare versions to drop stale copies (see is_stale / changed_paths).
+
+Shard ids are fixed by the catalog (not by the directory listing). The IndexStore uses the byte sizes to plan capacity
+before a load, the Dispatcher orders the plan by work per loaded byte, the bounded search uses the radii.
+Without a catalog, ShardCatalog.open falls back to listing idx_root (vdb_utils.list_shard_indexes).
+'''
+
+import os
+import json
+
+import numpy as np
+
+from utils.vdb_utils import list_shard_indexes, load_shard_radii, read_index, index_kind
+
+CATALOG_FILE = "catalog.json"
+CENTROIDS_FILE = "catalog_centroids.npy"
+CATALOG_VERSION = 1
+
+
+class ShardCatalog:
+    '''
+    Shard metadata of one idx_root, shard id = position in shards
+    '''
+    def __init__(self, idx_root, shards, centroid_index=None, centroids=None, radii=None, dim=None, version=CATALOG_VERSION):
+        '''
+        args:
+            - idx_root: dir to index files, paths in the catalog are relative to it
+            - shards: [{"id", "path", "num_vectors", "nbytes", "index_type"}, ...] ordered by shard id, unknown fields are None
+              (updated shards also have "version" and "next_id")
+            - centroid_index: file name of the centroid router index
+            - centroids: (num_shards, dim) shard centroids, None if unknown
+            - radii: (num_shards,) max L2 distance of a shard vector to its centroid, None if unknown
+            - version: bumped on every change of the shard set
+        '''
+        self.idx_root = idx_root
+        self.shards = shards
+        self.centroid_index = centroid_index
+        self.centroids = centroids
+        self.radii = None if radii is None else np.asarray(radii, dtype=np.float32)
+        self.dim = dim
+        self.version = version
+        self.paths = [os.path.join(idx_root, shard["path"]) for shard in shards]
+        self.path_bytes = {path: shard["nbytes"] for path, shard in zip(self.paths, shards) if shard["nbytes"] is not None}
+        # mtime of the catalog file this catalog was read from (or written to), None if there is none
+        self.mtime = None
+
+    @classmethod
+    def open(cls, idx_root):
+        # the catalog if create_shard_idx.py wrote one, otherwise the directory listing (paths only, no probing)
+        catalog = cls.load(idx_root)
+        if catalog is None:
+            catalog = cls.scan(idx_root, probe=False)
+        return catalog
+
+    @classmethod
+    def load(cls, idx_root):
+        '''
+        return:
+            - ShardCatalog of idx_root, None if it has no catalog
+        '''
+        catalog_path = os.path.join(idx_root, CATALOG_FILE)
+        if not os.path.exists(catalog_path):
+            return None
+        with open(catalog_path, "r") as f:
+            data = json.load(f)
+        shards = data["shards"]
+        centroids = None
+        if data.get("centroids") is not None:
+            centroids = np.load(os.path.join(idx_root, data["centroids"]))
+        radii = [shard.pop("radius") for shard in shards]
+        radii = None if any(radius is None for radius in radii) else radii
+        catalog = cls(idx_root, shards, centroid_index=data["centroid_index"], centroids=centroids, radii=radii,
+                      dim=data["dim"], version=data["version"])
+        catalog.mtime = catalog.file_mtime()
+        return catalog
+
+    @classmethod
+    def scan(cls, idx_root, probe=True, centroids=None, radii=None):
+        '''
+        Catalog from the directory listing, shard ids in natural file order
+
+        args:
+            - probe: read every shard index (IVF lists mapped, not read) for its vector count, dim and type
+            - centroids, radii: known shard centroids and radii (radii default to idx_root/embeds_radii.npy)
+        '''
+        idx_paths, centriod_idx_paths = list_shard_indexes(idx_root)
+        shards = []
+        dim = None if centroids is None else centroids.shape[1]
+        for shard_id, idx_path in enumerate(idx_paths):
+            shard = {"id": shard_id, "path": os.path.relpath(idx_path, idx_root), "num_vectors": None,
+                     "nbytes": os.path.getsize(idx_path) if probe else None, "index_type": None}
+            if probe:
+                index = read_index(idx_path, mmap=True)
+                shard["num_vectors"] = int(index.ntotal)
+                shard["index_type"] = index_kind(index)
+                dim = int(index.d)
+            shards.append(shard)
+        if radii is None:
+            radii = load_shard_radii(idx_root)
+        centroid_index = os.path.basename(centriod_idx_paths) if centriod_idx_paths else None
+        return cls(idx_root, shards, centroid_index=centroid_index, centroids=centroids, radii=radii, dim=dim)
+
+    def save(self):
+        '''
+        Write catalog.json (and the centroids), atomically: readers see the old or the new catalog
+        '''
+        shards = []
+        for shard_id, shard in enumerate(self.shards):
+            shard = dict(shard)
+            shard["radius"] = None if self.radii is None else float(self.radii[shard_id])
+            shards.append(shard)
+        data = {
+            "version": self.version,
+            "dim": self.dim,
+            "centroid_index": self.centroid_index,
+            "centroids": None if self.centroids is None else CENTROIDS_FILE,
+            "shards": shards,
+        }
+        if self.centroids is not None:
+            # np.save appends .npy to names without it
+            tmp_path = os.path.join(self.idx_root, CENTROIDS_FILE + ".tmp.npy")
+            np.save(tmp_path, np.asarray(self.centroids, dtype=np.float32))
+            os.replace(tmp_path, os.path.join(self.idx_root, CENTROIDS_FILE))
+        tmp_path = os.path.join(self.idx_root, CATALOG_FILE + ".tmp")
+        with open(tmp_path, "w") as f:
+            json.dump(data, f, indent=4)
+        os.replace(tmp_path, os.path.join(self.idx_root, CATALOG_FILE))
+        self.mtime = self.file_mtime()
+
+    def file_mtime(self):
+        catalog_path = os.path.join(self.idx_root, CATALOG_FILE)
+        return os.stat(catalog_path).st_mtime_ns if os.path.exists(catalog_path) else None
+
+    def is_stale(self):
+        # the catalog file has been written (or created) since this catalog was read, one stat
+        return self.file_mtime() != self.mtime
+
+    def changed_paths(self, other):
+        '''
+        Shard paths whose version differs in other (a newer catalog of the same idx_root)
+        '''
+        return [path for path, shard, other_shard in zip(self.paths, self.shards, other.shards)
+                if shard.get("version", 0) != other_shard.get("version", 0)]
+
+    def update_shard(self, shard_id, **fields):
+        # set catalog fields of one shard (e.g. num_vectors, nbytes after an update)
+        self.shards[shard_id].update(fields)
+        if self.shards[shard_id]["nbytes"] is not None:
+            self.path_bytes[self.paths[shard_id]] = self.shards[shard_id]["nbytes"]
+
+    def __len__(self):
+        return len(self.shards)
+
+    @property
+    def centroid_index_path(self):
+        return "" if self.centroid_index is None else os.path.join(self.idx_root, self.centroid_index)
+
+    @property
+    def shard_bytes(self):
+        # (num_shards,) byte size of every shard, None if the catalog does not know them
+        if len(self.path_bytes) < len(self.paths):
+            return None
+        return np.array([shard["nbytes"] for shard in self.shards], dtype=np.int64)
+
+    def nbytes(self, index_path):
+        # byte size of a shard index, None if unknown
+        return self.path_bytes.get(index_path)
+
+    def total_bytes(self, index_paths=None):
+        # bytes of the given shards (all shards if None), unknown sizes count as 0
+        index_paths = self.paths if index_paths is None else index_paths
+        return sum(self.path_bytes.get(index_path, 0) for index_path in index_paths)
@@ -0,0 +1,123 @@
+'''
+Incremental shard updates: append vectors to / delete ids from the IVF shards of an idx_root without retraining
+
+    - append: vectors are assigned by the trained quantizer of the shard (IndexIVF.add_with_ids), new ids continue
+      after the largest id ever given in the shard (catalog "next_id"), ids are never reused
+    - delete: ids are removed from the inverted lists (IndexIVF.remove_ids)
+    - every update rewrites the shard file atomically (tmp + rename) and bumps the shard version
+    - commit moves the updated centroids in the router and writes the catalog with a new version
+
+Appending moves the centroid to the running mean and grows the radius so it still bounds every vector
+(Dispatcher.lower_bounds stays exact). Deleting keeps both: the old centroid and radius remain valid bounds.
+The npy files of npy_root are not updated, the shard index is the source of truth.
+Readers pick up committed updates without a restart: SearchEngine.refresh, or IndexStore.invalidate on the changed paths.
+Single writer: one ShardUpdater per idx_root.
+'''
+
+import os
+
+import faiss
+import numpy as np
+
+from utils.shard_catalog import ShardCatalog
+from utils.centroid_router import update_router_centroids
+from utils.vdb_utils import read_index, save_index
+
+
+class ShardUpdater:
+    '''
+    Writer of the shards of one idx_root (needs its catalog, see create_shard_idx.py)
+    '''
+    def __init__(self, idx_root):
+        self.catalog = ShardCatalog.load(idx_root)
+        if self.catalog is None:
+            raise ValueError(f"no shard catalog in {idx_root}, run create_shard_idx.py --catalog_only")
+        self.router = read_index(self.catalog.centroid_index_path)
+        # shards updated since the last commit
+        self.dirty = set()
+
+    def load_shard(self, shard_id):
+        index = read_index(self.catalog.paths[shard_id])
+        try:
+            faiss.extract_index_ivf(index)
+        except RuntimeError:
+            raise ValueError(f"shard {shard_id} is not an IVF index, it can not be updated in place")
+        return index
+
+    def write_shard(self, shard_id, index, **fields):
+        # atomic: readers load the old or the new file, never a partial one
+        index_path = self.catalog.paths[shard_id]
+        save_index(index, index_path + ".tmp")
+        os.replace(index_path + ".tmp", index_path)
+        shard = self.catalog.shards[shard_id]
+        self.catalog.update_shard(shard_id, num_vectors=int(index.ntotal), nbytes=os.path.getsize(index_path),
+                                  version=shard.get("version", 0) + 1, **fields)
+        self.dirty.add(shard_id)
+
+    def append(self, shard_id, vectors):
+        '''
+        args:
+            - shard_id: shard to append to
+            - vectors: (n, dim) vectors
+        return:
+            - (n,) ids of the new vectors in the shard
+        '''
+        vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+        index = self.load_shard(shard_id)
+        shard = self.catalog.shards[shard_id]
+        num_vectors = int(index.ntotal)
+        # shards built by create_shard_idx.py use ids 0..num_vectors-1
+        next_id = shard.get("next_id", num_vectors)
+        ids = np.arange(next_id, next_id + len(vectors), dtype=np.int64)
+        index.add_with_ids(vectors, ids)
+
+        if self.catalog.centroids is not None:
+            centroid = self.catalog.centroids[shard_id].astype(np.float64)
+            new_centroid = (centroid * num_vectors + vectors.sum(axis=0, dtype=np.float64)) / (num_vectors + len(vectors))
+            if self.catalog.radii is not None:
+                # old vectors are within radius + shift of the new centroid
+                shift = np.linalg.norm(new_centroid - centroid)
+                new_radius = np.sqrt(((vectors - new_centroid) ** 2).sum(axis=1).max())
+                self.catalog.radii[shard_id] = max(self.catalog.radii[shard_id] + shift, new_radius)
+            self.catalog.centroids[shard_id] = new_centroid
+
+        self.write_shard(shard_id, index, next_id=int(ids[-1]) + 1 if len(ids) > 0 else next_id)
+        return ids
+
+    def delete(self, shard_id, ids):
+        '''
+        args:
+            - shard_id: shard to delete from
+            - ids: ids of the shard to remove, unknown ids are ignored
+        return:
+            - number of vectors removed
+        '''
+        index = self.load_shard(shard_id)
+        shard = self.catalog.shards[shard_id]
+        # keep the next id, removed ids are never given again
+        next_id = shard.get("next_id", int(index.ntotal))
+        num_removed = int(index.remove_ids(faiss.IDSelectorArray(np.asarray(ids, dtype=np.int64))))
+        if num_removed > 0:
+            self.write_shard(shard_id, index, next_id=next_id)
+        return num_removed
+
+    def commit(self):
+        '''
+        Publish the updates: move the centroids of the updated shards in the router, then write the catalog with a new version.
+        Shard files are already in place, readers that see the new catalog reload the changed shards.
+
+        return:
+            - catalog version
+        '''
+        if len(self.dirty) == 0:
+            return self.catalog.version
+        shard_ids = sorted(self.dirty)
+        if self.catalog.centroids is not None:
+            update_router_centroids(self.router, shard_ids, self.catalog.centroids[shard_ids])
+            router_path = self.catalog.centroid_index_path
+            save_index(self.router, router_path + ".tmp")
+            os.replace(router_path + ".tmp", router_path)
+        self.catalog.version += 1
+        self.catalog.save()
+        self.dirty = set()
+        return self.catalog.version
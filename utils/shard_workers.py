@@ -0,0 +1,200 @@
+'''
+Shard-partitioned search across worker processes (one GIL, IndexStore and memory budget per worker)
+
+    - shard i is owned by worker i % num_workers, only its owner ever loads it
+    - the coordinator routes the batch, splits the index-major plan by owner and writes the queries into a SharedArena
+    - every worker searches its sub-plan (index_async topology, own loader pool) and writes its top k into its result slab
+    - the coordinator merges the partial top k of all workers
+Only the plan (CSR arrays) and the arena layout are pickled, queries and results stay in shared memory.
+'''
+
+import multiprocessing
+
+import faiss
+import numpy as np
+
+from utils.index_store import IndexStore, ThreadDataLoaderPool
+from utils.index_manager import IndexManager
+from utils.search_plan import SearchPlan
+from utils.shared_arena import SharedArena
+from utils.result_accumulator import ResultAccumulator
+from utils.search_by_topology import search_outterloop_index_async
+
+
+def worker_main(conn, worker_id, num_workers, idx_paths, max_index_store, mem_budget_mb, ranking_policy, evict, mmap, num_loaders, omp_threads):
+    '''
+    Worker process: serve ("search", ...) messages on conn until ("stop",)
+    '''
+    faiss.omp_set_num_threads(omp_threads)
+    index_manager = IndexManager(policy=ranking_policy, capacity=max_index_store)
+    index_store = IndexStore(max_indexes=max_index_store, index_manager=index_manager, mmap=mmap,
+                             mem_budget_mb=mem_budget_mb, evict_policy=evict)
+    # the policy holds what the budget fits of the shards this worker owns
+    index_manager.set_capacity(index_store.policy_capacity(idx_paths[worker_id::num_workers]))
+    index_loader = ThreadDataLoaderPool(index_store, idx_paths, num_loaders=num_loaders)
+    index_store.set_index_loader(index_loader)
+    index_loader.start()
+
+    # the coordinator reuses its arena across batches, attach once per arena
+    arena = None
+    while True:
+        message = conn.recv()
+        if message[0] == "stop":
+            break
+        if message[0] == "invalidate":
+            # shard files replaced by a new version (utils/shard_updater.py)
+            for idx_path in message[1]:
+                index_store.invalidate(idx_path)
+            conn.send(("ok",))
+            continue
+
+        _, layout, num_queries, ids, offsets, indices, k = message
+        queries = out = None
+        try:
+            if arena is None or arena.name != layout["name"]:
+                if arena is not None:
+                    arena.close()
+                arena = SharedArena.attach(layout)
+            queries = arena["queries"][:num_queries]
+            # this worker's slab of the final D/I/file_idx matrices
+            out = tuple(arena[name][:num_queries, worker_id] for name in ["D", "I", "file_idx"])
+
+            rstopology = SearchPlan(ids, offsets, indices)
+            shard_paths = [idx_paths[idx] for idx in rstopology.keys()]
+            index_loader.pause_loading()
+            index_loader.update_files_to_load(shard_paths)
+            index_store.set_search_plan(shard_paths)
+            index_loader.resume_loading()
+            search_outterloop_index_async(rstopology, queries, k, k, idx_paths, index_store, out=out)
+            conn.send(("ok",))
+        except Exception as e:
+            conn.send(("error", repr(e)))
+        finally:
+            # drop the views, the arena can only be closed without them
+            queries = out = None
+
+        # warm the store for the next batch with this worker's hot shards
+        index_loader.pause_loading()
+        index_loader.update_files_to_load(index_manager.get_head_index(k=max_index_store))
+        index_loader.resume_loading()
+
+    index_loader.stop_loading()
+    index_loader.join()
+    if arena is not None:
+        arena.close()
+    conn.close()
+
+
+class ShardWorkerPool:
+    '''
+    Coordinator of num_workers shard-owning worker processes
+    '''
+    def __init__(self, idx_paths, num_workers, max_index_store=1000, mem_budget_mb=None, ranking_policy="LFU", evict="rank",
+                 mmap=False, num_loaders=4, omp_threads=1):
+        '''
+        args:
+            - idx_paths: shard index paths, shard id = position
+            - num_workers: worker processes, each owns len(idx_paths) / num_workers shards
+            - max_index_store, mem_budget_mb: totals, split evenly across the workers
+            - ranking_policy, evict, mmap: IndexStore / IndexManager settings of every worker
+            - num_loaders, omp_threads: loader threads and faiss OMP threads of every worker
+        '''
+        self.idx_paths = idx_paths
+        self.num_workers = num_workers
+        worker_max_indexes = max(1, max_index_store // num_workers)
+        worker_mem_budget_mb = None if mem_budget_mb is None else mem_budget_mb / num_workers
+
+        # spawn: forking a process that already ran faiss (OpenMP) or started threads can deadlock
+        ctx = multiprocessing.get_context("spawn")
+        self.conns = []
+        self.workers = []
+        # queries and result slabs, grown when a batch does not fit
+        self.arena = None
+        for worker_id in range(num_workers):
+            parent_conn, child_conn = ctx.Pipe()
+            worker = ctx.Process(target=worker_main, daemon=True,
+                                 args=(child_conn, worker_id, num_workers, idx_paths, worker_max_indexes, worker_mem_budget_mb, ranking_policy, evict,
+                                       mmap, num_loaders, omp_threads))
+            worker.start()
+            child_conn.close()
+            self.conns.append(parent_conn)
+            self.workers.append(worker)
+
+    def owner(self, shard_ids):
+        return np.asarray(shard_ids) % self.num_workers
+
+    def search(self, queries, rstopology, k):
+        '''
+        args:
+            - queries: (num_queries, dim) float32
+            - rstopology: index-major SearchPlan of the batch (plan order is kept within each worker)
+            - k: top k results
+        return:
+            - D, I, file_idx: (num_queries, k)
+        '''
+        queries = np.ascontiguousarray(queries, dtype=np.float32)
+        num_queries = queries.shape[0]
+        arena = self.get_arena(num_queries, queries.shape[1], k)
+        arena["queries"][:num_queries] = queries
+        # workers write every row of their slab, idle workers contribute nothing
+        arena["D"][:num_queries] = np.inf
+        arena["I"][:num_queries] = -1
+        arena["file_idx"][:num_queries] = -1
+
+        # scatter: every worker gets the part of the plan it owns
+        owners = self.owner(rstopology.ids)
+        busy = []
+        for w, conn in enumerate(self.conns):
+            positions = np.flatnonzero(owners == w)
+            if len(positions) == 0:
+                continue
+            sub_plan = rstopology.reorder(positions)
+            conn.send(("search", arena.layout(), num_queries, sub_plan.ids, sub_plan.offsets, sub_plan.indices, k))
+            busy.append(conn)
+
+        errors = [reply[1] for reply in [conn.recv() for conn in busy] if reply[0] == "error"]
+        if len(errors) > 0:
+            raise RuntimeError("shard worker failed: {}".format("; ".join(errors)))
+
+        # gather: the slabs of a row are contiguous, merge the num_workers * k candidates of every query at once
+        width = self.num_workers * k
+        results = ResultAccumulator(num_queries, k, buffer_shards=self.num_workers)
+        results.add(np.arange(num_queries), arena["D"][:num_queries].reshape(num_queries, width),
+                    arena["I"][:num_queries].reshape(num_queries, width), arena["file_idx"][:num_queries].reshape(num_queries, width))
+        return results.result()
+
+    def invalidate(self, shard_ids):
+        '''
+        Drop the resident copies of updated shards in their owners, the next search loads the new files
+        '''
+        owners = self.owner(shard_ids)
+        busy = []
+        for w, conn in enumerate(self.conns):
+            idx_paths = [self.idx_paths[idx] for idx, owner in zip(shard_ids, owners) if owner == w]
+            if len(idx_paths) > 0:
+                conn.send(("invalidate", idx_paths))
+                busy.append(conn)
+        for conn in busy:
+            conn.recv()
+
+    def get_arena(self, num_queries, dim, k):
+        specs = {
+            "queries": ((num_queries, dim), np.float32),
+            "D": ((num_queries, self.num_workers, k), np.float32),
+            "I": ((num_queries, self.num_workers, k), np.int64),
+            "file_idx": ((num_queries, self.num_workers, k), np.int64),
+        }
+        if self.arena is None or not self.arena.fits(specs):
+            if self.arena is not None:
+                self.arena.unlink()
+            self.arena = SharedArena.create(specs)
+        return self.arena
+
+    def close(self):
+        for conn in self.conns:
+            conn.send(("stop",))
+        for worker in self.workers:
+            worker.join()
+        if self.arena is not None:
+            self.arena.unlink()
+            self.arena = None
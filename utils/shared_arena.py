@@ -0,0 +1,85 @@
+'''
+Shared-memory arena: several NumPy arrays in one multiprocessing.shared_memory block
+
+The coordinator creates the arena (query matrix, final D/I/file_idx slabs) and sends its layout (a small dict) to the
+workers, who attach and read query rows / write results in place. Arrays never go through pickle.
+'''
+
+from multiprocessing import shared_memory
+
+import numpy as np
+
+ALIGN = 64
+
+
+class SharedArena:
+    '''
+    arena[name] is a view of the shared block, layout() is all a worker needs to attach
+    '''
+    def __init__(self, shm, arrays, owner=False):
+        '''
+        args:
+            - shm: SharedMemory block
+            - arrays: {name: (shape, dtype str, offset)}
+            - owner: the creator unlinks the block (see unlink)
+        '''
+        self.shm = shm
+        self.arrays = arrays
+        self.owner = owner
+        self.views = {name: np.ndarray(shape, dtype=dtype, buffer=shm.buf, offset=offset)
+                      for name, (shape, dtype, offset) in arrays.items()}
+
+    @classmethod
+    def create(cls, specs):
+        '''
+        args:
+            - specs: {name: (shape, dtype)}
+        '''
+        arrays = {}
+        size = 0
+        for name, (shape, dtype) in specs.items():
+            size = (size + ALIGN - 1) // ALIGN * ALIGN
+            dtype = np.dtype(dtype)
+            arrays[name] = (tuple(shape), dtype.str, size)
+            size += int(np.prod(shape, dtype=np.int64)) * dtype.itemsize
+        shm = shared_memory.SharedMemory(create=True, size=max(size, 1))
+        return cls(shm, arrays, owner=True)
+
+    @classmethod
+    def attach(cls, layout):
+        return cls(shared_memory.SharedMemory(name=layout["name"]), layout["arrays"])
+
+    @property
+    def name(self):
+        return self.shm.name
+
+    def layout(self):
+        return {"name": self.shm.name, "arrays": self.arrays}
+
+    def __getitem__(self, name):
+        return self.views[name]
+
+    def __contains__(self, name):
+        return name in self.views
+
+    def fits(self, specs):
+        # every array of specs fits in the arena's array of the same name (leading dim may be smaller)
+        for name, (shape, dtype) in specs.items():
+            if name not in self.arrays:
+                return False
+            arena_shape, arena_dtype, _ = self.arrays[name]
+            if np.dtype(dtype).str != arena_dtype or len(shape) != len(arena_shape):
+                return False
+            if shape[0] > arena_shape[0] or tuple(shape[1:]) != tuple(arena_shape[1:]):
+                return False
+        return True
+
+    def close(self):
+        # views must not be used after close
+        self.views = {}
+        self.shm.close()
+
+    def unlink(self):
+        self.close()
+        if self.owner:
+            self.shm.unlink()
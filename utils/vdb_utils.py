@@ -2,6 +2,9 @@
 This file contains utility functions for VectorDB.
 '''
 
+import os
+import re
+
 import faiss
 import numpy as np
 
@@ -17,7 +20,8 @@ def random_mv_normal_vectors(cluster_size, dim, scale=1):
 
 def random_floats(size, low=0, high=1, seed=None):
     if seed is not None: np.random.seed(seed)
-    return [np.random.uniform(low, high) for _ in range(size)]
+    # one vectorized draw, same values as size scalar draws
+    return np.random.uniform(low, high, size)
 
 def random_normal_vectors(num_embeds, dim, mean=0, std=1, seed=None):
     if seed is not None: np.random.seed(seed)
@@ -102,9 +106,82 @@ def random_queries(num_queries, dim, seed=None):
     # queries[:, 0] += np.arange(num_queries) / 1000.
     return queries
 
+def shard_sort_key(file_name):
+    # natural order: embeds_2.index before embeds_10.index
+    return [int(token) if token.isdigit() else token for token in re.split(r"(\d+)", file_name)]
+
+def list_shard_indexes(idx_root):
+    '''
+    Index files of idx_root, shard i is embeds_{i}.index (create_shard_idx.py), i.e. row i of the centroid router
+
+    return:
+        - idx_paths: shard index paths ordered by shard id
+        - centriod_idx_paths: path of the centroid index
+    '''
+    idx_paths = []
+    centriod_idx_paths = ""
+    for f in sorted(os.listdir(idx_root), key=shard_sort_key):
+        if not f.endswith(".index"):
+            continue
+        if "centroid" in f:
+            centriod_idx_paths = os.path.join(idx_root, f)
+        else:
+            idx_paths.append(os.path.join(idx_root, f))
+    return idx_paths, centriod_idx_paths
+
+def load_shard_radii(idx_root):
+    '''
+    Radius of every shard (max L2 distance of its vectors to its centroid), row i is shard i.
+    Written by create_shard_idx.py next to the indexes, None if missing.
+    '''
+    radii_path = os.path.join(idx_root, "embeds_radii.npy")
+    if not os.path.exists(radii_path):
+        return None
+    return np.load(radii_path)
+
 def save_index(index, index_path):
     faiss.write_index(index, index_path)
 
+def read_index(index_path, mmap=False):
+    '''
+    mmap: IVF inverted lists are mapped from the file (faiss OnDiskInvertedLists) instead of copied into RAM,
+    the index is searchable right away and the OS page cache handles residency
+    '''
+    if mmap:
+        return faiss.read_index(index_path, faiss.IO_FLAG_MMAP)
+    return faiss.read_index(index_path)
+
+def index_kind(index):
+    # flat, hnsw or ivf
+    index = faiss.downcast_index(index)
+    if isinstance(index, faiss.IndexHNSW):
+        return "hnsw"
+    try:
+        faiss.extract_index_ivf(index)
+        return "ivf"
+    except RuntimeError:
+        return "flat"
+
+def ivf_lists_nbytes(index):
+    # bytes of codes + ids stored in the inverted lists of an IVF index, 0 for other index types
+    try:
+        ivf = faiss.extract_index_ivf(index)
+    except RuntimeError:
+        return 0
+    invlists = ivf.invlists
+    num_entries = sum(invlists.list_size(i) for i in range(invlists.nlist))
+    return num_entries * (invlists.code_size + 8)
+
+def index_resident_bytes(index, index_path, mmap=False):
+    '''
+    Approximate RAM held by a loaded index (the serialized size is a close upper bound).
+    With mmap, the inverted lists live in the page cache and are not counted.
+    '''
+    nbytes = os.path.getsize(index_path)
+    if mmap:
+        nbytes = max(0, nbytes - ivf_lists_nbytes(index))
+    return nbytes
+
 # @Logger.log_index_load_time
 # def load_index(index_path):
 #     # NOT used now, function integrated in the IndexStore class
@@ -40,7 +40,27 @@ def parse_func_name(func_name_str):
 def parse_latency(time_str):
     return float(time_str[:-1])
 
-def create_gantt_chart(load_index_hbars, search_index_hbars, figsize=(6, 1), ax=None, vline=True):
+def merge_hbars(hbars):
+    # [(x, length), ...] => sorted, non-overlapping [(start, end), ...]
+    merged = []
+    for start, length in sorted(hbars):
+        end = start + length
+        if len(merged) > 0 and start <= merged[-1][1]:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+    return merged
+
+def overlap_time(hbars, other_hbars):
+    # total time of hbars that overlaps with any of other_hbars
+    others = merge_hbars(other_hbars)
+    total = 0.
+    for start, end in merge_hbars(hbars):
+        for other_start, other_end in others:
+            total += max(0., min(end, other_end) - max(start, other_start))
+    return total
+
+def create_gantt_chart(load_index_hbars, search_index_hbars, figsize=(6, 1), ax=None, vline=True, route_hbars=None):
     return_ax = False
     if ax is None:
         fig, ax = plt.subplots(figsize=figsize)
@@ -52,7 +72,14 @@ def create_gantt_chart(load_index_hbars, search_index_hbars, figsize=(6, 1), ax=
     ax.broken_barh(load_index_hbars[:], (1, bar_width), facecolors =('darkorange'))
     ax.broken_barh(search_index_hbars[:], (1+bar_width+bar_gap, bar_width), facecolors =('green'))
 
-    ax.set_yticks([1+bar_width/2, 1+bar_width+bar_gap+bar_width/2], ['load', 'search'])
+    yticks = [1+bar_width/2, 1+bar_width+bar_gap+bar_width/2]
+    ylabels = ['load', 'search']
+    if route_hbars:
+        # centroid routing of the query batches, overlaps with search when routing ahead (squery_shard_idx.py --lookahead)
+        ax.broken_barh(route_hbars[:], (1+2*(bar_width+bar_gap), bar_width), facecolors =('steelblue'))
+        yticks.append(1+2*(bar_width+bar_gap)+bar_width/2)
+        ylabels.append('route')
+    ax.set_yticks(yticks, ylabels)
     # ax.grid(True, alpha=0.5)
 
     if vline:
@@ -81,10 +108,25 @@ if __name__ == "__main__":
     search_index_hbars = []
     for i, row in df[df["action"] == "load_index"].iterrows():
         load_index_hbars.append((row["start_time"], row["latency"]))
+    route_hbars = []
     for i, row in df[df["action"] == "query_index"].iterrows():
         search_index_hbars.append((row["start_time"], row["latency"]))
-
-    fig, ax = create_gantt_chart(load_index_hbars, search_index_hbars, ax=None)
+    for i, row in df[df["action"] == "route"].iterrows():
+        route_hbars.append((row["start_time"], row["latency"]))
+
+    # overlap with shard search, the centroid search is part of routing
+    shard_search_hbars = [(row["start_time"], row["latency"]) for i, row in df[df["action"] == "query_index"].iterrows() 
+                          if "centroid" not in str(row["file_path"])]
+    if len(route_hbars) > 0:
+        route_time = sum(length for _, length in route_hbars)
+        route_overlap = overlap_time(route_hbars, shard_search_hbars)
+        print(f"route: {route_time:.5f}s; overlapped with search: {route_overlap:.5f}s ({100 * route_overlap / route_time:.1f}%)")
+    if len(load_index_hbars) > 0:
+        load_time = sum(length for _, length in merge_hbars(load_index_hbars))
+        load_overlap = overlap_time(load_index_hbars, shard_search_hbars)
+        print(f"load: {load_time:.5f}s; overlapped with search: {load_overlap:.5f}s ({100 * load_overlap / load_time:.1f}%)")
+
+    fig, ax = create_gantt_chart(load_index_hbars, search_index_hbars, ax=None, route_hbars=route_hbars)
     ax.set_title(log_file)
     fig.tight_layout()
     fig.savefig("vislogs_tmp.pdf")